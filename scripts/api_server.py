@@ -1,18 +1,116 @@
-from fastapi import FastAPI, Query
-from scripts.utils.bd_oracle_connection import get_oracle_connection
+from fastapi import FastAPI, Header, Query, Request
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, Response
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from scripts.utils.bd_oracle_connection import acquire, get_oracle_connection, reserve_pool_sessions
 from scripts.utils.logger import logger
-from typing import List, Dict, Optional
+from scripts.utils.correlation import correlation_pairs
+from scripts.utils.price_loader import load_daily_close_panel
+from scripts.utils.response_cache import ResponseCache
+from typing import List, Dict, NamedTuple, Optional
 from datetime import datetime, timedelta
+import asyncio
+import functools
+import multiprocessing
+import os
 import pandas as pd
 
 app = FastAPI()
 
+class CachedBody(NamedTuple):
+    """Corps déjà encodé d'une réponse en cache (une Response est modifiée par les middlewares, pas partageable)."""
+    body: bytes
+    status_code: int
+    media_type: str
+
+def freeze_response(value):
+    if isinstance(value, Response):
+        return CachedBody(value.body, value.status_code, value.media_type)
+    return value
+
+def thaw_response(value):
+    if isinstance(value, CachedBody):
+        return Response(content=value.body, status_code=value.status_code, media_type=value.media_type)
+    return value
+
+# Cache de réponses : Grafana interroge ces endpoints toutes les quelques secondes,
+# alors que les prix ne changent qu'une fois par heure (crypto) ou par jour (EODHD)
+response_cache = ResponseCache(
+    max_entries=int(os.getenv("API_CACHE_MAX_ENTRIES", "256")), freeze=freeze_response, thaw=thaw_response
+)
+CACHE_TTL = {
+    "system-metrics": 15,
+    "positions": 300,
+    "correlation_matrix": 600,
+    "portfolio_summary": 60
+}
+CORRELATION_METHODS = ("pearson", "spearman")
+# POST /api/cache/invalidate : appels locaux, ou jeton X-Cache-Token si API_CACHE_TOKEN est défini
+CACHE_ADMIN_TOKEN = os.getenv("API_CACHE_TOKEN")
+LOCAL_HOSTS = ("127.0.0.1", "::1", "localhost")
+
+# Exécuteurs bornés par classe d'endpoint : une corrélation lente n'occupe pas les threads des panneaux système.
+EXECUTOR_SIZES = {
+    "metrics": int(os.getenv("API_METRICS_WORKERS", "4")),
+    "prices": int(os.getenv("API_PRICES_WORKERS", "4")),
+    "analytics": int(os.getenv("API_ANALYTICS_WORKERS", "2"))
+}
+# Une session Oracle par thread d'exécuteur, plus une pour la relecture des watermarks : les classes ne se
+# disputent jamais le pool (ORACLE_POOL_MAX ne s'applique que s'il est plus grand)
+ORACLE_POOL_SIZE = reserve_pool_sessions(sum(EXECUTOR_SIZES.values()) + 1)
+executors = {
+    name: ThreadPoolExecutor(max_workers=size, thread_name_prefix=f"api-{name}")
+    for name, size in EXECUTOR_SIZES.items()
+}
+# Calculs pandas lourds (corrélation) dans un pool de process, au-delà de cette taille de matrice
+CORRELATION_PROCESS_MIN_CELLS = int(os.getenv("API_CORRELATION_PROCESS_MIN_CELLS", "50000"))
+_process_pool = None
+
+def get_process_pool():
+    global _process_pool
+    if _process_pool is None:
+        # spawn : pas de fork d'un process multi-threadé qui détient des sessions Oracle
+        _process_pool = ProcessPoolExecutor(
+            max_workers=int(os.getenv("API_PROCESS_WORKERS", "2")),
+            mp_context=multiprocessing.get_context("spawn")
+        )
+    return _process_pool
+
+async def run_blocking(executor_name, func, *args):
+    """Exécute une fonction bloquante (I/O cx_Oracle, pandas) dans l'exécuteur de sa classe d'endpoint."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executors[executor_name], functools.partial(func, *args))
+
+def render_json(value):
+    """
+    Sérialise la réponse hors de la boucle d'événements (des milliers de lignes de /api/positions
+    bloqueraient sinon tous les autres endpoints). Les erreurs restent des dicts, jamais mis en cache.
+    """
+    if isinstance(value, dict) and "error" in value:
+        return value
+    return JSONResponse(jsonable_encoder(value))
+
+def respond(func, *args):
+    return render_json(func(*args))
+
+@app.on_event("shutdown")
+def shutdown_executors():
+    for executor in executors.values():
+        executor.shutdown(wait=False)
+    if _process_pool is not None:
+        _process_pool.shutdown(wait=False)
+
 # Endpoint /api/system-metrics
 @app.get("/api/system-metrics")
-def get_system_metrics(
+# Métriques insérées chaque minute sans watermark : seul le TTL court les rafraîchit
+@response_cache.cached("system-metrics", ttl=CACHE_TTL["system-metrics"], sources=())
+async def get_system_metrics(
     start: str = Query(None, description="Start date YYYY-MM-DD HH:MM:SS"),
     end: str = Query(None, description="End date YYYY-MM-DD HH:MM:SS")
 ):
+    return await run_blocking("metrics", respond, query_system_metrics, start, end)
+
+def query_system_metrics(start, end):
     try:
         conn = get_oracle_connection()
         if not conn:
@@ -70,10 +168,14 @@ def get_system_metrics(
         return {"error": str(e)}
 
 @app.get("/api/positions")
-def get_positions(
+@response_cache.cached("positions", ttl=CACHE_TTL["positions"], sources=("prices",))
+async def get_positions(
     start: str = Query(None, description="Start date YYYY-MM-DD"),
     end: str = Query(None, description="End date YYYY-MM-DD")
 ):
+    return await run_blocking("prices", respond, query_positions, start, end)
+
+def query_positions(start, end):
     try:
         conn = get_oracle_connection()
         if not conn:
@@ -88,31 +190,24 @@ def get_positions(
         end_dt = datetime.strptime(end_date, '%Y-%m-%d').date()
         if (end_dt - start_dt).days > int(365*max_years):
             start_dt = end_dt - timedelta(days=int(365*max_years))
-        # Requête : un point par ticker/jour, pour la crypto uniquement la dernière observation du jour
+        # Requête : un point par ticker/jour lu dans l'agrégat prices_daily
+        # (dernière observation du jour, la seule qui porte les indicateurs pour la crypto)
         query = '''
-SELECT * FROM (
-        SELECT
-            a.asset_name,
-            a.ticker,
-            p.price_date,
-            p.close_value,
-            p.rsi,
-            p.ma52,
-            p.ma104,
-            LAG(p.close_value) OVER (PARTITION BY a.ticker ORDER BY p.price_date) AS prev_close_value,
-            (p.close_value - LAG(p.close_value) OVER (PARTITION BY a.ticker ORDER BY p.price_date)) / NULLIF(LAG(p.close_value) OVER (PARTITION BY a.ticker ORDER BY p.price_date), 0) AS evolution_prix,
-            a.asset_type,
-            ROW_NUMBER() OVER (
-                PARTITION BY a.asset_type, a.asset_id, TRUNC(p.price_date)
-                ORDER BY p.price_date DESC
-            ) as rn
-        FROM assets a
-        JOIN prices p ON a.asset_id = p.asset_id
-        WHERE p.price_date >= TO_DATE(:start_dt, 'YYYY-MM-DD')
-            AND p.price_date <= TO_DATE(:end_dt, 'YYYY-MM-DD')
-)
-WHERE (asset_type = 'CRYPTO' AND rn = 1)
-     OR (asset_type <> 'CRYPTO')
+SELECT
+    a.asset_name,
+    a.ticker,
+    d.last_price_date AS price_date,
+    d.close_value,
+    p.rsi,
+    p.ma52,
+    p.ma104,
+    LAG(d.close_value) OVER (PARTITION BY a.ticker ORDER BY d.price_day) AS prev_close_value,
+    (d.close_value - LAG(d.close_value) OVER (PARTITION BY a.ticker ORDER BY d.price_day)) / NULLIF(LAG(d.close_value) OVER (PARTITION BY a.ticker ORDER BY d.price_day), 0) AS evolution_prix
+FROM assets a
+JOIN prices_daily d ON d.asset_id = a.asset_id
+JOIN prices p ON p.price_id = d.last_price_id
+WHERE d.price_day >= TO_DATE(:start_dt, 'YYYY-MM-DD')
+    AND d.price_day <= TO_DATE(:end_dt, 'YYYY-MM-DD')
 ORDER BY ticker, price_date
         '''
         cur.execute(query, {"start_dt": start_dt.strftime('%Y-%m-%d'), "end_dt": end_dt.strftime('%Y-%m-%d')})
@@ -134,142 +229,120 @@ ORDER BY ticker, price_date
         return {"error": str(e)}
 
 @app.get("/api/correlation_matrix")
-def correlation_matrix(discord_user: str = Query(..., description="Utilisateur Discord")):
+@response_cache.cached("correlation_matrix", ttl=CACHE_TTL["correlation_matrix"], sources=("prices", "transactions"))
+async def correlation_matrix(
+    discord_user: str = Query(..., description="Utilisateur Discord"),
+    window: Optional[int] = Query(None, ge=2, description="Nombre de jours d'historique (tout l'historique par défaut)"),
+    method: str = Query("pearson", description="pearson ou spearman")
+):
     """
-    Retourne la matrice de corrélation des actifs détenus (qte>0) pour un utilisateur Discord.
+    Retourne la matrice de corrélation des rendements journaliers des actifs détenus (qte>0)
+    pour un utilisateur Discord.
     """
+    if method not in CORRELATION_METHODS:
+        return {"error": f"Méthode inconnue : {method} (attendu : {', '.join(CORRELATION_METHODS)})"}
+    loaded = await run_blocking("analytics", load_correlation_prices, discord_user, window)
+    if isinstance(loaded, dict):
+        return loaded
+    prices, labels = loaded
     try:
-        conn = get_oracle_connection()
-        if not conn:
-            return {"error": "Connexion Oracle impossible"}
-        # Récupérer la liste des actifs détenus (qte>0)
-        query_assets = '''
-            SELECT uw.asset_id, uw.asset_name, uw.asset_type, uw.ticker
-            FROM user_watchlist uw
-            WHERE uw.discord_user = :discord_user AND NVL(uw.qte,0) > 0
-        '''
-        assets = pd.read_sql(query_assets, conn, params={"discord_user": discord_user})
-        assets.columns = [c.lower() for c in assets.columns]
-        if assets.empty:
-            return {"error": "Aucun actif trouvé pour cet utilisateur"}
-        # Pour chaque actif, récupérer la série de prix (close_value ou daily max pour crypto)
-        price_dfs = []
-        for _, row in assets.iterrows():
-            if row['asset_type'] == 'CRYPTO':
-                query_price = f'''
-                    SELECT TRUNC(price_date) as price_date, MAX(close_value) as close_value
-                    FROM prices
-                    WHERE asset_id = {row['asset_id']} AND close_value IS NOT NULL
-                    GROUP BY TRUNC(price_date)
-                    ORDER BY TRUNC(price_date)
-                '''
-            else:
-                query_price = f'''
-                    SELECT price_date, close_value
-                    FROM prices
-                    WHERE asset_id = {row['asset_id']} AND close_value IS NOT NULL
-                    ORDER BY price_date
-                '''
-            df = pd.read_sql(query_price, conn)
-            if not df.empty:
-                df.columns = [c.lower() for c in df.columns]
-                df = df.rename(columns={"close_value": row['asset_name']})
-                df['price_date'] = pd.to_datetime(df['price_date'])
-                df = df.set_index('price_date')
-                price_dfs.append(df[[row['asset_name']]])
-        conn.close()
-        if not price_dfs:
+        # Corrélation des rendements alignés par date, NaN gérés paire par paire
+        if prices.size >= CORRELATION_PROCESS_MIN_CELLS:
+            loop = asyncio.get_running_loop()
+            result = await loop.run_in_executor(get_process_pool(), correlation_pairs, prices, labels, method)
+            return await run_blocking("analytics", render_json, result)
+        return await run_blocking("analytics", respond, correlation_pairs, prices, labels, method)
+    except Exception as e:
+        logger.error(f"[correlation_matrix] Erreur: {e}")
+        return {"error": str(e)}
+
+def load_correlation_prices(discord_user, window):
+    """Charge la matrice jours × actifs des actifs détenus. Retourne (prix, libellés) ou un dict d'erreur."""
+    try:
+        with acquire() as conn:
+            # Récupérer la liste des actifs détenus (qte>0)
+            cur = conn.cursor()
+            cur.execute('''
+                SELECT uw.asset_id, uw.asset_name
+                FROM user_watchlist uw
+                WHERE uw.discord_user = :discord_user AND NVL(uw.qte,0) > 0 AND uw.asset_id IS NOT NULL
+            ''', {"discord_user": discord_user})
+            names = {int(asset_id): asset_name for asset_id, asset_name in cur.fetchall()}
+            cur.close()
+            if not names:
+                return {"error": "Aucun actif trouvé pour cet utilisateur"}
+            # Une seule requête pour tous les actifs (cryptos : max journalier), pivotée en matrice jours × actifs
+            days, asset_ids, prices = load_daily_close_panel(list(names), window_days=window, conn=conn)
+        if len(days) == 0:
             return {"error": "Aucune donnée de prix trouvée pour les actifs de cet utilisateur"}
-        # Fusionner toutes les séries sur la date
-        prices = pd.concat(price_dfs, axis=1, join='outer').sort_index()
-        # Calculer la matrice de corrélation (corrélation de Pearson)
-        corr_matrix = prices.corr().round(3)
-        # Pour Grafana, retourner sous forme de liste de dicts (source, target, value)
-        result = []
-        for col in corr_matrix.columns:
-            for idx in corr_matrix.index:
-                if col != idx:
-                    result.append({"source": col, "target": idx, "value": corr_matrix.loc[idx, col]})
-        return result
+        return prices, [names[a] for a in asset_ids]
     except Exception as e:
         logger.error(f"[correlation_matrix] Erreur: {e}")
         return {"error": str(e)}
     
 from scripts.compute_positions import compute_positions
+from scripts.utils.latest_prices import load_latest_prices
 
 @app.get("/api/portfolio_summary")
-def portfolio_summary(discord_user: str = Query(..., description="Utilisateur Discord")):
+@response_cache.cached("portfolio_summary", ttl=CACHE_TTL["portfolio_summary"], sources=("prices", "transactions"))
+async def portfolio_summary(discord_user: str = Query(..., description="Utilisateur Discord")):
     """Retourne un résumé du portefeuille: valeur totale, P&L journalier, positions et cashflow mensuel."""
-    try:
-        conn = get_oracle_connection()
-        if not conn:
-            return {"error": "Connexion Oracle impossible"}
+    return await run_blocking("prices", respond, query_portfolio_summary, discord_user)
 
-        # 1) calculer positions courantes via compute_positions (utilise user_transactions)
-        positions_df = compute_positions(discord_user)
-        if positions_df.empty:
-            return {"total_value": 0, "pnl_today": 0, "positions": [], "cashflow_month": []}
-
-        # conserver les positions non nulles
-        positions_df = positions_df[positions_df['QTE_COURANTE'] != 0]
+def query_portfolio_summary(discord_user):
+    try:
+        # Une seule connexion du pool pour les positions, les prix et le cashflow
+        with acquire() as conn:
+            # 1) calculer positions courantes via compute_positions (utilise user_transactions)
+            positions_df = compute_positions(discord_user, conn=conn)
+            if positions_df.empty:
+                return {"total_value": 0, "pnl_today": 0, "positions": [], "cashflow_month": []}
 
-        cur = conn.cursor()
-        total_value = 0.0
-        pnl_today = 0.0
-        positions_out = []
+            # conserver les positions non nulles
+            positions_df = positions_df[positions_df['QTE_COURANTE'] != 0]
 
-        for _, r in positions_df.iterrows():
-            ticker = r['TICKER']
-            qte = float(r['QTE_COURANTE'])
-            # retrouver asset_id et asset_name
-            cur.execute("SELECT asset_id, asset_name FROM assets WHERE ticker = :t FETCH FIRST 1 ROWS ONLY", {"t": ticker})
-            row = cur.fetchone()
-            if not row:
-                continue
-            asset_id = row[0]
-            asset_name = row[1]
+            # 2) asset_id, dernière et avant-dernière clôture de toutes les positions en une requête
+            latest = load_latest_prices(positions_df['TICKER'].tolist(), conn)
 
-            # récupérer les 2 dernières closes
-            cur.execute("""
-                SELECT close_value, price_date FROM prices
-                WHERE asset_id = :aid AND close_value IS NOT NULL
-                ORDER BY price_date DESC FETCH FIRST 2 ROWS ONLY
-            """, {"aid": asset_id})
-            price_rows = cur.fetchall()
-            if not price_rows:
-                last_price = None
-                prev_price = None
-            else:
-                last_price = float(price_rows[0][0]) if price_rows[0][0] is not None else None
-                prev_price = float(price_rows[1][0]) if len(price_rows) > 1 and price_rows[1][0] is not None else last_price
+            total_value = 0.0
+            pnl_today = 0.0
+            positions_out = []
 
-            value = qte * (last_price or 0)
-            total_value += value
-            pnl_today += qte * ((last_price or 0) - (prev_price or 0))
+            for _, r in positions_df.iterrows():
+                ticker = r['TICKER']
+                qte = float(r['QTE_COURANTE'])
+                if ticker not in latest:
+                    continue
+                asset_id, asset_name, last_close, prev_close = latest[ticker]
+                last_price = float(last_close) if last_close is not None else None
+                prev_price = float(prev_close) if prev_close is not None else last_price
 
-            positions_out.append({
-                "ticker": ticker,
-                "asset_id": asset_id,
-                "asset_name": asset_name,
-                "qte": qte,
-                "last_price": last_price,
-                "value": value
-            })
+                value = qte * (last_price or 0)
+                total_value += value
+                pnl_today += qte * ((last_price or 0) - (prev_price or 0))
 
-        # cashflow mensuel (achat = négatif, vente = positif)
-        cur.execute("""
-            SELECT TO_CHAR(dt, 'YYYY-MM') as mon,
-                   SUM(CASE WHEN UPPER(NVL(type_mvt,'')) LIKE 'V%' THEN NVL(prix,0)*NVL(qte,0) ELSE -NVL(prix,0)*NVL(qte,0) END) as cash
-            FROM user_transactions
-            WHERE discord_user = :u
-            GROUP BY TO_CHAR(dt, 'YYYY-MM')
-            ORDER BY mon DESC
-        """, {"u": discord_user})
-        cash_rows = cur.fetchall()
-        cashflow_month = [{"month": r[0], "cashflow": float(r[1] or 0)} for r in cash_rows]
+                positions_out.append({
+                    "ticker": ticker,
+                    "asset_id": asset_id,
+                    "asset_name": asset_name,
+                    "qte": qte,
+                    "last_price": last_price,
+                    "value": value
+                })
 
-        cur.close()
-        conn.close()
+            # cashflow mensuel (achat = négatif, vente = positif)
+            cur = conn.cursor()
+            cur.execute("""
+                SELECT TO_CHAR(dt, 'YYYY-MM') as mon,
+                       SUM(CASE WHEN UPPER(NVL(type_mvt,'')) LIKE 'V%' THEN NVL(prix,0)*NVL(qte,0) ELSE -NVL(prix,0)*NVL(qte,0) END) as cash
+                FROM user_transactions
+                WHERE discord_user = :u
+                GROUP BY TO_CHAR(dt, 'YYYY-MM')
+                ORDER BY mon DESC
+            """, {"u": discord_user})
+            cash_rows = cur.fetchall()
+            cashflow_month = [{"month": r[0], "cashflow": float(r[1] or 0)} for r in cash_rows]
+            cur.close()
 
         return {
             "total_value": total_value,
@@ -279,4 +352,22 @@ def portfolio_summary(discord_user: str = Query(..., description="Utilisateur Di
         }
     except Exception as e:
         logger.error(f"[portfolio_summary] Erreur: {e}")
-        return {"error": str(e)}
\ No newline at end of file
+        return {"error": str(e)}
+
+@app.post("/api/cache/invalidate")
+async def cache_invalidate(
+    request: Request,
+    endpoint: Optional[str] = Query(None, description="Endpoint à vider (tous par défaut)"),
+    x_cache_token: Optional[str] = Header(None)
+):
+    """Vide le cache de réponses (appelé par les jobs d'extraction ou à la main), depuis la machine ou avec le jeton."""
+    local = request.client is not None and request.client.host in LOCAL_HOSTS
+    if not local and not (CACHE_ADMIN_TOKEN and x_cache_token == CACHE_ADMIN_TOKEN):
+        logger.warning(f"⛔ Invalidation du cache refusée pour {request.client.host if request.client else '?'}")
+        return JSONResponse({"error": "forbidden"}, status_code=403)
+    return {"invalidated": response_cache.invalidate(endpoint)}
+
+@app.get("/api/cache/stats")
+async def cache_stats():
+    """Compteurs hits / misses du cache de réponses, par endpoint."""
+    return response_cache.stats()
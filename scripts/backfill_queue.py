@@ -0,0 +1,360 @@
+import argparse
+import json
+import os
+import sqlite3
+import threading
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from scripts.utils.logger import logger
+from scripts.utils.prices_upsert import upsert_prices
+from scripts.utils.candles import CandleBatch
+from scripts.utils.eodhd_client import EodhdFetcher
+
+# File persistante des backfills historiques (SQLite local, survit aux redémarrages)
+QUEUE_DB = Path(os.getenv("BACKFILL_QUEUE_DB", str(Path.home() / "market-watcher/data/backfill_queue.sqlite")))
+
+# Backfills simultanés maximum par fournisseur (crédits / limites de débit)
+PROVIDER_LIMITS = {"eodhd": 2, "coinbase": 3}
+MAX_ATTEMPTS = 3
+EODHD_YEARS = 10
+# Fenêtre d'un appel EODHD : un checkpoint après chaque fenêtre
+EODHD_CHUNK_DAYS = 365
+COINBASE_YEARS = 5
+COINBASE_CHUNK_DAYS = 365
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS jobs (
+        job_id      INTEGER PRIMARY KEY AUTOINCREMENT,
+        asset_id    INTEGER NOT NULL,
+        ticker      TEXT NOT NULL,
+        asset_type  TEXT,
+        provider    TEXT NOT NULL,
+        status      TEXT NOT NULL DEFAULT 'pending',
+        attempts    INTEGER NOT NULL DEFAULT 0,
+        checkpoint  TEXT,
+        rows        INTEGER NOT NULL DEFAULT 0,
+        error       TEXT,
+        created_at  TEXT NOT NULL,
+        updated_at  TEXT NOT NULL
+    );
+    CREATE UNIQUE INDEX IF NOT EXISTS jobs_active_asset ON jobs(asset_id) WHERE status IN ('pending', 'running');
+"""
+
+def provider_for(asset_type):
+    if asset_type and asset_type.upper() == "CRYPTO":
+        return "coinbase"
+    if asset_type and asset_type.upper() in ("STOCK", "ETF"):
+        return "eodhd"
+    return None
+
+class BackfillQueue:
+    """
+    File de jobs de backfill (statuts pending / running / done / failed).
+    Une connexion SQLite partagée, sérialisée par un verrou : les workers sont des threads du même process.
+    """
+
+    def __init__(self, path=QUEUE_DB):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(str(path), check_same_thread=False, timeout=30)
+        self.conn.row_factory = sqlite3.Row
+        self.lock = threading.Lock()
+        with self.lock:
+            self.conn.executescript(SCHEMA)
+
+    def _now(self):
+        return datetime.now().isoformat(timespec="seconds")
+
+    def enqueue(self, asset_id, ticker, asset_type):
+        """Ajoute un backfill (ignoré si l'actif a déjà un job en attente ou en cours). Retourne True si ajouté."""
+        provider = provider_for(asset_type)
+        if provider is None:
+            logger.warning(f"⚠️ Pas de fournisseur de backfill pour {ticker} (type {asset_type})")
+            return False
+        with self.lock, self.conn:
+            cur = self.conn.execute(
+                "INSERT OR IGNORE INTO jobs (asset_id, ticker, asset_type, provider, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (int(asset_id), ticker, asset_type, provider, self._now(), self._now())
+            )
+        if cur.rowcount:
+            logger.info(f"📥 Backfill {provider} en file pour {ticker} (asset_id={asset_id})")
+        return bool(cur.rowcount)
+
+    def reset_running(self):
+        """Au démarrage : les jobs 'running' d'un process interrompu repassent en attente (reprise au checkpoint)."""
+        with self.lock, self.conn:
+            cur = self.conn.execute(
+                "UPDATE jobs SET status = 'pending', updated_at = ? WHERE status = 'running'", (self._now(),)
+            )
+        if cur.rowcount:
+            logger.info(f"♻️ {cur.rowcount} backfills interrompus remis en attente")
+        return cur.rowcount
+
+    def claim(self, provider):
+        """Prend le plus ancien job en attente du fournisseur. Retourne le job (dict) ou None."""
+        with self.lock, self.conn:
+            row = self.conn.execute(
+                "SELECT * FROM jobs WHERE status = 'pending' AND provider = ? ORDER BY job_id LIMIT 1", (provider,)
+            ).fetchone()
+            if row is None:
+                return None
+            self.conn.execute(
+                "UPDATE jobs SET status = 'running', attempts = attempts + 1, updated_at = ? WHERE job_id = ?",
+                (self._now(), row["job_id"])
+            )
+        job = dict(row)
+        job["attempts"] += 1
+        job["checkpoint"] = json.loads(job["checkpoint"]) if job["checkpoint"] else None
+        return job
+
+    def save_checkpoint(self, job_id, checkpoint, rows):
+        with self.lock, self.conn:
+            self.conn.execute(
+                "UPDATE jobs SET checkpoint = ?, rows = rows + ?, updated_at = ? WHERE job_id = ?",
+                (json.dumps(checkpoint), rows, self._now(), job_id)
+            )
+
+    def finish(self, job_id):
+        with self.lock, self.conn:
+            self.conn.execute(
+                "UPDATE jobs SET status = 'done', error = NULL, updated_at = ? WHERE job_id = ?", (self._now(), job_id)
+            )
+
+    def fail(self, job, error):
+        """Échec : nouvel essai (depuis le checkpoint) tant que MAX_ATTEMPTS n'est pas atteint."""
+        status = "failed" if job["attempts"] >= MAX_ATTEMPTS else "pending"
+        with self.lock, self.conn:
+            self.conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, updated_at = ? WHERE job_id = ?",
+                (status, str(error)[:1000], self._now(), job["job_id"])
+            )
+        return status
+
+    def retry_failed(self):
+        with self.lock, self.conn:
+            cur = self.conn.execute(
+                "UPDATE jobs SET status = 'pending', attempts = 0, updated_at = ? WHERE status = 'failed'", (self._now(),)
+            )
+        return cur.rowcount
+
+    def jobs(self, statuses=("pending", "running", "failed")):
+        placeholders = ", ".join("?" for _ in statuses)
+        with self.lock:
+            rows = self.conn.execute(
+                f"SELECT * FROM jobs WHERE status IN ({placeholders}) ORDER BY status, job_id", tuple(statuses)
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def counts(self):
+        with self.lock:
+            rows = self.conn.execute("SELECT provider, status, COUNT(*) FROM jobs GROUP BY provider, status").fetchall()
+        return {(provider, status): n for provider, status, n in rows}
+
+def publish_backfill(asset_id):
+    """
+    Après un backfill : les états incrémentaux et le cache de prix de l'actif sont périmés (historique
+    ajouté avant leur point de départ), l'instantané latest_prices et les réponses API aussi.
+    """
+    from scripts.utils.indicator_engine import invalidate_states
+    from scripts.utils.price_cache import invalidate_cache
+    from scripts.utils.latest_prices import refresh_latest_prices
+    from scripts.utils.response_cache import bump_watermark
+    invalidate_states([asset_id])
+    invalidate_cache([asset_id])
+    refresh_latest_prices(asset_ids=[asset_id])
+    bump_watermark("prices")
+
+def backfill_eodhd(job, checkpoint, fetcher=None):
+    """
+    Historique EODHD par fenêtres de EODHD_CHUNK_DAYS jours, du plus ancien au plus récent.
+    Le checkpoint {"next": "YYYY-MM-DD"} est enregistré après l'upsert de chaque fenêtre.
+    """
+    from scripts.extraction_eodhd_ import SOURCE_EODHD
+    from scripts.extraction_eodhd_hist import update_asset_dates, update_asset_status
+    fetcher = fetcher or EodhdFetcher()
+    today = date.today()
+    start = today - timedelta(days=EODHD_YEARS * 365)
+    if job["checkpoint"]:
+        start = date.fromisoformat(job["checkpoint"]["next"])
+    total = job["rows"]
+    while start <= today:
+        end = min(start + timedelta(days=EODHD_CHUNK_DAYS - 1), today)
+        data, size = fetcher.eod(job["ticker"], from_date=start, to_date=end)
+        rows = CandleBatch.from_eod(data or [], asset_id=job["asset_id"])
+        if rows:
+            upsert_prices(rows, SOURCE_EODHD, label=f"{job['ticker']} {start} → {end}")
+        start = end + timedelta(days=1)
+        checkpoint({"next": start.isoformat()}, len(rows))
+        total += len(rows)
+    if not total:
+        update_asset_status(job["asset_id"], "ERROR")
+        raise RuntimeError(f"Aucune barre EODHD pour {job['ticker']}")
+    update_asset_dates(job["asset_id"])
+    publish_backfill(job["asset_id"])
+
+def backfill_coinbase(job, checkpoint, workers=8):
+    """
+    Historique 1h Coinbase par fenêtres de COINBASE_CHUNK_DAYS jours, du plus récent au plus ancien
+    (fenêtres de 300 bougies téléchargées en parallèle). Le checkpoint {"before": ISO} est enregistré
+    après l'upsert de chaque fenêtre ; une fenêtre vide signifie que la paire n'était pas encore cotée.
+    """
+    import pytz
+    from scripts.extraction_coinbase_histo_ import fetch_coinbase_history, insert_prices
+    from scripts.extraction_eodhd_hist import update_asset_dates, update_asset_status
+    paris = pytz.timezone("Europe/Paris")
+    now = datetime.now(paris)
+    oldest = now - timedelta(days=COINBASE_YEARS * 365)
+    end = now
+    if job["checkpoint"]:
+        end = datetime.fromisoformat(job["checkpoint"]["before"])
+    total = job["rows"]
+    while end > oldest:
+        start = max(end - timedelta(days=COINBASE_CHUNK_DAYS), oldest)
+        candles = fetch_coinbase_history(job["ticker"], start, end, workers=workers)
+        if len(candles):
+            insert_prices(job["asset_id"], job["ticker"], candles)
+        # Fin exclusive de la fenêtre suivante : une seconde avant le début de celle-ci
+        checkpoint({"before": (start - timedelta(seconds=1)).isoformat()}, len(candles))
+        total += len(candles)
+        if not len(candles):
+            break
+        end = start - timedelta(seconds=1)
+    if not total:
+        update_asset_status(job["asset_id"], "ERROR")
+        raise RuntimeError(f"Aucune bougie Coinbase pour {job['ticker']}")
+    update_asset_dates(job["asset_id"])
+    publish_backfill(job["asset_id"])
+
+BACKFILLS = {"eodhd": backfill_eodhd, "coinbase": backfill_coinbase}
+
+class BackfillWorkers:
+    """
+    Pool de threads qui vide la file. Chaque fournisseur a son sémaphore (PROVIDER_LIMITS) :
+    un worker ne prend un job que si le fournisseur a encore une place libre.
+    """
+
+    def __init__(self, queue, workers=4, limits=None, poll_seconds=1.0):
+        self.queue = queue
+        self.workers = workers
+        self.limits = dict(limits or PROVIDER_LIMITS)
+        self.semaphores = {provider: threading.Semaphore(n) for provider, n in self.limits.items()}
+        self.poll_seconds = poll_seconds
+        self.wakeup = threading.Event()
+        self.stop_when_idle = threading.Event()
+        self.threads = []
+        self.stats = {"done": 0, "failed": 0, "retried": 0}
+        self.active = 0
+        self.stats_lock = threading.Lock()
+
+    def start(self):
+        self.queue.reset_running()
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f"backfill-{i}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        return self
+
+    def notify(self):
+        self.wakeup.set()
+
+    def drain(self):
+        """Attend que la file soit vide puis arrête les workers."""
+        self.stop_when_idle.set()
+        self.wakeup.set()
+        for thread in self.threads:
+            thread.join()
+        logger.info(
+            f"✅ Backfills terminés : {self.stats['done']} OK, {self.stats['retried']} à réessayer, "
+            f"{self.stats['failed']} en échec"
+        )
+        return self.stats
+
+    def _claim(self):
+        for provider, semaphore in self.semaphores.items():
+            if not semaphore.acquire(blocking=False):
+                continue
+            job = self.queue.claim(provider)
+            if job is not None:
+                with self.stats_lock:
+                    self.active += 1
+                return job, semaphore
+            semaphore.release()
+        return None, None
+
+    def _run(self):
+        while True:
+            job, semaphore = self._claim()
+            if job is None:
+                if self.stop_when_idle.is_set() and not self._busy():
+                    return
+                self.wakeup.wait(self.poll_seconds)
+                self.wakeup.clear()
+                continue
+            try:
+                self._process(job)
+            finally:
+                semaphore.release()
+                with self.stats_lock:
+                    self.active -= 1
+                self.wakeup.set()
+
+    def _busy(self):
+        # Un job en cours peut encore échouer et revenir en attente
+        with self.stats_lock:
+            return self.active > 0
+
+    def _process(self, job):
+        label = f"{job['ticker']} (job {job['job_id']}, essai {job['attempts']}/{MAX_ATTEMPTS})"
+        if job["checkpoint"]:
+            logger.info(f"⏯️ Reprise du backfill {label} au checkpoint {job['checkpoint']}")
+        else:
+            logger.info(f"🚀 Backfill {job['provider']} {label}")
+        try:
+            BACKFILLS[job["provider"]](
+                job, lambda checkpoint, rows: self.queue.save_checkpoint(job["job_id"], checkpoint, rows)
+            )
+        except Exception as e:
+            status = self.queue.fail(job, e)
+            logger.error(f"❌ Backfill {label} : {e} ({'abandonné' if status == 'failed' else 'remis en attente'})")
+            with self.stats_lock:
+                self.stats["failed" if status == "failed" else "retried"] += 1
+            return
+        self.queue.finish(job["job_id"])
+        logger.info(f"✅ Backfill {label} terminé")
+        with self.stats_lock:
+            self.stats["done"] += 1
+
+def run_backfills(workers=4, queue=None):
+    """Vide la file avec un pool de workers (bloquant)."""
+    queue = queue or BackfillQueue()
+    return BackfillWorkers(queue, workers).start().drain()
+
+def show_status(queue=None, show_all=False):
+    queue = queue or BackfillQueue()
+    counts = queue.counts()
+    for provider in sorted({p for p, _ in counts}):
+        summary = ", ".join(f"{status}={n}" for (p, status), n in sorted(counts.items()) if p == provider)
+        print(f"{provider:<10} {summary}")
+    statuses = ("pending", "running", "failed", "done") if show_all else ("pending", "running", "failed")
+    for job in queue.jobs(statuses):
+        print(
+            f"[{job['status']:<7}] job {job['job_id']:>4} {job['ticker']:<14} {job['provider']:<8} "
+            f"essais {job['attempts']}  lignes {job['rows']:>7}  checkpoint {job['checkpoint'] or '-'}  "
+            f"maj {job['updated_at']}  {job['error'] or ''}"
+        )
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="File des backfills historiques des nouveaux actifs")
+    sub = parser.add_subparsers(dest="command", required=True)
+    status_parser = sub.add_parser("status", help="Backfills en attente, en cours et en échec")
+    status_parser.add_argument("--all", action="store_true", help="Inclut les jobs terminés")
+    run_parser = sub.add_parser("run", help="Vide la file")
+    run_parser.add_argument("--workers", type=int, default=4)
+    sub.add_parser("retry", help="Remet les jobs en échec en attente")
+    args = parser.parse_args()
+    if args.command == "status":
+        show_status(show_all=args.all)
+    elif args.command == "run":
+        run_backfills(args.workers)
+    else:
+        logger.info(f"♻️ {BackfillQueue().retry_failed()} backfills en échec remis en attente")
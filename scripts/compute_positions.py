@@ -2,8 +2,11 @@ import pandas as pd
 from scripts.utils.bd_oracle_connection import get_oracle_connection
 from scripts.utils.logger import logger
 
-def compute_positions(discord_user=None):
-    conn = get_oracle_connection()
+def compute_positions(discord_user=None, conn=None):
+    # conn : connexion déjà ouverte par l'appelant (elle n'est alors pas fermée ici)
+    own_conn = conn is None
+    if own_conn:
+        conn = get_oracle_connection()
     cur = conn.cursor()
     logger.info("🔗 Connexion Oracle pour calcul des positions courantes")
     # Récupère toutes les transactions
@@ -20,7 +23,8 @@ def compute_positions(discord_user=None):
         """)
     rows = cur.fetchall()
     cur.close()
-    conn.close()
+    if own_conn:
+        conn.close()
     if not rows:
         logger.warning("Aucune transaction trouvée.")
         return pd.DataFrame()
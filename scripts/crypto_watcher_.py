@@ -4,6 +4,7 @@ from pathlib import Path
 from dotenv import load_dotenv
 from scripts.utils.log_checker import check_and_alert_log
 from scripts.utils.logger import logger
+from scripts.utils.price_loader import load_price_histories
 from scripts.utils.discord_manager import DiscordManager  # Import du DiscordManager
 import os
 
@@ -25,17 +26,13 @@ def get_assets():
     logger.info(f"{len(df)} actifs chargés.")
     return df
 
+def history_to_df(history):
+    return pd.DataFrame({"price_date": pd.to_datetime(history["price_date"]), "price": history["price"]})
+
 def get_prices(asset_id):
     logger.info(f"Chargement des prix pour asset_id={asset_id}...")
-    conn = get_oracle_connection()
-    df = pd.read_sql(f"""
-        SELECT price_date, price_value as price
-        FROM prices
-        WHERE asset_id = {asset_id} AND price_value IS NOT NULL
-        ORDER BY price_date
-    """, conn)
-    conn.close()
-    df.columns = [c.lower() for c in df.columns]
+    history = load_price_histories([asset_id], value_column="price_value").get(int(asset_id))
+    df = history_to_df(history) if history is not None else pd.DataFrame(columns=["price_date", "price"])
     logger.info(f"{len(df)} prix chargés pour asset_id={asset_id}.")
     return df
 
@@ -105,8 +102,11 @@ if __name__ == "__main__":
     assets = get_assets()
     achats, ventes, conserver = [], [], []
     
+    # Un seul aller-retour Oracle pour l'historique de toutes les cryptos
+    histories = load_price_histories(assets["asset_id"], value_column="price_value")
     for _, row in assets.iterrows():
-        df = get_prices(row["asset_id"])
+        history = histories.get(int(row["asset_id"]))
+        df = history_to_df(history) if history is not None else pd.DataFrame(columns=["price_date", "price"])
         ma_window = 50  # MA50 pour la crypto
         
         if len(df) < max(20, ma_window, 14):
@@ -1,25 +1,39 @@
 import os
-import requests
 from dotenv import load_dotenv
 from datetime import datetime, timedelta
 import pytz
+import random
 import time
+import numpy as np
 
-from scripts.utils.bd_oracle_connection import get_oracle_connection
+from scripts.utils.bd_oracle_connection import get_oracle_connection, log_pool_stats
 from scripts.utils.logger import logger
+from scripts.utils.prices_upsert import upsert_prices
+from scripts.utils.coinbase_client import get_candles, run_concurrently, CANDLES_LIMIT
+from scripts.utils.candles import CandleBatch
 from scripts.utils.log_checker import check_and_alert_log
+from scripts.utils.price_cache import cache_enabled, refresh_cache
+from scripts.utils.latest_prices import refresh_latest_prices
+from scripts.utils.response_cache import bump_watermark
 
 
 # Charger les variables d'environnement
 load_dotenv(dotenv_path=os.path.expanduser('~/market-watcher/config/.env'))
 
 SOURCE_COINBASE = 1
+PARIS = pytz.timezone("Europe/Paris")
+
+# Bougies en retard : file différée re-interrogée avec un backoff exponentiel à jitter,
+# abandonnée LATE_RETRY_WINDOW secondes après le premier passage
+LATE_RETRY_WINDOW = int(os.getenv("COINBASE_LATE_RETRY_WINDOW", 150))
+LATE_BASE_DELAY = 5
+LATE_MAX_DELAY = 40
 
 def get_crypto_pairs():
-    """Récupère les paires CRYPTO à extraire depuis la table assets."""
+    """Récupère les paires CRYPTO à extraire depuis la table assets : (asset_id, ticker, date_max)."""
     conn = get_oracle_connection()
     cur = conn.cursor()
-    cur.execute("SELECT asset_id, ticker FROM assets WHERE asset_type = 'CRYPTO'")
+    cur.execute("SELECT asset_id, ticker, date_max FROM assets WHERE asset_type = 'CRYPTO'")
     pairs = cur.fetchall()
     cur.close()
     conn.close()
@@ -62,42 +76,24 @@ def update_user_watchlist_asset_id(ticker, asset_id):
     conn.close()
 
 def fetch_coinbase_ohlc(pair, granularity=21600):
-    """Récupère toutes les données OHLC pour une paire avec la granularité choisie (ex: 6h)."""
+    """Récupère toutes les données OHLC (CandleBatch) pour une paire avec la granularité choisie (ex: 6h)."""
     url = f"https://api.exchange.coinbase.com/products/{pair}/candles?granularity={granularity}"
     logger.info(f"📡 Requête Coinbase OHLC pour {pair} : {url}")
     try:
-        resp = requests.get(url, timeout=10)
-        resp.raise_for_status()
-        data = resp.json()
+        data, _ = get_candles(pair, granularity=granularity)
         if not data:
             logger.warning(f"⚠️ Pas de données OHLC pour {pair}")
-            return []
-        ohlc_list = []
-        for ohlc in data:
-            utc_dt = datetime.fromtimestamp(ohlc[0], tz=pytz.UTC)
-            paris_dt = utc_dt.astimezone(pytz.timezone("Europe/Paris"))
-            ohlc_list.append({
-                "price_date": paris_dt,
-                "open": ohlc[3],
-                "high": ohlc[2],
-                "low": ohlc[1],
-                "close": ohlc[4],
-                "price_value": ohlc[4],
-                "volume": ohlc[5]
-            })
-        return ohlc_list
+        return CandleBatch.from_coinbase(data or [])
     except Exception as e:
         logger.error(f"❌ Erreur extraction Coinbase pour {pair}: {e}")
-        return []
+        return CandleBatch()
 
 def fetch_coinbase_last_6h(pair):
     """Récupère la dernière bougie 6h pour une paire."""
     url = f"https://api.exchange.coinbase.com/products/{pair}/candles?granularity=21600"
     logger.info(f"📡 Requête Coinbase OHLC 6h pour {pair} : {url}")
     try:
-        resp = requests.get(url, timeout=10)
-        resp.raise_for_status()
-        data = resp.json()
+        data, _ = get_candles(pair, granularity=21600)
         if not data:
             logger.warning(f"⚠️ Pas de données OHLC pour {pair}")
             return None
@@ -119,31 +115,7 @@ def fetch_coinbase_last_6h(pair):
 
 def insert_price(asset_id, pair, ohlc):
     """Insère la donnée dans la table prices."""
-    conn = get_oracle_connection()
-    cur = conn.cursor()
-    cur.execute("""
-        MERGE INTO prices dst
-        USING (SELECT :asset_id AS asset_id, :price_date AS price_date FROM dual) src
-        ON (dst.asset_id = src.asset_id AND dst.price_date = src.price_date)
-        WHEN MATCHED THEN
-            UPDATE SET price_value = :price_value, open_value = :open, high_value = :high, low_value = :low, close_value = :close, volume = :volume, source = :source
-        WHEN NOT MATCHED THEN
-            INSERT (asset_id, price_date, price_value, open_value, high_value, low_value, close_value, volume, source)
-            VALUES (:asset_id, :price_date, :price_value, :open, :high, :low, :close, :volume, :source)
-    """, {
-        "asset_id": asset_id,
-        "price_date": ohlc["price_date"],
-        "price_value": ohlc["price_value"],
-        "open": ohlc["open"],
-        "high": ohlc["high"],
-        "low": ohlc["low"],
-        "close": ohlc["close"],
-        "volume": ohlc["volume"],
-        "source": SOURCE_COINBASE
-    })
-    conn.commit()
-    cur.close()
-    conn.close()
+    upsert_prices([ohlc], SOURCE_COINBASE, asset_id=asset_id, label=pair)
     logger.info(f"✅ Données insérées pour {pair} (asset_id={asset_id})")
 
 def update_asset_dates_and_status(asset_id, ohlc_list, status):
@@ -178,52 +150,161 @@ def update_asset_dates_and_status(asset_id, ohlc_list, status):
     conn.close()
     logger.info(f"🗓️ assets mis à jour pour asset_id={asset_id} ({date_min} → {date_max}, status={status})")
 
-def batch_extract_and_insert():
+def watermark_ts(date_max):
+    """assets.date_max (heure de Paris sans fuseau) en secondes epoch ; None si la paire n'a jamais été extraite."""
+    if date_max is None:
+        return None
+    return int(PARIS.localize(date_max).timestamp())
+
+def fetch_coinbase_hours(pair, asset_id, since_ts, target_ts):
+    """
+    Un seul appel /candles borné par start/end : bougies 1h postérieures à since_ts jusqu'à target_ts inclus
+    (au plus CANDLES_LIMIT heures). Retourne (CandleBatch, latence en secondes).
+    """
+    start_ts = target_ts - (CANDLES_LIMIT - 1) * 3600
+    if since_ts is not None:
+        start_ts = max(start_ts, since_ts + 3600)
+    params = {
+        "start": datetime.fromtimestamp(start_ts, pytz.UTC).isoformat(),
+        "end": datetime.fromtimestamp(target_ts, pytz.UTC).isoformat()
+    }
+    data, latency = get_candles(pair, granularity=3600, params=params)
+    return CandleBatch.from_coinbase(data or [], asset_id).clip(start_ts, target_ts), latency
+
+class LateCandleScheduler:
+    """
+    Extraction d'une heure cible pour toutes les paires, sans bloquer sur les bougies publiées en retard.
+    1er passage : un appel par paire (en parallèle) ; toutes les heures reçues depuis date_max sont upsertées,
+    y compris les heures manquées des runs précédents. Les paires sans l'heure cible passent dans une file
+    différée, re-interrogée en parallèle (seulement depuis la dernière heure reçue) avec un backoff exponentiel
+    à jitter, jusqu'à retry_window secondes. Le retard de chaque bougie (disponibilité - clôture) est mesuré.
+    """
+
+    def __init__(self, target_dt, max_workers=8, retry_window=LATE_RETRY_WINDOW,
+                 base_delay=LATE_BASE_DELAY, max_delay=LATE_MAX_DELAY, clock=time.time, sleep=time.sleep):
+        self.target_dt = target_dt
+        self.target_ts = int(target_dt.timestamp())
+        self.close_ts = self.target_ts + 3600
+        self.max_workers = max_workers
+        self.retry_window = retry_window
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.clock = clock
+        self.sleep = sleep
+        # asset_id -> {"pair", "found", "late", "attempts", "rows", "latency"}
+        self.results = {}
+
+    def backoff(self, attempt):
+        """Délai avant le (attempt + 1)-ième appel : tirage uniforme sous un plafond exponentiel."""
+        return random.uniform(self.base_delay, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def _poll(self, target):
+        asset_id, pair, since_ts = target
+        try:
+            batch, latency = fetch_coinbase_hours(pair, asset_id, since_ts, self.target_ts)
+        except Exception as e:
+            logger.warning(f"⚠️ Erreur requête Coinbase pour {pair}: {e}")
+            return CandleBatch(), 0.0
+        return batch, latency
+
+    def _round(self, targets):
+        """Interroge les paires en parallèle, upserte en un lot ce qui est arrivé. Retourne les paires encore en attente."""
+        polled = run_concurrently(targets, self._poll, max_workers=self.max_workers)
+        now = self.clock()
+        batches, waiting = [], []
+        for (asset_id, pair, since_ts), (batch, latency) in polled:
+            state = self.results[asset_id]
+            state["attempts"] += 1
+            state["latency"] += latency
+            state["rows"] += len(batch)
+            batches.append(batch)
+            if (batch.data["time"] == self.target_ts).any():
+                state["found"] = True
+                state["late"] = max(0.0, now - self.close_ts)
+            else:
+                # Le prochain appel repart de la dernière heure reçue
+                last_ts = int(batch.data["time"].max()) if len(batch) else since_ts
+                waiting.append((asset_id, pair, last_ts))
+        rows = CandleBatch.concat(batches)
+        if len(rows):
+            upsert_prices(rows, SOURCE_COINBASE, label=f"{len(rows)} bougies Coinbase")
+        return waiting
+
+    def run(self, targets):
+        """targets : [(asset_id, paire, since_ts)]. Retourne self.results."""
+        todo = []
+        for asset_id, pair, since_ts in targets:
+            self.results[asset_id] = {"pair": pair, "found": False, "late": None, "attempts": 0, "rows": 0,
+                                      "latency": 0.0}
+            if since_ts is not None and since_ts >= self.target_ts:
+                self.results[asset_id]["found"] = True
+                continue
+            if since_ts is not None and self.target_ts - since_ts > CANDLES_LIMIT * 3600:
+                logger.warning(f"⚠️ {pair}: trou de plus de {CANDLES_LIMIT}h, seules les dernières heures sont rattrapées")
+            todo.append((asset_id, pair, since_ts))
+        started = self.clock()
+        waiting = self._round(todo)
+        logger.info(f"📡 1er passage : {len(todo)} paires en {self.clock() - started:.1f}s, {len(waiting)} en attente")
+        deadline = started + self.retry_window
+        deferred = [(started + self.backoff(0), 1, target) for target in waiting]
+        while deferred:
+            now = self.clock()
+            due = [entry for entry in deferred if entry[0] <= now]
+            if not due:
+                self.sleep(min(entry[0] for entry in deferred) - now)
+                continue
+            deferred = [entry for entry in deferred if entry[0] > now]
+            attempts = {target[0]: attempt for _, attempt, target in due}
+            for target in self._round([target for _, _, target in due]):
+                retry_at = self.clock() + self.backoff(attempts[target[0]])
+                if retry_at <= deadline:
+                    deferred.append((retry_at, attempts[target[0]] + 1, target))
+                else:
+                    logger.error(f"Bougie {target[1]} {self.target_dt} non trouvée après {self.retry_window}s.")
+        return self.results
+
+    def log_summary(self):
+        """Retard de publication par paire et synthèse (médiane, max, manquantes)."""
+        polled = {a: s for a, s in self.results.items() if s["attempts"]}
+        lates = [s["late"] for s in polled.values() if s["late"] is not None]
+        for state in sorted(polled.values(), key=lambda s: -(s["late"] if s["late"] is not None else float("inf"))):
+            late = f"{state['late']:.0f}s après la clôture" if state["late"] is not None else "manquante"
+            logger.info(
+                f"⏱️ {state['pair']}: bougie {late}, {state['attempts']} appel(s), {state['rows']} heures upsertées, "
+                f"latence {state['latency']:.2f}s"
+            )
+        missing = len(polled) - len(lates)
+        first_pass = sum(1 for s in polled.values() if s["found"] and s["attempts"] == 1)
+        summary = (f"📊 Bougie {self.target_dt:%Y-%m-%d %H:%M} : {len(polled)} paires, {first_pass} au 1er passage, "
+                   f"{len(lates) - first_pass} en retard, {missing} manquantes")
+        if lates:
+            summary += f" ; retard médian {np.median(lates):.0f}s, max {max(lates):.0f}s"
+        logger.info(summary)
+
+def batch_extract_and_insert(max_workers=8):
     pairs = get_crypto_pairs()
-    now = datetime.now(pytz.timezone("Europe/Paris"))
+    now = datetime.now(PARIS)
     last_hour = now.replace(minute=0, second=0, microsecond=0) - timedelta(hours=1)
-    for asset_id, pair in pairs:
+    targets = []
+    for asset_id, pair, date_max in pairs:
         if not asset_id:
             asset_id = get_or_create_asset_id(pair)
         update_user_watchlist_asset_id(pair, asset_id)
-        ohlc = fetch_coinbase_ohlc_for_hour(pair, last_hour)
-        status = "OK" if ohlc else "ERROR"
-        if ohlc:
-            insert_price(asset_id, pair, ohlc)
-            update_asset_dates_and_status(asset_id, [ohlc], status)
-        else:
-            update_asset_dates_and_status(asset_id, [], status)
-
-def fetch_coinbase_ohlc_for_hour(pair, target_dt, max_retries=5, retry_delay=30):
-    """Récupère la bougie 1h pour une heure précise (target_dt = datetime Europe/Paris) avec retry."""
-    url = f"https://api.exchange.coinbase.com/products/{pair}/candles?granularity=3600"
-    for attempt in range(max_retries):
-        resp = requests.get(url, timeout=10)
-        resp.raise_for_status()
-        data = resp.json()
-        found = False
-        for ohlc in data:
-            utc_dt = datetime.fromtimestamp(ohlc[0], tz=pytz.UTC)
-            paris_dt = utc_dt.astimezone(pytz.timezone("Europe/Paris"))
-            # On compare l'heure exacte (sans les minutes/secondes)
-            if paris_dt.replace(minute=0, second=0, microsecond=0) == target_dt.replace(minute=0, second=0, microsecond=0):
-                return {
-                    "price_date": paris_dt,
-                    "open": ohlc[3],
-                    "high": ohlc[2],
-                    "low": ohlc[1],
-                    "close": ohlc[4],
-                    "price_value": ohlc[4],
-                    "volume": ohlc[5]
-                }
-        if attempt < max_retries - 1:
-            logger.warning(f"Bougie {pair} {target_dt} non trouvée, retry dans {retry_delay}s...")
-            time.sleep(retry_delay)
-    logger.error(f"Bougie {pair} {target_dt} non trouvée après {max_retries} tentatives.")
-    return None
+        targets.append((asset_id, pair, watermark_ts(date_max)))
+
+    scheduler = LateCandleScheduler(last_hour, max_workers=max_workers)
+    results = scheduler.run(targets)
+    scheduler.log_summary()
+    for asset_id, state in results.items():
+        update_asset_dates_and_status(asset_id, [], "OK" if state["found"] else "ERROR")
 
 if __name__ == "__main__":
     batch_extract_and_insert()
     from scripts.utils.maj_indicateurs_last_obs import update_last_obs_all_assets
     update_last_obs_all_assets('CRYPTO')
+    if cache_enabled():
+        refresh_cache()
+    refresh_latest_prices(asset_types=['CRYPTO'])
+    bump_watermark("prices")
+    log_pool_stats()
     check_and_alert_log("extraction_coinbase_", "extraction_coinbase_")
\ No newline at end of file
@@ -1,18 +1,33 @@
+import argparse
+import json
 import os
+import numpy as np
 import requests
 import time
 from dotenv import load_dotenv
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timedelta
+from pathlib import Path
 import pytz
 
-from scripts.utils.bd_oracle_connection import get_oracle_connection
+from scripts.utils.bd_oracle_connection import acquire, get_oracle_connection, number_list
 from scripts.utils.logger import logger
+from scripts.utils.prices_upsert import upsert_prices
+from scripts.utils.indicator_engine import invalidate_states
+from scripts.utils.latest_prices import refresh_latest_prices
+from scripts.utils.response_cache import bump_watermark
+from scripts.utils.binance_client import get_klines, KLINES_LIMIT
+from scripts.utils.coinbase_client import get_candles, run_concurrently, CANDLES_LIMIT
+from scripts.utils.candles import CandleBatch, PARIS_TZ
+from scripts.utils.price_cache import invalidate_cache
 
 # Charger les variables d'environnement
 load_dotenv(dotenv_path=os.path.expanduser('~/market-watcher/config/.env'))
 
 SOURCE_COINBASE = 1
 SOURCE_BINANCE = 4
+# Progression des backfills Binance par "SYMBOLE|intervalle" : {"start", "last_open"} en ms
+BINANCE_CHECKPOINT_FILE = Path.home() / "market-watcher/data/cache/binance_backfill.json"
 
 def get_crypto_pairs():
     """Récupère les paires CRYPTO à extraire depuis la table assets."""
@@ -61,42 +76,22 @@ def update_user_watchlist_asset_id(ticker, asset_id):
     conn.close()
 
 def fetch_coinbase_ohlc(pair, granularity=21600):
-    """Récupère toutes les données OHLC pour une paire avec la granularité choisie (ex: 6h)."""
-    url = f"https://api.exchange.coinbase.com/products/{pair}/candles?granularity={granularity}"
-    logger.info(f"📡 Requête Coinbase OHLC pour {pair} : {url}")
+    """Récupère toutes les données OHLC (CandleBatch) pour une paire avec la granularité choisie (ex: 6h)."""
+    logger.info(f"📡 Requête Coinbase OHLC pour {pair} (granularité {granularity}s)")
     try:
-        resp = requests.get(url, timeout=10)
-        resp.raise_for_status()
-        data = resp.json()
+        data, _ = get_candles(pair, granularity=granularity)
         if not data:
             logger.warning(f"⚠️ Pas de données OHLC pour {pair}")
-            return []
-        ohlc_list = []
-        for ohlc in data:
-            utc_dt = datetime.fromtimestamp(ohlc[0], tz=pytz.UTC)
-            paris_dt = utc_dt.astimezone(pytz.timezone("Europe/Paris"))
-            ohlc_list.append({
-                "price_date": paris_dt,
-                "open": ohlc[3],
-                "high": ohlc[2],
-                "low": ohlc[1],
-                "close": ohlc[4],
-                "price_value": ohlc[4],
-                "volume": ohlc[5]
-            })
-        return ohlc_list
+        return CandleBatch.from_coinbase(data or [])
     except Exception as e:
         logger.error(f"❌ Erreur extraction Coinbase pour {pair}: {e}")
-        return []
+        return CandleBatch()
 
 def fetch_coinbase_last_6h(pair):
     """Récupère la dernière bougie 6h pour une paire."""
-    url = f"https://api.exchange.coinbase.com/products/{pair}/candles?granularity=21600"
-    logger.info(f"📡 Requête Coinbase OHLC 6h pour {pair} : {url}")
+    logger.info(f"📡 Requête Coinbase OHLC 6h pour {pair}")
     try:
-        resp = requests.get(url, timeout=10)
-        resp.raise_for_status()
-        data = resp.json()
+        data, _ = get_candles(pair, granularity=21600)
         if not data:
             logger.warning(f"⚠️ Pas de données OHLC pour {pair}")
             return None
@@ -118,12 +113,9 @@ def fetch_coinbase_last_6h(pair):
 
 def fetch_coinbase_last_1h(pair):
     """Récupère la dernière bougie 1h pour une paire."""
-    url = f"https://api.exchange.coinbase.com/products/{pair}/candles?granularity=3600"
-    logger.info(f"📡 Requête Coinbase OHLC 1h pour {pair} : {url}")
+    logger.info(f"📡 Requête Coinbase OHLC 1h pour {pair}")
     try:
-        resp = requests.get(url, timeout=10)
-        resp.raise_for_status()
-        data = resp.json()
+        data, _ = get_candles(pair, granularity=3600)
         if not data:
             logger.warning(f"⚠️ Pas de données OHLC pour {pair}")
             return None
@@ -144,99 +136,109 @@ def fetch_coinbase_last_1h(pair):
         return None
 
 def fetch_coinbase_ohlc_1h(pair):
-    """Récupère toutes les bougies 1h disponibles pour une paire."""
-    url = f"https://api.exchange.coinbase.com/products/{pair}/candles?granularity=3600"
-    logger.info(f"📡 Requête Coinbase OHLC 1h pour {pair} : {url}")
+    """Récupère toutes les bougies 1h disponibles (CandleBatch) pour une paire."""
+    logger.info(f"📡 Requête Coinbase OHLC 1h pour {pair}")
     try:
-        resp = requests.get(url, timeout=10)
-        resp.raise_for_status()
-        data = resp.json()
+        data, _ = get_candles(pair, granularity=3600)
         if not data:
             logger.warning(f"⚠️ Pas de données OHLC pour {pair}")
-            return []
-        ohlc_list = []
-        for ohlc in data:
-            utc_dt = datetime.fromtimestamp(ohlc[0], tz=pytz.UTC)
-            paris_dt = utc_dt.astimezone(pytz.timezone("Europe/Paris"))
-            ohlc_list.append({
-                "price_date": paris_dt,
-                "open": ohlc[3],
-                "high": ohlc[2],
-                "low": ohlc[1],
-                "close": ohlc[4],
-                "price_value": ohlc[4],
-                "volume": ohlc[5]
-            })
-        return ohlc_list
+        return CandleBatch.from_coinbase(data or [])
     except Exception as e:
         logger.error(f"❌ Erreur extraction Coinbase pour {pair}: {e}")
-        return []
+        return CandleBatch()
+
+def coinbase_windows(start_dt, end_dt, step=3600, limit=CANDLES_LIMIT):
+    """
+    Découpe [start_dt, end_dt] en fenêtres de `limit` bougies, de la plus récente à la plus ancienne.
+    Retourne une liste de (début, fin) en secondes epoch, bornes incluses et alignées sur le pas.
+    """
+    first = int(start_dt.timestamp()) // step * step
+    window_end = int(end_dt.timestamp()) // step * step
+    windows = []
+    while window_end >= first:
+        window_start = max(window_end - (limit - 1) * step, first)
+        windows.append((window_start, window_end))
+        window_end = window_start - step
+    return windows
+
+def fetch_coinbase_window(pair, window, step=3600, max_retries=3, retry_delay=2):
+    """
+    Une fenêtre de bougies Coinbase (start/end) en CandleBatch. get_candles réessaie déjà les 429 / 5xx ;
+    les coupures réseau (connexion, timeout) sont réessayées ici.
+    """
+    window_start, window_end = window
+    params = {
+        "start": datetime.fromtimestamp(window_start, pytz.UTC).isoformat(),
+        "end": datetime.fromtimestamp(window_end, pytz.UTC).isoformat()
+    }
+    for attempt in range(1, max_retries + 1):
+        try:
+            data, _ = get_candles(pair, granularity=step, params=params)
+            break
+        except (requests.ConnectionError, requests.Timeout) as e:
+            if attempt == max_retries:
+                raise
+            logger.warning(f"⚠️ Fenêtre Coinbase {pair} {params['start']} : {e}, retry {attempt}/{max_retries}")
+            time.sleep(retry_delay * attempt)
+    return CandleBatch.from_coinbase(data or [])
+
+def fetch_coinbase_history(pair, start_dt, end_dt, step=3600, workers=8):
+    """
+    Historique Coinbase d'une paire entre start_dt et end_dt (datetimes aware), quelle que soit la durée.
+    Les fenêtres de CANDLES_LIMIT bougies sont téléchargées en parallèle sous le limiteur partagé,
+    puis fusionnées et dédoublonnées. Retourne un CandleBatch trié par date.
+    """
+    windows = coinbase_windows(start_dt, end_dt, step)
+    started = time.perf_counter()
+    results = run_concurrently(windows, lambda window: fetch_coinbase_window(pair, window, step), max_workers=workers)
+    candles = CandleBatch.concat([batch for _, batch in results])
+    candles = candles.clip(int(start_dt.timestamp()), int(end_dt.timestamp())).unique()
+    logger.info(
+        f"📡 Coinbase {pair} : {len(candles)} bougies ({len(windows)} fenêtres de {step}s) "
+        f"en {time.perf_counter() - started:.1f}s"
+    )
+    return candles
+
+def backfill_coinbase_history(pairs, start_dt, end_dt, step=3600, workers=8):
+    """Historique Coinbase de plusieurs paires, upserté en masse paire par paire."""
+    from scripts.extraction_eodhd_hist import update_asset_dates
+    assets = {ticker: asset_id for asset_id, ticker in get_crypto_pairs()}
+    touched = set()
+    for pair in pairs:
+        asset_id = assets.get(pair) or get_or_create_asset_id(pair)
+        try:
+            candles = fetch_coinbase_history(pair, start_dt, end_dt, step, workers)
+        except Exception as e:
+            logger.error(f"❌ Historique Coinbase {pair} : {e}")
+            continue
+        if len(candles):
+            insert_prices(asset_id, pair, candles)
+            update_asset_dates(asset_id)
+            touched.add(asset_id)
+    if touched:
+        invalidate_states(touched)
+        invalidate_cache(touched)
+    return touched
 
 def insert_price(asset_id, pair, ohlc):
     """Insère la donnée dans la table prices."""
-    conn = get_oracle_connection()
-    cur = conn.cursor()
-    cur.execute("""
-        MERGE INTO prices dst
-        USING (SELECT :asset_id AS asset_id, :price_date AS price_date FROM dual) src
-        ON (dst.asset_id = src.asset_id AND dst.price_date = src.price_date)
-        WHEN MATCHED THEN
-            UPDATE SET price_value = :price_value, open_value = :open, high_value = :high, low_value = :low, close_value = :close, volume = :volume, source = :source
-        WHEN NOT MATCHED THEN
-            INSERT (asset_id, price_date, price_value, open_value, high_value, low_value, close_value, volume, source)
-            VALUES (:asset_id, :price_date, :price_value, :open, :high, :low, :close, :volume, :source)
-    """, {
-        "asset_id": asset_id,
-        "price_date": ohlc["price_date"],
-        "price_value": ohlc["price_value"],
-        "open": ohlc["open"],
-        "high": ohlc["high"],
-        "low": ohlc["low"],
-        "close": ohlc["close"],
-        "volume": ohlc["volume"],
-            "source": SOURCE_COINBASE
-    })
-    conn.commit()
-    cur.close()
-    conn.close()
-    logger.info(f"✅ Données insérées pour {pair} (asset_id={asset_id})")
+    insert_prices(asset_id, pair, [ohlc])
 
 def insert_price_binance(asset_id, pair, ohlc):
     """Insère la donnée dans la table prices (source Binance)."""
-    conn = get_oracle_connection()
-    cur = conn.cursor()
-    cur.execute("""
-        MERGE INTO prices dst
-        USING (SELECT :asset_id AS asset_id, :price_date AS price_date FROM dual) src
-        ON (dst.asset_id = src.asset_id AND dst.price_date = src.price_date)
-        WHEN MATCHED THEN
-            UPDATE SET price_value = :price_value, open_value = :open, high_value = :high, low_value = :low, close_value = :close, volume = :volume, source = :source
-        WHEN NOT MATCHED THEN
-            INSERT (asset_id, price_date, price_value, open_value, high_value, low_value, close_value, volume, source)
-            VALUES (:asset_id, :price_date, :price_value, :open, :high, :low, :close, :volume, :source)
-    """, {
-        "asset_id": asset_id,
-        "price_date": ohlc["price_date"],
-        "price_value": ohlc["price_value"],
-        "open": ohlc["open"],
-        "high": ohlc["high"],
-        "low": ohlc["low"],
-        "close": ohlc["close"],
-        "volume": ohlc["volume"],
-            "source": SOURCE_BINANCE
-    })
-    conn.commit()
-    cur.close()
-    conn.close()
-    logger.info(f"✅ Données Binance insérées pour {pair} (asset_id={asset_id})")
+    insert_prices(asset_id, pair, [ohlc], source=SOURCE_BINANCE)
+
+def insert_prices(asset_id, pair, ohlc_list, source=SOURCE_COINBASE):
+    """Insère un lot de bougies dans la table prices en un seul upsert."""
+    stats = upsert_prices(ohlc_list, source, asset_id=asset_id, label=pair)
+    logger.info(f"✅ {stats['rows']} bougies insérées pour {pair} (asset_id={asset_id})")
+    return stats
 
 def update_asset_dates_and_status(asset_id, ohlc_list, status):
-    """Met à jour date_min, date_max, last_extract_status, last_extract_attempt dans assets."""
+    """Met à jour date_min, date_max, last_extract_status, last_extract_attempt dans assets (ohlc_list : CandleBatch)."""
     if not ohlc_list:
         return
-    dates = [ohlc["price_date"] for ohlc in ohlc_list]
-    date_min = min(dates)
-    date_max = max(dates)
+    date_min, date_max = ohlc_list.date_range()
     now = datetime.now(pytz.timezone("Europe/Paris"))
     conn = get_oracle_connection()
     cur = conn.cursor()
@@ -268,123 +270,351 @@ def batch_extract_and_insert():
         ohlc_list = fetch_coinbase_ohlc_1h(pair)
         status = "OK" if ohlc_list else "ERROR"
         if ohlc_list:
-            for ohlc in ohlc_list:
-                insert_price(asset_id, pair, ohlc)
+            insert_prices(asset_id, pair, ohlc_list)
             update_asset_dates_and_status(asset_id, ohlc_list, status)
         else:
             update_asset_dates_and_status(asset_id, [], status)
 
-def fetch_binance_ohlc_1h(symbol, start_dt, end_dt):
-    logger.info("🔄 Démarrage de l'extraction des donnée Binance")
-    url = "https://api.binance.com/api/v3/klines"
-    interval = "1h"
-    limit = 1000
-    all_ohlc = []
-    max_span = timedelta(days=365)
-
-    current_start = start_dt
-    while current_start < end_dt:
-        current_end = min(current_start + max_span, end_dt)
-        start_ts = int(current_start.timestamp() * 1000)
-        end_ts = int(current_end.timestamp() * 1000)
-        while start_ts < end_ts:
-            params = {
-                "symbol": symbol,
-                "interval": interval,
-                "startTime": start_ts,
-                "endTime": min(start_ts + limit * 3600 * 1000, end_ts),
-                "limit": limit
-            }
-            resp = requests.get(url, params=params, timeout=10)
-            resp.raise_for_status()
-            data = resp.json()
-            if not data:
-                break
-            for ohlc in data:
-                all_ohlc.append({
-                    "price_date": datetime.fromtimestamp(ohlc[0] / 1000, pytz.UTC),
-                    "open": float(ohlc[1]),
-                    "high": float(ohlc[2]),
-                    "low": float(ohlc[3]),
-                    "close": float(ohlc[4]),
-                    "price_value": float(ohlc[4]),
-                    "volume": float(ohlc[5])
-                })
-            start_ts = data[-1][0] + 3600 * 1000
-            time.sleep(0.2)
-        current_start = current_end
-    logger.info("🔄 Fin de l'extraction des donnée Binance")
-    return all_ohlc
-
-
-
-def get_missing_date_ranges(asset_id, start_dt, end_dt):
+GRANULARITIES = {"1h": 3600, "6h": 21600, "1d": 86400}
+EPOCH = datetime(1970, 1, 1)
+
+# "Gaps and islands" : chaque prix est ramené à son numéro de créneau (secondes depuis 1970 / pas),
+# LEAD donne le créneau occupé suivant ; un écart > 1 est un trou. Les sentinelles (créneaux juste
+# avant / après la période) font apparaître les trous en début et en fin de période.
+# {slot_date} : price_date exprimée dans le fuseau des créneaux (voir _slot_date).
+GAPS_SQL = """
+    WITH buckets AS (
+        SELECT asset_id, b FROM (
+            SELECT p.asset_id, FLOOR(ROUND(({slot_date} - DATE '1970-01-01') * 86400) / :step) AS b
+            FROM prices p
+            WHERE {filters}
+        )
+        GROUP BY asset_id, b
+        {sentinels}
+    ),
+    steps AS (
+        SELECT asset_id, b, LEAD(b) OVER (PARTITION BY asset_id ORDER BY b) AS next_b
+        FROM buckets
+    )
+    SELECT asset_id, b + 1 AS first_missing, next_b - 1 AS last_missing
+    FROM steps
+    WHERE next_b > b + 1
+    ORDER BY asset_id, b
+"""
+
+RANGE_SENTINELS = """
+        UNION ALL SELECT column_value, :first_bucket - 1 FROM TABLE(:ids)
+        UNION ALL SELECT column_value, :last_bucket + 1 FROM TABLE(:ids)
+"""
+
+def _slot_date(tz):
     """
-    Retourne une liste de tuples (start, end) pour les plages horaires manquantes dans prices.
+    Date de créneau SQL. tz : fuseau dans lequel price_date est stockée (comme CandleBatch.tz).
+    Les bougies Coinbase / Binance sont découpées en UTC, sinon l'heure sautée au passage à l'heure d'été
+    ressort comme un trou et les créneaux de 6h sont alignés sur Paris ; tz=None garde la date stockée
+    (barres journalières EODHD, datées à minuit local).
     """
-    conn = get_oracle_connection()
+    if tz is None:
+        return "p.price_date"
+    return f"CAST(FROM_TZ(CAST(p.price_date AS TIMESTAMP), '{tz}') AT TIME ZONE 'UTC' AS DATE)"
+
+def _bucket(dt, step, tz=PARIS_TZ):
+    """Créneau de dt (aware, ou naïf dans le fuseau tz comme price_date)."""
+    if tz is None:
+        return int((dt.replace(tzinfo=None) - EPOCH).total_seconds() // step)
+    if dt.tzinfo is None:
+        dt = pytz.timezone(tz).localize(dt)
+    return int(dt.timestamp()) // step
+
+def _bucket_start(bucket, step, tz=PARIS_TZ):
+    """Début du créneau : datetime aware dans le fuseau tz (naïf si tz=None)."""
+    if tz is None:
+        return EPOCH + timedelta(seconds=int(bucket) * step)
+    return datetime.fromtimestamp(int(bucket) * step, pytz.UTC).astimezone(pytz.timezone(tz))
+
+def _unreachable(bucket, step, tz=PARIS_TZ):
+    """
+    Vrai si aucune price_date ne peut tomber dans ce créneau : au passage à l'heure d'hiver, l'heure
+    locale répétée n'est stockée qu'une fois (dédoublonnage sur la date locale) et Oracle la relit en
+    heure d'hiver ; le créneau UTC de la première occurrence reste donc toujours vide.
+    """
+    if tz is None:
+        return False
+    return _bucket(_bucket_start(bucket, step, tz).replace(tzinfo=None), step, tz) != bucket
+
+def _gap_rows(rows, step, tz=PARIS_TZ):
+    gaps = {}
+    for asset_id, first_missing, last_missing in rows:
+        first_missing, last_missing = int(first_missing), int(last_missing)
+        # Créneaux impossibles à remplir retirés des bords (un trou réduit à l'heure répétée disparaît)
+        while first_missing <= last_missing and _unreachable(first_missing, step, tz):
+            first_missing += 1
+        while last_missing >= first_missing and _unreachable(last_missing, step, tz):
+            last_missing -= 1
+        if first_missing > last_missing:
+            continue
+        gaps.setdefault(int(asset_id), []).append(
+            (_bucket_start(first_missing, step, tz), _bucket_start(last_missing, step, tz),
+             int(last_missing - first_missing + 1))
+        )
+    return gaps
+
+def find_gaps(asset_ids, start_dt, end_dt, step=3600, conn=None, tz=PARIS_TZ):
+    """
+    Trous de plusieurs actifs entre start_dt et end_dt (inclus), calculés en une requête.
+    Retourne {asset_id: [(début, fin, nb de créneaux manquants), ...]} (actifs sans trou absents),
+    début et fin de créneau en datetimes aware dans le fuseau tz.
+    """
+    asset_ids = sorted({int(a) for a in asset_ids})
+    if not asset_ids:
+        return {}
+    if conn is None:
+        with acquire() as pooled_conn:
+            return find_gaps(asset_ids, start_dt, end_dt, step, pooled_conn, tz)
+    first_bucket, last_bucket = _bucket(start_dt, step, tz), _bucket(end_dt, step, tz)
+    filters = ("p.asset_id IN (SELECT column_value FROM TABLE(:ids)) "
+               "AND p.price_date >= :range_start AND p.price_date < :range_end")
     cur = conn.cursor()
-    cur.execute("""
-        SELECT price_date FROM prices
-        WHERE asset_id = :asset_id
-        AND price_date BETWEEN :start_dt AND :end_dt
-        ORDER BY price_date
-    """, {"asset_id": asset_id, "start_dt": start_dt, "end_dt": end_dt})
-    existing_dates = set([row[0].replace(minute=0, second=0, microsecond=0) for row in cur.fetchall()])
+    cur.execute(GAPS_SQL.format(slot_date=_slot_date(tz), filters=filters, sentinels=RANGE_SENTINELS), {
+        "ids": number_list(conn, asset_ids),
+        "step": step,
+        "range_start": _bucket_start(first_bucket, step, tz).replace(tzinfo=None),
+        "range_end": _bucket_start(last_bucket + 1, step, tz).replace(tzinfo=None),
+        "first_bucket": first_bucket,
+        "last_bucket": last_bucket
+    })
+    rows = cur.fetchall()
     cur.close()
-    conn.close()
+    return _gap_rows(rows, step, tz)
 
-    # Génère toutes les heures attendues
-    all_hours = []
-    dt = start_dt
-    while dt <= end_dt:
-        all_hours.append(dt.replace(minute=0, second=0, microsecond=0))
-        dt += timedelta(hours=1)
-
-    missing = sorted(set(all_hours) - existing_dates)
-    # Regroupe les dates manquantes en plages continues
-    ranges = []
-    if missing:
-        range_start = missing[0]
-        prev = missing[0]
-        for d in missing[1:]:
-            if d - prev > timedelta(hours=1):
-                ranges.append((range_start, prev))
-                range_start = d
-            prev = d
-        ranges.append((range_start, prev))
-    return ranges
-
-def batch_extract_and_insert_binance():
-    pairs = get_crypto_pairs()
-    pairs = [(asset_id, pair) for asset_id, pair in pairs if pair in ("XRP-EUR", "XRPEUR")]
-    for asset_id, pair in pairs:
-        if not asset_id:
-            asset_id = get_or_create_asset_id(pair)  # Ajoute cette ligne !
-        binance_symbol = pair.replace("-", "").upper()
-        start_dt = datetime(2024, 10, 18, tzinfo=pytz.UTC)
-        end_dt = datetime(2025, 10, 18, tzinfo=pytz.UTC)
-        missing_ranges = get_missing_date_ranges(asset_id, start_dt, end_dt)
-        for range_start, range_end in missing_ranges:
-            logger.info(f"⏳ Complétion Binance {binance_symbol} du {range_start} au {range_end}")
-            ohlc_list = fetch_binance_ohlc_1h(binance_symbol, range_start, range_end)
-            logger.info(f"📊 {len(ohlc_list)} bougies récupérées pour {binance_symbol} ({range_start} → {range_end})")
-            for ohlc in ohlc_list:
-                insert_price_binance(asset_id, pair, ohlc)
+def get_missing_date_ranges(asset_id, start_dt, end_dt, step=3600):
+    """
+    Retourne une liste de tuples (start, end) pour les plages manquantes dans prices
+    (créneaux de `step` secondes, horaires par défaut).
+    """
+    return [(start, end) for start, end, _ in find_gaps([asset_id], start_dt, end_dt, step).get(int(asset_id), [])]
+
+def find_internal_gaps(step, asset_type=None, conn=None, tz=PARIS_TZ):
+    """
+    Trous de tous les actifs (ou d'un asset_type) entre leur premier et leur dernier prix,
+    sur toute la table prices, en une requête. Même format que find_gaps.
+    """
+    if conn is None:
+        with acquire() as pooled_conn:
+            return find_internal_gaps(step, asset_type, pooled_conn, tz)
+    filters, params = "1 = 1", {"step": step}
+    if asset_type is not None:
+        filters = "p.asset_id IN (SELECT asset_id FROM assets WHERE asset_type = :asset_type)"
+        params["asset_type"] = asset_type
+    cur = conn.cursor()
+    cur.arraysize = 10000
+    cur.execute(GAPS_SQL.format(slot_date=_slot_date(tz), filters=filters, sentinels=""), params)
+    rows = cur.fetchall()
+    cur.close()
+    return _gap_rows(rows, step, tz)
+
+def drop_weekend_gaps(gaps):
+    """Retire les trous limités à des samedis / dimanches (pas de séance, pas de trou)."""
+    kept = {}
+    for asset_id, ranges in gaps.items():
+        ranges = [g for g in ranges if np.busday_count(g[0].date(), g[1].date() + timedelta(days=1)) > 0]
+        if ranges:
+            kept[asset_id] = ranges
+    return kept
+
+def report_gaps(granularity=None, asset_type=None, skip_weekends=None):
+    """
+    Liste les trous de chaque actif. Sans granularité : CRYPTO en 1h, autres actifs en 1d hors week-ends.
+    """
+    if granularity is not None:
+        groups = [(asset_type, GRANULARITIES[granularity], bool(skip_weekends))]
+    elif asset_type is not None:
+        crypto = asset_type == "CRYPTO"
+        groups = [(asset_type, 3600 if crypto else 86400, not crypto if skip_weekends is None else skip_weekends)]
+    else:
+        groups = [("CRYPTO", 3600, False), ("STOCK", 86400, True), ("ETF", 86400, True)]
+    # Bougies crypto datées en UTC, barres EODHD à minuit local
+    tz_for = lambda group_type: None if group_type in ("STOCK", "ETF") else PARIS_TZ
+    with acquire() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT asset_id, ticker FROM assets")
+        tickers = dict(cur.fetchall())
+        cur.close()
+        for group_type, step, weekends in groups:
+            gaps = find_internal_gaps(step, group_type, conn, tz_for(group_type))
+            if weekends:
+                gaps = drop_weekend_gaps(gaps)
+            total = sum(n for ranges in gaps.values() for _, _, n in ranges)
+            print(f"== {group_type or 'tous les actifs'} (pas {step}s) : {len(gaps)} actifs avec trous, "
+                  f"{total} créneaux manquants")
+            for asset_id, ranges in sorted(gaps.items(), key=lambda item: tickers.get(item[0]) or ""):
+                print(f"{tickers.get(asset_id, asset_id)} (asset_id={asset_id}) : {len(ranges)} trous, "
+                      f"{sum(n for _, _, n in ranges)} créneaux")
+                for start, end, n in ranges:
+                    print(f"    {start} → {end} ({n})")
+
+def binance_pages(ranges, step_seconds, limit=KLINES_LIMIT):
+    """Découpe des plages [début, fin] (datetimes aware) en fenêtres d'au plus `limit` bougies (ms, bornes incluses)."""
+    step_ms = step_seconds * 1000
+    pages = []
+    for range_start, range_end in ranges:
+        start_ms = int(range_start.timestamp() * 1000) // step_ms * step_ms
+        end_ms = int(range_end.timestamp() * 1000)
+        while start_ms <= end_ms:
+            pages.append((start_ms, min(start_ms + limit * step_ms - 1, end_ms)))
+            start_ms += limit * step_ms
+    return pages
+
+def fetch_binance_page(symbol, interval, start_ms, end_ms):
+    """Une page de bougies Binance (CandleBatch), datée en Europe/Paris comme les bougies Coinbase."""
+    return CandleBatch.from_binance(get_klines(symbol, interval, start_ms, end_ms))
+
+def load_binance_checkpoints(path=BINANCE_CHECKPOINT_FILE):
+    if not path.exists():
+        return {}
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except Exception as e:
+        logger.warning(f"⚠️ Checkpoints Binance illisibles ({path}), reprise depuis le début : {e}")
+        return {}
+
+def save_binance_checkpoints(checkpoints, path=BINANCE_CHECKPOINT_FILE):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(".tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(checkpoints, f)
+    tmp_path.replace(path)
+
+def backfill_binance(pairs, start_dt, end_dt, interval="1h", workers=4, missing_only=False,
+                     checkpoint_path=BINANCE_CHECKPOINT_FILE):
+    """
+    Backfill Binance de plusieurs paires sur [start_dt, end_dt] (datetimes Europe/Paris).
+    Les pages de KLINES_LIMIT bougies sont téléchargées en parallèle sous le limiteur de poids partagé
+    et chaque page est upsertée dès réception. Le checkpoint (par symbole et intervalle) retient le début
+    demandé et l'heure d'ouverture de la dernière bougie d'une suite continue de pages terminées : un run
+    avec le même début (fin libre, ex. jusqu'à maintenant) repart juste après.
+    Avec missing_only, seules les plages absentes de prices (find_gaps) sont demandées.
+    """
+    step = GRANULARITIES[interval]
+    step_ms = step * 1000
+    start_ms = int(start_dt.timestamp() * 1000)
+    assets = {ticker: asset_id for asset_id, ticker in get_crypto_pairs()}
+    checkpoints = load_binance_checkpoints(checkpoint_path)
+    progress = {}
+    tasks = []
+    for pair in pairs:
+        asset_id = assets.get(pair) or get_or_create_asset_id(pair)
+        symbol = pair.replace("-", "").upper()
+        if missing_only:
+            gaps = find_gaps([asset_id], start_dt, end_dt, step).get(int(asset_id), [])
+            ranges = [(g_start, g_end) for g_start, g_end, _ in gaps]
+        else:
+            ranges = [(start_dt, end_dt)]
+        key = f"{symbol}|{interval}"
+        checkpoint = checkpoints.get(key)
+        last_open = checkpoint["last_open"] if checkpoint and checkpoint.get("start") == start_ms else -1
+        pages = [(max(page[0], last_open + step_ms), page[1])
+                 for page in binance_pages(ranges, step) if page[1] // step_ms * step_ms > last_open]
+        logger.info(f"⏳ Binance {symbol} : {len(pages)} pages à télécharger ({interval}, {len(ranges)} plages)")
+        if not pages:
+            continue
+        # Pages dans l'ordre : le checkpoint avance tant que les pages précédentes sont terminées
+        progress[key] = {"pages": [page[1] // step_ms * step_ms for page in pages], "done": set(), "next": 0,
+                         "rows": 0, "errors": 0}
+        tasks.extend((key, asset_id, pair, symbol, page) for page in pages)
+
+    touched = set()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(fetch_binance_page, symbol, interval, page[0], page[1]): (key, asset_id, pair, page)
+            for key, asset_id, pair, symbol, page in tasks
+        }
+        for future in as_completed(futures):
+            key, asset_id, pair, page = futures[future]
+            state = progress[key]
+            try:
+                rows = future.result()
+            except Exception as e:
+                state["errors"] += 1
+                logger.error(f"❌ Page Binance {key.split('|')[0]} {page[0]} → {page[1]} : {e}")
+                continue
+            if rows:
+                insert_prices(asset_id, pair, rows, source=SOURCE_BINANCE)
+                touched.add(asset_id)
+            state["rows"] += len(rows)
+            state["done"].add(page[1] // step_ms * step_ms)
+            while state["next"] < len(state["pages"]) and state["pages"][state["next"]] in state["done"]:
+                checkpoints[key] = {"start": start_ms, "last_open": state["pages"][state["next"]]}
+                state["next"] += 1
+            save_binance_checkpoints(checkpoints, checkpoint_path)
+    for key, state in progress.items():
+        logger.info(
+            f"📊 Binance {key.split('|')[0]} : {len(state['done'])}/{len(state['pages'])} pages, "
+            f"{state['rows']} bougies, {state['errors']} erreurs"
+        )
+    logger.info(f"✅ Backfill Binance terminé en {time.perf_counter() - started:.1f}s")
+    if touched:
+        invalidate_states(touched)
+        invalidate_cache(touched)
+    return touched
 
 def fetch_with_retry_coinbase(pair, target_dt, max_attempts=5, delay=30):
-    """Essaie de récupérer la bougie manquante via Coinbase avec plusieurs tentatives."""
+    """Essaie de récupérer la bougie manquante via Coinbase avec plusieurs tentatives (CandleBatch d'une bougie)."""
+    target_ts = int(target_dt.timestamp())
     for attempt in range(1, max_attempts + 1):
-        ohlc_list = fetch_coinbase_ohlc_1h(pair)
-        for ohlc in ohlc_list:
-            if ohlc["price_date"] == target_dt:
-                logger.info(f"✅ Bougie {pair} {target_dt} récupérée à la tentative {attempt}.")
-                return ohlc
+        found = fetch_coinbase_ohlc_1h(pair).clip(target_ts, target_ts)
+        if len(found):
+            logger.info(f"✅ Bougie {pair} {target_dt} récupérée à la tentative {attempt}.")
+            return found
         logger.warning(f"Bougie {pair} {target_dt} non trouvée, retry dans {delay}s... (tentative {attempt}/{max_attempts})")
         time.sleep(delay)
     logger.error(f"Bougie {pair} {target_dt} non trouvée après {max_attempts} tentatives.")
     return None
 
 if __name__ == "__main__":
-    # Extraction historique sur Binance pour la paire XRP-EUR
-    batch_extract_and_insert_binance()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Extraction historique crypto et contrôle des trous de prices")
+    sub = parser.add_subparsers(dest="command")
+    gaps_parser = sub.add_parser("gaps", help="Liste les trous de chaque actif dans prices")
+    gaps_parser.add_argument("--granularity", choices=sorted(GRANULARITIES), default=None,
+                             help="Pas attendu (défaut : 1h pour CRYPTO, 1d hors week-ends pour les autres)")
+    gaps_parser.add_argument("--asset-type", default=None, help="Filtre asset_type")
+    gaps_parser.add_argument("--skip-weekends", action="store_true", default=None,
+                             help="Ignore les trous limités aux week-ends")
+    binance_parser = sub.add_parser("binance", help="Backfill Binance de paires sur une période")
+    binance_parser.add_argument("pairs", nargs="+", help="Paires au format Coinbase (ex : XRP-EUR)")
+    binance_parser.add_argument("--start", required=True, help="Début (YYYY-MM-DD, heure de Paris)")
+    binance_parser.add_argument("--end", default=None, help="Fin incluse (YYYY-MM-DD, défaut : maintenant)")
+    binance_parser.add_argument("--interval", choices=sorted(GRANULARITIES), default="1h")
+    binance_parser.add_argument("--workers", type=int, default=4, help="Pages téléchargées en parallèle")
+    binance_parser.add_argument("--missing-only", action="store_true", help="Seulement les trous de prices")
+    coinbase_parser = sub.add_parser("coinbase", help="Historique Coinbase de paires sur une période")
+    coinbase_parser.add_argument("pairs", nargs="+", help="Paires Coinbase (ex : BTC-EUR)")
+    coinbase_parser.add_argument("--start", required=True, help="Début (YYYY-MM-DD, heure de Paris)")
+    coinbase_parser.add_argument("--end", default=None, help="Fin incluse (YYYY-MM-DD, défaut : maintenant)")
+    coinbase_parser.add_argument("--granularity", choices=sorted(GRANULARITIES), default="1h")
+    coinbase_parser.add_argument("--workers", type=int, default=8, help="Fenêtres téléchargées en parallèle")
+    args = parser.parse_args()
+    if args.command == "gaps":
+        report_gaps(args.granularity, args.asset_type, args.skip_weekends)
+    elif args.command in ("binance", "coinbase"):
+        paris = pytz.timezone("Europe/Paris")
+        start_dt = paris.localize(datetime.strptime(args.start, "%Y-%m-%d"))
+        if args.end:
+            end_dt = paris.localize(datetime.strptime(args.end, "%Y-%m-%d") + timedelta(days=1) - timedelta(seconds=1))
+        else:
+            end_dt = datetime.now(paris)
+        if args.command == "binance":
+            backfill_binance(args.pairs, start_dt, end_dt, args.interval, args.workers, args.missing_only)
+        else:
+            backfill_coinbase_history(args.pairs, start_dt, end_dt, GRANULARITIES[args.granularity], args.workers)
+        refresh_latest_prices(asset_types=['CRYPTO'])
+        bump_watermark("prices")
+    else:
+        # Job historique : complétion Binance de la paire XRP-EUR
+        paris = pytz.timezone("Europe/Paris")
+        backfill_binance(["XRP-EUR"], paris.localize(datetime(2024, 10, 18)), paris.localize(datetime(2025, 10, 18)),
+                         missing_only=True)
+        refresh_latest_prices(asset_types=['CRYPTO'])
+        bump_watermark("prices")
@@ -1,17 +1,32 @@
 from eodhd import APIClient
+import argparse
 import os
+import numpy as np
 from dotenv import load_dotenv
 from pathlib import Path
-from scripts.utils.bd_oracle_connection import get_oracle_connection
+from scripts.utils.bd_oracle_connection import acquire, get_oracle_connection, log_pool_stats, number_list
+from scripts.utils.eodhd_client import EodhdFetcher, RecordedFetcher, RecordingFetcher
 from scripts.utils.logger import logger
+from scripts.utils.prices_upsert import upsert_prices
 from scripts.utils.log_checker import check_and_alert_log
-from datetime import datetime, timedelta
+from scripts.utils.price_cache import cache_enabled, refresh_cache
+from scripts.utils.latest_prices import refresh_latest_prices
+from scripts.utils.response_cache import bump_watermark
+from datetime import date, datetime, timedelta
 
 # Charger la clé API
 load_dotenv(str(Path.home() / "market-watcher/config/.env"))
 EODHD_API_KEY = os.getenv("EODHD_API_KEY")
 api = APIClient(EODHD_API_KEY)
 
+SOURCE_EODHD = 4
+# Actif sans historique (date_max NULL) : même profondeur que l'extraction historique
+INITIAL_YEARS = 10
+# Coût d'un appel eod-bulk-last-day en crédits EODHD (un appel /eod ticker par ticker = 1 crédit)
+BULK_CALL_COST = 100
+# Une place passe en bulk au-delà de ce nombre de tickers suivis (par défaut : quand le bulk est moins cher)
+BULK_THRESHOLD = int(os.getenv("EODHD_BULK_THRESHOLD", BULK_CALL_COST))
+
 def get_or_create_asset_id(ticker):
     conn = get_oracle_connection()
     cur = conn.cursor()
@@ -122,53 +137,233 @@ def fetch_last_daily_data_eodhd(ticker):
         if data and isinstance(data, list) and len(data) > 0:
             entry = data[0]
             logger.info(f"📈 Dernière ligne extraite pour {ticker}: {entry['date']}")
-            return [{
-                "date": entry["date"],
-                "open": float(entry["open"]),
-                "close": float(entry["close"]),
-                "high": float(entry["high"]),
-                "low": float(entry["low"]),
-                "volume": float(entry["volume"]),
-                "dividend_amount": float(entry.get("dividend", 0)),
-                "split_coefficient": float(entry.get("split", 1))
-            }]
+            return [parse_eod_entry(entry)]
         return []
     except Exception as e:
         logger.error(f"❌ Erreur extraction EODHD pour {ticker}: {e}")
         return []
 
 def insert_prices(asset_id, ticker, prices):
-    conn = get_oracle_connection()
-    cur = conn.cursor()
-    total = len(prices)
-    for idx, p in enumerate(prices, 1):
-        price_date = datetime.strptime(p["date"], "%Y-%m-%d")
+    rows = [{
+        "price_date": datetime.strptime(p["date"], "%Y-%m-%d"),
+        "open": p["open"],
+        "close": p["close"],
+        "high": p.get("high"),
+        "low": p.get("low"),
+        "volume": p.get("volume"),
+        "dividend_amount": p.get("dividend_amount"),
+        "split_coefficient": p.get("split_coefficient")
+    } for p in prices]
+    return upsert_prices(rows, SOURCE_EODHD, asset_id=asset_id, label=ticker)
+
+def parse_eod_entry(entry):
+    return {
+        "date": entry["date"],
+        "open": float(entry["open"]),
+        "close": float(entry["close"]),
+        "high": float(entry["high"]),
+        "low": float(entry["low"]),
+        "volume": float(entry["volume"]),
+        "dividend_amount": float(entry.get("dividend", 0)),
+        "split_coefficient": float(entry.get("split", 1))
+    }
+
+def get_incremental_targets():
+    """Actifs non crypto avec leur watermark date_max : [(asset_id, ticker, date_max), ...]."""
+    with acquire() as conn:
+        cur = conn.cursor()
         cur.execute("""
-            MERGE INTO prices dst
-            USING (SELECT :asset_id AS asset_id, :price_date AS price_date FROM dual) src
-            ON (dst.asset_id = src.asset_id AND dst.price_date = src.price_date)
-            WHEN MATCHED THEN
-                UPDATE SET open_value = :open, close_value = :close, high_value = :high, low_value = :low, volume = :volume,
-                           dividend_amount = :dividend, split_coefficient = :split, source = 4
-            WHEN NOT MATCHED THEN
-                INSERT (asset_id, price_date, open_value, close_value, high_value, low_value, volume, dividend_amount, split_coefficient, source)
-                VALUES (:asset_id, :price_date, :open, :close, :high, :low, :volume, :dividend, :split, 4)
-        """, {
-            "asset_id": asset_id,
-            "price_date": price_date,
-            "open": p["open"],
-            "close": p["close"],
-            "high": p.get("high"),
-            "low": p.get("low"),
-            "volume": p.get("volume"),
-            "dividend": p.get("dividend_amount"),
-            "split": p.get("split_coefficient")
-        })
-        if idx % 500 == 0 or idx == total:
-            logger.info(f"⏳ Progression {ticker}: {idx}/{total} lignes insérées")
-    conn.commit()
-    cur.close()
-    conn.close()
+            SELECT asset_id, ticker, date_max FROM assets
+            WHERE asset_type IS NULL OR asset_type <> 'CRYPTO'
+        """)
+        targets = cur.fetchall()
+        cur.close()
+    return targets
+
+def link_watchlist_asset_ids(targets):
+    """Associe en un seul executemany les lignes user_watchlist à l'asset_id de leur ticker."""
+    with acquire() as conn:
+        cur = conn.cursor()
+        cur.executemany(
+            "UPDATE user_watchlist SET asset_id = :asset_id WHERE ticker = :ticker "
+            "AND (asset_id IS NULL OR asset_id <> :asset_id)",
+            [{"asset_id": asset_id, "ticker": ticker} for asset_id, ticker, _ in targets]
+        )
+        conn.commit()
+        cur.close()
+
+def incremental_from_date(date_max, today):
+    """Premier jour à demander : lendemain de date_max (ou INITIAL_YEARS d'historique si l'actif est vide)."""
+    if date_max is None:
+        return today - timedelta(days=INITIAL_YEARS * 365)
+    return date_max.date() + timedelta(days=1)
+
+def fetch_eod_since(ticker, from_date, today, fetcher=None):
+    """
+    Barres EODHD de from_date à today (trous de plusieurs jours compris).
+    Retourne (prix, octets reçus) ; aucun appel si la période ne contient aucun jour ouvré.
+    """
+    if from_date > today or np.busday_count(from_date, today + timedelta(days=1)) == 0:
+        return [], 0
+    fetcher = fetcher or EodhdFetcher()
+    data, size = fetcher.eod(ticker, from_date=from_date, to_date=today)
+    if not isinstance(data, list):
+        return [], size
+    return [parse_eod_entry(entry) for entry in data], size
+
+def price_rows(asset_id, prices):
+    """Lignes prêtes pour upsert_prices (avec asset_id, pour un upsert multi-actifs)."""
+    return [{
+        "asset_id": asset_id,
+        "price_date": datetime.strptime(p["date"], "%Y-%m-%d"),
+        "open": p["open"],
+        "close": p["close"],
+        "high": p.get("high"),
+        "low": p.get("low"),
+        "volume": p.get("volume"),
+        "dividend_amount": p.get("dividend_amount"),
+        "split_coefficient": p.get("split_coefficient")
+    } for p in prices]
+
+def update_assets_after_incremental(statuses):
+    """
+    Met à jour en une passe date_min/date_max et le statut d'extraction des actifs traités.
+    statuses : {asset_id: "OK" | "ERROR"}.
+    """
+    if not statuses:
+        return
+    with acquire() as conn:
+        cur = conn.cursor()
+        cur.executemany(
+            "UPDATE assets SET last_extract_status = :1, last_extract_attempt = SYSDATE WHERE asset_id = :2",
+            [(status, asset_id) for asset_id, status in statuses.items()]
+        )
+        cur.execute("""
+            UPDATE assets a
+            SET (date_min, date_max) = (SELECT MIN(p.price_date), MAX(p.price_date) FROM prices p WHERE p.asset_id = a.asset_id)
+            WHERE a.asset_id IN (SELECT column_value FROM TABLE(:ids))
+        """, {"ids": number_list(conn, list(statuses))})
+        conn.commit()
+        cur.close()
+    logger.info(f"🗓️ Dates min/max et statuts mis à jour pour {len(statuses)} actifs")
+
+def fetch_incremental(targets, today, fetcher, rows, statuses):
+    """Appels par ticker depuis date_max + 1. Alimente rows / statuses, retourne les octets reçus."""
+    total_bytes = 0
+    for asset_id, ticker, date_max in targets:
+        from_date = incremental_from_date(date_max, today)
+        try:
+            prices, size = fetch_eod_since(ticker, from_date, today, fetcher)
+        except Exception as e:
+            logger.error(f"❌ Erreur extraction EODHD pour {ticker}: {e}")
+            statuses[asset_id] = "ERROR"
+            continue
+        total_bytes += size
+        statuses[asset_id] = "OK"
+        logger.info(f"📈 {ticker}: {len(prices)} lignes depuis le {from_date}, {size} octets")
+        rows.extend(price_rows(asset_id, prices))
+    return total_bytes
+
+def store_extraction(rows, statuses, label):
+    if rows:
+        upsert_prices(rows, SOURCE_EODHD, label=f"{len(rows)} lignes EODHD ({label})")
+    update_assets_after_incremental(statuses)
+
+def incremental_extract_and_insert(fetcher=None):
+    """
+    Extraction incrémentale : pour chaque actif, seulement les jours postérieurs à assets.date_max
+    (comble automatiquement week-ends et interruptions), puis un seul upsert pour tous les actifs.
+    """
+    fetcher = fetcher or EodhdFetcher()
+    targets = get_incremental_targets()
+    link_watchlist_asset_ids(targets)
+    rows, statuses = [], {}
+    total_bytes = fetch_incremental(targets, date.today(), fetcher, rows, statuses)
+    store_extraction(rows, statuses, "incrémental")
+    logger.info(f"📦 EODHD incrémental : {len(statuses)} actifs, {len(rows)} lignes, {total_bytes / 1024:.1f} Ko reçus")
+
+def group_by_exchange(targets):
+    """
+    Regroupe les actifs par suffixe de place (IES.XETRA -> XETRA, code IES).
+    Retourne ({place: {code: (asset_id, ticker, date_max)}}, actifs sans suffixe).
+    """
+    exchanges, unsuffixed = {}, []
+    for asset_id, ticker, date_max in targets:
+        code, sep, exchange = ticker.rpartition(".")
+        if not sep or not code:
+            unsuffixed.append((asset_id, ticker, date_max))
+            continue
+        exchanges.setdefault(exchange.upper(), {})[code.upper()] = (asset_id, ticker, date_max)
+    return exchanges, unsuffixed
+
+def split_bulk_rows(bulk_data, tracked):
+    """
+    Sépare les actifs suivis d'une place selon le fichier bulk.
+    Retourne ({asset_id: entrée bulk}, actifs à relire ticker par ticker) : absents du fichier,
+    ou dont date_max laisse un trou (jours ouvrés manquants avant la séance du fichier).
+    """
+    by_code = {str(entry.get("code", "")).upper(): entry for entry in bulk_data if isinstance(entry, dict)}
+    from_bulk, fallback = {}, []
+    for code, (asset_id, ticker, date_max) in tracked.items():
+        entry = by_code.get(code)
+        if entry is None or date_max is None:
+            fallback.append((asset_id, ticker, date_max))
+            continue
+        bulk_day = datetime.strptime(entry["date"], "%Y-%m-%d").date()
+        last_day = date_max.date()
+        if bulk_day <= last_day:
+            from_bulk[asset_id] = None  # déjà à jour
+        elif np.busday_count(last_day + timedelta(days=1), bulk_day) > 0:
+            fallback.append((asset_id, ticker, date_max))
+        else:
+            from_bulk[asset_id] = entry
+    return from_bulk, fallback
+
+def bulk_extract_and_insert(fetcher=None, threshold=None):
+    """
+    Extraction par place : un appel eod-bulk-last-day par suffixe de place, filtré aux tickers suivis,
+    seulement si la place compte plus de `threshold` tickers suivis (BULK_THRESHOLD par défaut, soit le
+    coût de l'appel bulk) ; sinon ses tickers passent par l'extraction incrémentale ticker par ticker.
+    Les tickers absents du fichier ou en retard de plus d'une séance y repassent aussi. Un seul upsert
+    pour l'ensemble.
+    """
+    fetcher = fetcher or EodhdFetcher()
+    threshold = BULK_THRESHOLD if threshold is None else threshold
+    targets = get_incremental_targets()
+    link_watchlist_asset_ids(targets)
+    exchanges, fallback = group_by_exchange(targets)
+    rows, statuses = [], {}
+    bulk_bytes, bulk_exchanges = 0, []
+    for exchange, tracked in sorted(exchanges.items()):
+        if len(tracked) <= threshold:
+            logger.info(f"💡 {exchange}: {len(tracked)} tickers suivis (seuil bulk {threshold}), ticker par ticker")
+            fallback.extend(tracked.values())
+            continue
+        bulk_exchanges.append(exchange)
+        try:
+            bulk_data, size = fetcher.bulk_last_day(exchange)
+        except Exception as e:
+            logger.error(f"❌ Erreur bulk EODHD pour {exchange}: {e} (repli ticker par ticker)")
+            fallback.extend(tracked.values())
+            continue
+        bulk_bytes += size
+        from_bulk, missing = split_bulk_rows(bulk_data if isinstance(bulk_data, list) else [], tracked)
+        for asset_id, entry in from_bulk.items():
+            statuses[asset_id] = "OK"
+            if entry is not None:
+                rows.extend(price_rows(asset_id, [parse_eod_entry(entry)]))
+        fallback.extend(missing)
+        logger.info(
+            f"📈 {exchange}: {len(bulk_data)} lignes dans le fichier bulk, {len(from_bulk)} actifs suivis servis, "
+            f"{len(missing)} en repli, {size} octets"
+        )
+    fallback_bytes = fetch_incremental(fallback, date.today(), fetcher, rows, statuses)
+    store_extraction(rows, statuses, "bulk")
+    logger.info(
+        f"📦 EODHD bulk : {len(bulk_exchanges)} appels bulk ({', '.join(bulk_exchanges) or 'aucun'}, "
+        f"{bulk_bytes / 1024:.1f} Ko), "
+        f"{len(fallback)} tickers en repli ({fallback_bytes / 1024:.1f} Ko), {len(rows)} lignes"
+    )
 
 def get_unique_tickers():
     conn = get_oracle_connection()
@@ -197,9 +392,32 @@ def batch_extract_and_insert():
         update_asset_dates(asset_id)
 
 if __name__ == "__main__":
-    batch_extract_and_insert()
+    parser = argparse.ArgumentParser(description="Extraction quotidienne EODHD (actions / ETF)")
+    parser.add_argument("--mode", choices=["bulk", "incremental", "last"], default="incremental",
+                        help="bulk : un appel par place assez suivie ; incremental : jours depuis assets.date_max ; "
+                             "last : dernière barre par ticker")
+    parser.add_argument("--bulk-threshold", type=int, default=None,
+                        help=f"bulk : nombre de tickers suivis au-delà duquel une place passe en bulk "
+                             f"(défaut EODHD_BULK_THRESHOLD={BULK_THRESHOLD})")
+    parser.add_argument("--stub", default=None, help="Rejoue les réponses enregistrées de ce répertoire")
+    parser.add_argument("--record", default=None, help="Enregistre les réponses de l'API dans ce répertoire")
+    args = parser.parse_args()
+    fetcher = RecordedFetcher(args.stub) if args.stub else EodhdFetcher()
+    if args.record:
+        fetcher = RecordingFetcher(fetcher, args.record)
+    if args.mode == "bulk":
+        bulk_extract_and_insert(fetcher, args.bulk_threshold)
+    elif args.mode == "incremental":
+        incremental_extract_and_insert(fetcher)
+    else:
+        batch_extract_and_insert()
     # Calcul des indicateurs après extraction
     from scripts.utils.maj_indicateurs_last_obs import update_last_obs_all_assets
     update_last_obs_all_assets('STOCK')
     update_last_obs_all_assets('ETF')
+    if cache_enabled():
+        refresh_cache()
+    refresh_latest_prices(asset_types=['STOCK', 'ETF'])
+    bump_watermark("prices")
+    log_pool_stats()
     check_and_alert_log("extraction_eodhd_", "extraction_eodhd_")
\ No newline at end of file
@@ -4,6 +4,11 @@ from dotenv import load_dotenv
 from pathlib import Path
 from scripts.utils.bd_oracle_connection import get_oracle_connection
 from scripts.utils.logger import logger
+from scripts.utils.prices_upsert import upsert_prices
+from scripts.utils.candles import CandleBatch
+from scripts.utils.indicator_engine import invalidate_states
+from scripts.utils.latest_prices import refresh_latest_prices
+from scripts.utils.response_cache import bump_watermark
 from scripts.utils.log_checker import check_and_alert_log
 from datetime import datetime, timedelta
 
@@ -12,6 +17,8 @@ load_dotenv(str(Path.home() / "market-watcher/config/.env"))
 EODHD_API_KEY = os.getenv("EODHD_API_KEY")
 api = APIClient(EODHD_API_KEY)
 
+SOURCE_EODHD = 4
+
 def get_or_create_asset_id(ticker):
     conn = get_oracle_connection()
     cur = conn.cursor()
@@ -92,24 +99,12 @@ def fetch_daily_data_eodhd(ticker, years=10):
             from_date=date_from.strftime("%Y-%m-%d"),
             to_date=date_to.strftime("%Y-%m-%d")
         )
-        results = []
-        if data and isinstance(data, list):
-            for entry in data:
-                results.append({
-                    "date": entry["date"],
-                    "open": float(entry["open"]),
-                    "close": float(entry["close"]),
-                    "high": float(entry["high"]),
-                    "low": float(entry["low"]),
-                    "volume": float(entry["volume"]),
-                    "dividend_amount": float(entry.get("dividend", 0)),
-                    "split_coefficient": float(entry.get("split", 1))
-                })
+        results = CandleBatch.from_eod(data if data and isinstance(data, list) else [])
         logger.info(f"📈 {len(results)} lignes extraites pour {ticker}")
         return results
     except Exception as e:
         logger.error(f"❌ Erreur extraction EODHD pour {ticker}: {e}")
-        return []
+        return CandleBatch()
 
 def fetch_last_daily_data_eodhd(ticker):
     logger.info(f"🔎 Extraction dernière daily EODHD pour {ticker}")
@@ -122,53 +117,15 @@ def fetch_last_daily_data_eodhd(ticker):
         if data and isinstance(data, list) and len(data) > 0:
             entry = data[0]
             logger.info(f"📈 Dernière ligne extraite pour {ticker}: {entry['date']}")
-            return [{
-                "date": entry["date"],
-                "open": float(entry["open"]),
-                "close": float(entry["close"]),
-                "high": float(entry["high"]),
-                "low": float(entry["low"]),
-                "volume": float(entry["volume"]),
-                "dividend_amount": float(entry.get("dividend", 0)),
-                "split_coefficient": float(entry.get("split", 1))
-            }]
-        return []
+            return CandleBatch.from_eod([entry])
+        return CandleBatch()
     except Exception as e:
         logger.error(f"❌ Erreur extraction EODHD pour {ticker}: {e}")
-        return []
+        return CandleBatch()
 
 def insert_prices(asset_id, ticker, prices):
-    conn = get_oracle_connection()
-    cur = conn.cursor()
-    total = len(prices)
-    for idx, p in enumerate(prices, 1):
-        price_date = datetime.strptime(p["date"], "%Y-%m-%d")
-        cur.execute("""
-            MERGE INTO prices dst
-            USING (SELECT :asset_id AS asset_id, :price_date AS price_date FROM dual) src
-            ON (dst.asset_id = src.asset_id AND dst.price_date = src.price_date)
-            WHEN MATCHED THEN
-                UPDATE SET open_value = :open, close_value = :close, high_value = :high, low_value = :low, volume = :volume,
-                           dividend_amount = :dividend, split_coefficient = :split, source = 4
-            WHEN NOT MATCHED THEN
-                INSERT (asset_id, price_date, open_value, close_value, high_value, low_value, volume, dividend_amount, split_coefficient, source)
-                VALUES (:asset_id, :price_date, :open, :close, :high, :low, :volume, :dividend, :split, 4)
-        """, {
-            "asset_id": asset_id,
-            "price_date": price_date,
-            "open": p["open"],
-            "close": p["close"],
-            "high": p.get("high"),
-            "low": p.get("low"),
-            "volume": p.get("volume"),
-            "dividend": p.get("dividend_amount"),
-            "split": p.get("split_coefficient")
-        })
-        if idx % 500 == 0 or idx == total:
-            logger.info(f"⏳ Progression {ticker}: {idx}/{total} lignes insérées")
-    conn.commit()
-    cur.close()
-    conn.close()
+    """prices : CandleBatch (fetch_daily_data_eodhd / fetch_last_daily_data_eodhd)."""
+    return upsert_prices(prices, SOURCE_EODHD, asset_id=asset_id, label=ticker)
 
 def get_unique_tickers():
     conn = get_oracle_connection()
@@ -192,6 +149,7 @@ def batch_extract_and_insert():
         if prices:
             insert_prices(asset_id, ticker, prices)
             logger.info(f"✅ Dernière donnée insérée pour {ticker}")
+            invalidate_states([asset_id])
             update_asset_status(asset_id, "OK")
         else:
             update_asset_status(asset_id, "ERROR")
@@ -199,4 +157,6 @@ def batch_extract_and_insert():
 
 if __name__ == "__main__":
     batch_extract_and_insert()
+    refresh_latest_prices(asset_types=['STOCK', 'ETF'])
+    bump_watermark("prices")
     check_and_alert_log("extraction_eodhd_hist", "extraction_eodhd_hist")
\ No newline at end of file
@@ -1,5 +1,5 @@
 from scripts.utils.bd_oracle_connection import get_oracle_connection
-from scripts.search_ticker_eodhd import is_valid_eodhd_ticker
+from scripts.search_ticker_eodhd import validate_eodhd_tickers
 import os
 from dotenv import load_dotenv
 from pathlib import Path
@@ -34,11 +34,12 @@ db_tickers = set(row[0] for row in cur.fetchall())
 missing = [t for t in cac40_tickers if t not in db_tickers]
 
 if missing:
+    validity = validate_eodhd_tickers(missing)
     print("Tickers CAC40 manquants dans assets :")
     for t in missing:
         print("-", t)
         # Vérifie sur EODHD
-        if is_valid_eodhd_ticker(t):
+        if validity[t]:
             print(f"  ✅ Ticker {t} existe sur EODHD, insertion dans assets...")
             asset_name = cac40_names.get(t)
             cur.execute(
@@ -0,0 +1,242 @@
+import argparse
+import random
+import threading
+import time
+from datetime import datetime, timedelta
+import numpy as np
+import requests
+import uvicorn
+from scripts.utils import bd_oracle_connection
+from scripts.utils.logger import logger
+
+# Panneaux Grafana simulés : (endpoint, paramètres)
+GRAFANA_PANELS = [
+    ("/api/system-metrics", {}),
+    ("/api/positions", {}),
+    ("/api/correlation_matrix", {"discord_user": "loadtest"}),
+    ("/api/portfolio_summary", {"discord_user": "loadtest"})
+]
+
+class FakeCollection:
+    def __init__(self):
+        self.values = []
+
+    def extend(self, values):
+        self.values.extend(values)
+
+class FakeType:
+    def newobject(self):
+        return FakeCollection()
+
+class FakeDatabase:
+    """
+    Base de substitution : répond aux requêtes de l'API par motif SQL, avec une latence simulée.
+    Les données sont générées une fois (n_assets actifs sur n_days jours).
+    """
+
+    def __init__(self, n_assets=40, n_days=400, latency_ms=20.0, heavy_latency_ms=120.0):
+        self.latency = latency_ms / 1000
+        self.heavy_latency = heavy_latency_ms / 1000
+        rng = np.random.default_rng(42)
+        today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+        self.days = [today - timedelta(days=n_days - 1 - i) for i in range(n_days)]
+        self.assets = [(1000 + i, f"TICK{i}", f"Actif {i}", "CRYPTO" if i % 4 == 0 else "STOCK") for i in range(n_assets)]
+        self.closes = 100 * np.exp(np.cumsum(rng.normal(0, 0.02, (n_days, n_assets)), axis=0))
+        self.rules = [
+            ("FROM system_metrics", self.latency, self._system_metrics),
+            ("p.price_id = d.last_price_id", self.heavy_latency, self._positions),
+            ("FROM user_watchlist", self.latency, self._watchlist),
+            ("THEN d.max_close", self.heavy_latency, self._daily_closes),
+            ("SELECT DISCORD_USER, TICKER, QTE, TYPE_MVT, DT", self.latency, self._transactions),
+            ("LEFT JOIN latest_prices", self.latency, self._latest_prices),
+            ("TO_CHAR(dt, 'YYYY-MM')", self.latency, self._cashflow),
+            ("FROM cache_watermark", self.latency, lambda params: ([], None))
+        ]
+
+    def execute(self, sql, params):
+        for pattern, latency, handler in self.rules:
+            if pattern in sql:
+                time.sleep(latency * random.uniform(0.5, 1.5))
+                return handler(params or {})
+        time.sleep(self.latency)
+        return [], None
+
+    def _system_metrics(self, params):
+        now = datetime.now()
+        rows = [(now - timedelta(minutes=i), "host-1", 12.5, 48.0, 61.0, 1e6, 2e6, 0.7) for i in range(60)]
+        return rows, None
+
+    def _positions(self, params):
+        columns = ["asset_name", "ticker", "price_date", "close_value", "rsi", "ma52", "ma104",
+                   "prev_close_value", "evolution_prix"]
+        rows = []
+        for j, (_, ticker, name, _) in enumerate(self.assets):
+            for i in range(len(self.days) - 180, len(self.days)):
+                rows.append((name, ticker, self.days[i], float(self.closes[i, j]), 50.0, None, None,
+                             float(self.closes[i - 1, j]), 0.01))
+        return rows, [(c.upper(),) for c in columns]
+
+    def _watchlist(self, params):
+        return [(asset_id, name) for asset_id, _, name, _ in self.assets], None
+
+    def _daily_closes(self, params):
+        rows = []
+        for j, (asset_id, *_rest) in enumerate(self.assets):
+            rows.extend((asset_id, day, float(self.closes[i, j])) for i, day in enumerate(self.days))
+        return rows, None
+
+    def _transactions(self, params):
+        return [("loadtest", ticker, 10, "ACHAT", self.days[0]) for _, ticker, _, _ in self.assets], None
+
+    def _latest_prices(self, params):
+        return [(ticker, asset_id, name, asset_id, float(self.closes[-1, j]), float(self.closes[-2, j]))
+                for j, (asset_id, ticker, name, _) in enumerate(self.assets)], None
+
+    def _cashflow(self, params):
+        return [("2025-01", -1000.0), ("2024-12", 250.0)], None
+
+class FakeCursor:
+    def __init__(self, database):
+        self.database = database
+        self.rows = []
+        self.description = None
+        self.arraysize = 100
+        self.rowcount = 0
+
+    def execute(self, sql, params=None):
+        self.rows, self.description = self.database.execute(sql, params)
+        self.rowcount = len(self.rows)
+
+    def fetchall(self):
+        return list(self.rows)
+
+    def fetchone(self):
+        return self.rows[0] if self.rows else None
+
+    def close(self):
+        pass
+
+class FakeConnection:
+    def __init__(self, pool):
+        self.pool = pool
+
+    def cursor(self):
+        return FakeCursor(self.pool.database)
+
+    def gettype(self, name):
+        return FakeType()
+
+    def commit(self):
+        pass
+
+    def close(self):
+        self.pool.release()
+
+class FakePool:
+    """Remplace le SessionPool cx_Oracle : même plafond de sessions (ORACLE_POOL_MAX), même attente."""
+
+    def __init__(self, database, max_sessions):
+        self.database = database
+        self.max = max_sessions
+        self.semaphore = threading.Semaphore(max_sessions)
+        self.lock = threading.Lock()
+        self.busy = 0
+        self.opened = max_sessions
+
+    def acquire(self):
+        self.semaphore.acquire()
+        with self.lock:
+            self.busy += 1
+        return FakeConnection(self)
+
+    def release(self):
+        with self.lock:
+            self.busy -= 1
+        self.semaphore.release()
+
+    def close(self, force=False):
+        pass
+
+def start_server(app, port):
+    config = uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning")
+    server = uvicorn.Server(config)
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+    return server, thread
+
+def poll_panel(base_url, endpoint, params, interval, deadline, latencies, errors):
+    """Un panneau Grafana : interroge son endpoint toutes les `interval` secondes jusqu'à `deadline`."""
+    session = requests.Session()
+    time.sleep(random.uniform(0, interval))
+    while time.monotonic() < deadline:
+        started = time.perf_counter()
+        try:
+            response = session.get(base_url + endpoint, params=params, timeout=30)
+            body = response.json()
+            if response.status_code != 200 or (isinstance(body, dict) and "error" in body):
+                errors[endpoint] = errors.get(endpoint, 0) + 1
+        except Exception:
+            errors[endpoint] = errors.get(endpoint, 0) + 1
+        latencies[endpoint].append(time.perf_counter() - started)
+        time.sleep(max(0.0, interval - (time.perf_counter() - started)))
+
+def report(latencies, errors, duration):
+    logger.info(f"📊 Résultats sur {duration:.0f}s")
+    for endpoint, values in latencies.items():
+        if not values:
+            continue
+        p50, p95, p99 = np.percentile(np.array(values) * 1000, [50, 95, 99])
+        logger.info(
+            f"   {endpoint:<28} {len(values):>6} req  p50 {p50:8.1f} ms  p95 {p95:8.1f} ms  "
+            f"p99 {p99:8.1f} ms  erreurs {errors.get(endpoint, 0)}"
+        )
+
+def run_loadtest(args):
+    if args.url:
+        base_url = args.url.rstrip("/")
+    else:
+        # Base de substitution branchée à la place du pool Oracle, puis serveur uvicorn local
+        # Import d'abord : l'API réserve ses sessions, la base de substitution prend la même taille de pool
+        from scripts.api_server import app, response_cache
+        database = FakeDatabase(args.assets, args.days, args.db_latency_ms, args.heavy_latency_ms)
+        pool_size = args.pool_size or bd_oracle_connection.pool_max_sessions()
+        logger.info(f"🗄️ Base de substitution : {pool_size} sessions")
+        bd_oracle_connection._pool = FakePool(database, pool_size)
+        if args.no_cache:
+            response_cache.max_entries = 0
+        start_server(app, args.port)
+        base_url = f"http://127.0.0.1:{args.port}"
+
+    latencies = {endpoint: [] for endpoint, _ in GRAFANA_PANELS}
+    errors = {}
+    deadline = time.monotonic() + args.duration
+    threads = []
+    for i in range(args.panels):
+        endpoint, params = GRAFANA_PANELS[i % len(GRAFANA_PANELS)]
+        thread = threading.Thread(
+            target=poll_panel, args=(base_url, endpoint, params, args.interval, deadline, latencies, errors)
+        )
+        thread.start()
+        threads.append(thread)
+    for thread in threads:
+        thread.join()
+    report(latencies, errors, args.duration)
+    return latencies
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Test de charge de l'API (polling type Grafana)")
+    parser.add_argument("--url", default=None, help="API déjà lancée (sinon serveur local sur base de substitution)")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--duration", type=float, default=30, help="Durée du test en secondes")
+    parser.add_argument("--panels", type=int, default=40, help="Nombre de panneaux qui interrogent l'API")
+    parser.add_argument("--interval", type=float, default=2.0, help="Période de rafraîchissement d'un panneau (s)")
+    parser.add_argument("--assets", type=int, default=40, help="Nombre d'actifs de la base de substitution")
+    parser.add_argument("--days", type=int, default=400, help="Jours d'historique de la base de substitution")
+    parser.add_argument("--db-latency-ms", type=float, default=20.0, help="Latence d'une requête simple")
+    parser.add_argument("--heavy-latency-ms", type=float, default=120.0, help="Latence d'une requête sur prices / prices_daily")
+    parser.add_argument("--pool-size", type=int, default=None,
+                        help="Sessions de la base de substitution (défaut : taille du pool Oracle de l'API)")
+    parser.add_argument("--no-cache", action="store_true", help="Désactive le cache de réponses")
+    run_loadtest(parser.parse_args())
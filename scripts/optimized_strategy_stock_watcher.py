@@ -1,11 +1,16 @@
+import argparse
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
 import pandas as pd
 import numpy as np
 from datetime import datetime, timedelta
 from skopt import gp_minimize
 from skopt.space import Integer, Real
-from scripts.utils.bd_oracle_connection import get_oracle_connection
+from scripts.utils.bd_oracle_connection import close_pool, get_oracle_connection
 from scripts.utils.log_checker import check_and_alert_log
 from scripts.utils.logger import logger
+from scripts.utils.price_loader import load_price_histories
 from scripts.utils.report_generator import generate_report
 import matplotlib.pyplot as plt
 import os
@@ -14,6 +19,10 @@ from dotenv import load_dotenv
 # Chargement des variables d'environnement
 load_dotenv(os.path.expanduser('~/market-watcher/config/.env'))
 
+TRAIN_START_DAYS = 1825  # Début de l'historique (5 ans)
+VALIDATION_DAYS = 548  # Derniers 18 mois réservés à la validation
+PHASES = ('load', 'indicator', 'simulate', 'gp')
+
 # --- 1. Récupération des données ---
 def get_cac40_assets():
     """Récupère les tickers CAC40 depuis la base Oracle"""
@@ -29,21 +38,49 @@ def get_cac40_assets():
     conn.close()
     return df
 
+def history_to_df(history):
+    """Convertit un historique du price_loader en DataFrame (price_date, price, volume)"""
+    if history is None:
+        return pd.DataFrame(columns=['price_date', 'price', 'volume'])
+    return pd.DataFrame({
+        'price_date': pd.to_datetime(history['price_date']),
+        'price': history['price'],
+        'volume': history['volume']
+    })
+
 def get_historical_data(asset_id, start_date, end_date):
     """Récupère les données historiques pour un asset"""
-    conn = get_oracle_connection()
-    query = f"""
-        SELECT price_date, close_value as price, volume
-        FROM prices
-        WHERE asset_id = {asset_id}
-        AND price_date BETWEEN TO_DATE('{start_date}', 'YYYY-MM-DD') 
-                          AND TO_DATE('{end_date}', 'YYYY-MM-DD')
-        ORDER BY price_date
-    """
-    df = pd.read_sql(query, conn)
-    df.columns = [c.lower() for c in df.columns]
-    conn.close()
-    return df
+    histories = load_price_histories(
+        [asset_id],
+        start_date=datetime.strptime(start_date, '%Y-%m-%d'),
+        end_date=datetime.strptime(end_date, '%Y-%m-%d'),
+        require_value=False
+    )
+    return history_to_df(histories.get(int(asset_id)))
+
+def load_all_histories(asset_ids, start_date, end_date):
+    """Charge en une requête l'historique de tous les assets sur [start_date, end_date]"""
+    histories = load_price_histories(
+        asset_ids,
+        start_date=datetime.strptime(start_date, '%Y-%m-%d'),
+        end_date=datetime.strptime(end_date, '%Y-%m-%d'),
+        require_value=False
+    )
+    return {int(asset_id): history_to_df(histories.get(int(asset_id))) for asset_id in asset_ids}
+
+def slice_period(df, start_date, end_date):
+    """Sous-période [start_date, end_date] (bornes incluses, comme la requête SQL)"""
+    mask = (df['price_date'] >= pd.Timestamp(start_date)) & (df['price_date'] <= pd.Timestamp(end_date))
+    return df[mask].reset_index(drop=True)
+
+@contextmanager
+def timed(timings, phase):
+    """Cumule dans timings[phase] le temps passé dans le bloc"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[phase] = timings.get(phase, 0.0) + time.perf_counter() - started
 
 # --- 2. Calcul des indicateurs ---
 def compute_technical_indicators(df, ma_window):
@@ -64,9 +101,44 @@ def compute_technical_indicators(df, ma_window):
     
     return df.dropna()
 
+def compute_technical_indicators_base(df):
+    """Partie de compute_technical_indicators indépendante de ma_window (sans dropna)"""
+    df = df[['price_date', 'price', 'volume']].copy()
+    delta = df['price'].diff()
+    gain = delta.where(delta > 0, 0)
+    loss = -delta.where(delta < 0, 0)
+    rs = gain.rolling(14).mean() / loss.rolling(14).mean()
+    df['rsi'] = 100 - (100 / (1 + rs))
+    df['vol_ma20'] = df['volume'].rolling(20).mean()
+    return df
+
+class IndicatorCache:
+    """
+    Indicateurs d'un asset mémorisés par ma_window.
+    RSI et volume moyen ne dépendent pas des paramètres : calculés une seule fois ;
+    seule la moyenne mobile (et le dropna qui en dépend) est calculée par fenêtre candidate.
+    """
+
+    def __init__(self, df):
+        self.base = compute_technical_indicators_base(df)
+        self.frames = {}
+
+    def get(self, ma_window):
+        """Retourne (df, variations de prix) identiques à compute_technical_indicators(df, ma_window)"""
+        ma_window = int(ma_window)
+        cached = self.frames.get(ma_window)
+        if cached is None:
+            df = self.base.copy()
+            df[f'ma{ma_window}'] = df['price'].rolling(ma_window).mean()
+            df = df.dropna()
+            cached = (df, df['price'].pct_change())
+            self.frames[ma_window] = cached
+        return cached
+
 # --- 3. Optimisation des paramètres ---
-def optimize_strategy(asset_id):
+def optimize_strategy(asset_id, train_df=None, timings=None):
     """Trouve les meilleurs paramètres pour un asset"""
+    timings = timings if timings is not None else {}
     # Espace de recherche
     space = [
         Integer(20, 40, name='rsi_buy'),
@@ -74,34 +146,38 @@ def optimize_strategy(asset_id):
         Integer(50, 200, name='ma_window'),
         Real(1.0, 3.0, name='vol_mult')
     ]
-    
+
+    # Données d'entraînement (70% de la période), chargées une seule fois
+    if train_df is None:
+        train_start = (datetime.now() - timedelta(days=TRAIN_START_DAYS)).strftime('%Y-%m-%d')
+        train_end = (datetime.now() - timedelta(days=VALIDATION_DAYS)).strftime('%Y-%m-%d')
+        with timed(timings, 'load'):
+            train_df = get_historical_data(asset_id, train_start, train_end)
+    with timed(timings, 'indicator'):
+        cache = IndicatorCache(train_df)
+
     # Fonction à optimiser
     def evaluate(params):
         rsi_buy, rsi_sell, ma_window, vol_mult = params
-        
-        # Données d'entraînement (70% de la période)
-        train_start = (datetime.now() - timedelta(days=1825)).strftime('%Y-%m-%d')
-        train_end = (datetime.now() - timedelta(days=548)).strftime('%Y-%m-%d')
-        df = get_historical_data(asset_id, train_start, train_end)
-        df = compute_technical_indicators(df, ma_window)
-        
+        with timed(timings, 'indicator'):
+            df, price_change = cache.get(ma_window)
+
         # Simulation
-        df['signal'] = 0
-        buy_cond = (
-            (df['rsi'] < rsi_buy) & 
-            (df['price'] > df[f'ma{ma_window}']) & 
-            (df['volume'] > vol_mult * df['vol_ma20'])
-        )
-        sell_cond = (df['rsi'] > rsi_sell)
-        
-        df.loc[buy_cond, 'signal'] = 1
-        df.loc[sell_cond, 'signal'] = -1
-        
-        # Rendement annualisé
-        returns = df['price'].pct_change()[df['signal'] == 1].sum()
+        with timed(timings, 'simulate'):
+            buy_cond = (
+                (df['rsi'] < rsi_buy) &
+                (df['price'] > df[f'ma{int(ma_window)}']) &
+                (df['volume'] > vol_mult * df['vol_ma20'])
+            )
+            sell_cond = (df['rsi'] > rsi_sell)
+
+            # Rendement annualisé (la vente l'emporte sur l'achat)
+            returns = price_change[buy_cond & ~sell_cond].sum()
         return -returns  # Minimiser l'opposé du rendement
-    
+
     # Optimisation
+    spent_before = timings.get('indicator', 0.0) + timings.get('simulate', 0.0)
+    started = time.perf_counter()
     result = gp_minimize(
         evaluate,
         space,
@@ -109,33 +185,36 @@ def optimize_strategy(asset_id):
         random_state=42,
         verbose=True
     )
-    
+    spent_in_objective = timings.get('indicator', 0.0) + timings.get('simulate', 0.0) - spent_before
+    timings['gp'] = timings.get('gp', 0.0) + time.perf_counter() - started - spent_in_objective
+
     return result.x  # Meilleurs paramètres
 
 # --- 4. Backtest avec paramètres optimisés ---
-def backtest_optimized(asset_id, params, start_date, end_date):
-    """Backtest avec les paramètres optimisés"""
+def backtest_optimized(asset_id, params, start_date, end_date, df=None):
+    """Backtest avec les paramètres optimisés (df : historique déjà chargé, sinon lu en base)"""
     rsi_buy, rsi_sell, ma_window, vol_mult = params
-    df = get_historical_data(asset_id, start_date, end_date)
-    df = compute_technical_indicators(df, ma_window)
-    
+    if df is None:
+        df = get_historical_data(asset_id, start_date, end_date)
+    df = compute_technical_indicators(df.copy(), ma_window)
+
     # Génération des signaux
     df['signal'] = 0
     buy_cond = (
-        (df['rsi'] < rsi_buy) & 
-        (df['price'] > df[f'ma{ma_window}']) & 
+        (df['rsi'] < rsi_buy) &
+        (df['price'] > df[f'ma{ma_window}']) &
         (df['volume'] > vol_mult * df['vol_ma20'])
     )
     sell_cond = (df['rsi'] > rsi_sell)
-    
+
     df.loc[buy_cond, 'signal'] = 1
     df.loc[sell_cond, 'signal'] = -1
-    
+
     # Simulation des trades
     trades = []
     position = 0
     entry_price = 0
-    
+
     for _, row in df.iterrows():
         if row['signal'] == 1 and position == 0:
             position = 1
@@ -147,41 +226,82 @@ def backtest_optimized(asset_id, params, start_date, end_date):
                 'return': (row['price'] - entry_price) / entry_price
             })
             position = 0
-    
+
     return trades
 
+def optimize_asset(asset_id, train_df, validation_df):
+    """Tâche d'un worker : optimisation puis validation d'un asset, avec ses temps par phase"""
+    timings = dict.fromkeys(PHASES, 0.0)
+    best_params = optimize_strategy(asset_id, train_df, timings)
+    with timed(timings, 'simulate'):
+        trades = backtest_optimized(asset_id, best_params, None, None, df=validation_df)
+    return best_params, trades, timings
+
+def log_timings(timings, wall_time):
+    logger.info(
+        f"⏱️ Temps par phase (cumulé sur les workers) : chargement {timings['load']:.2f}s | "
+        f"indicateurs {timings['indicator']:.2f}s | simulation {timings['simulate']:.2f}s | "
+        f"GP {timings['gp']:.2f}s — durée totale {wall_time:.2f}s"
+    )
+
 # --- 5. Workflow Principal ---
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Optimisation des paramètres de stratégie sur le CAC40")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Nombre de process d'optimisation")
+    args = parser.parse_args()
+
     logger.info("Début de l'optimisation")
-    
+    started = time.perf_counter()
+    timings = dict.fromkeys(PHASES, 0.0)
+
     # Paramètres
     assets = get_cac40_assets()
-    validation_start = (datetime.now() - timedelta(days=548)).strftime('%Y-%m-%d')  # Derniers 18 mois
+    train_start = (datetime.now() - timedelta(days=TRAIN_START_DAYS)).strftime('%Y-%m-%d')
+    validation_start = (datetime.now() - timedelta(days=VALIDATION_DAYS)).strftime('%Y-%m-%d')  # Derniers 18 mois
     validation_end = datetime.now().strftime('%Y-%m-%d')
-    
+
+    # Historique complet chargé une seule fois, puis découpé entraînement / validation
+    with timed(timings, 'load'):
+        histories = load_all_histories(assets['asset_id'].tolist(), train_start, validation_end)
+    # Les workers n'accèdent plus à Oracle : on libère le pool avant le fork
+    close_pool()
+
     all_results = []
-    
-    for _, asset in assets.iterrows():
-        try:
-            # Optimisation
-            best_params = optimize_strategy(asset['asset_id'])
-            logger.info(f"Meilleurs paramètres pour {asset['ticker']}: RSI={best_params[0]}/{best_params[1]}, MM={best_params[2]}j, Vol x{best_params[3]:.1f}")
-            
-            # Validation
-            trades = backtest_optimized(asset['asset_id'], best_params, validation_start, validation_end)
-            if trades:
-                avg_return = np.mean([t['return'] for t in trades])
-                all_results.append({
-                    'ticker': asset['ticker'],
-                    'name': asset['asset_name'],
-                    'params': best_params,
-                    'avg_return': avg_return,
-                    'n_trades': len(trades)
-                })
-                
-        except Exception as e:
-            logger.error(f"Erreur sur {asset['ticker']} : {str(e)}")
-    
+
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        futures = []
+        for _, asset in assets.iterrows():
+            df = histories[int(asset['asset_id'])]
+            futures.append((asset, executor.submit(
+                optimize_asset,
+                asset['asset_id'],
+                slice_period(df, train_start, validation_start),
+                slice_period(df, validation_start, validation_end)
+            )))
+
+        for asset, future in futures:
+            try:
+                best_params, trades, asset_timings = future.result()
+                for phase in PHASES:
+                    timings[phase] += asset_timings[phase]
+                logger.info(f"Meilleurs paramètres pour {asset['ticker']}: RSI={best_params[0]}/{best_params[1]}, MM={best_params[2]}j, Vol x{best_params[3]:.1f}")
+
+                # Validation
+                if trades:
+                    avg_return = np.mean([t['return'] for t in trades])
+                    all_results.append({
+                        'ticker': asset['ticker'],
+                        'name': asset['asset_name'],
+                        'params': best_params,
+                        'avg_return': avg_return,
+                        'n_trades': len(trades)
+                    })
+
+            except Exception as e:
+                logger.error(f"Erreur sur {asset['ticker']} : {str(e)}")
+
+    log_timings(timings, time.perf_counter() - started)
+
     # Génération du rapport
     if all_results:
         df_results = pd.DataFrame(all_results)
@@ -189,4 +309,4 @@ if __name__ == "__main__":
         df_results.to_csv('data/outputs/backtest_results/optimized_results.csv', index=False)
         generate_report(df_results)  # Génère un PDF avec matplotlib
         logger.info("Rapport généré dans /data/reports/")
-check_and_alert_log("optimized_strategy_stock_watcher", "optimized_strategy_stock_watcher")
\ No newline at end of file
+check_and_alert_log("optimized_strategy_stock_watcher", "optimized_strategy_stock_watcher")
@@ -2,4 +2,4 @@
 export LD_LIBRARY_PATH=/home/ufcbu/oracle/instantclient/instantclient_23_8
 export TNS_ADMIN=/home/ufcbu/wallet_dbmarketwatcher
 cd /home/ufcbu/market-watcher/
-/usr/bin/python3 -m scripts.extraction_eodhd_
\ No newline at end of file
+/usr/bin/python3 -m scripts.extraction_eodhd_ --mode bulk
\ No newline at end of file
@@ -1,33 +1,133 @@
-from eodhd import APIClient
+import json
 import os
-from dotenv import load_dotenv
+import threading
+import time
+from datetime import date, timedelta
 from pathlib import Path
+from requests import HTTPError
 from scripts.utils.logger import logger
+from scripts.utils.eodhd_client import get_eod
 
-load_dotenv(str(Path.home() / "market-watcher/config/.env"))
-EODHD_API_KEY = os.getenv("EODHD_API_KEY")
-api = APIClient(EODHD_API_KEY)
+# Cache persistant des validations : {ticker: {"valid", "last_seen", "checked_at"}}
+VALIDATION_CACHE_FILE = Path.home() / "market-watcher/data/cache/eodhd_validation.json"
+POSITIVE_TTL = int(os.getenv("EODHD_VALID_TTL", 30 * 24 * 3600))
+NEGATIVE_TTL = int(os.getenv("EODHD_INVALID_TTL", 24 * 3600))
+# Fenêtre de l'appel de validation : assez large pour couvrir week-ends et jours fériés
+VALIDATION_WINDOW_DAYS = 10
 
-def is_valid_eodhd_ticker(ticker):
+class EodhdValidationCache:
     """
-    Vérifie si le ticker est valide sur EODHD en tentant d'extraire la dernière donnée daily.
-    Retourne True si au moins une donnée est trouvée, False sinon.
+    Résultats de validation EODHD par ticker, avec un TTL pour les tickers valides et un TTL plus court
+    pour les invalides (404). Les erreurs réseau / serveur et les tickers sans barre récente ne sont pas
+    mis en cache.
+    """
+
+    def __init__(self, path=VALIDATION_CACHE_FILE, positive_ttl=POSITIVE_TTL, negative_ttl=NEGATIVE_TTL):
+        self.path = Path(path)
+        self.positive_ttl = positive_ttl
+        self.negative_ttl = negative_ttl
+        self.entries = None
+        self.lock = threading.Lock()
+
+    def _load(self):
+        if self.entries is not None:
+            return
+        self.entries = {}
+        if self.path.exists():
+            try:
+                with open(self.path, "r") as f:
+                    self.entries = json.load(f)
+            except Exception as e:
+                logger.warning(f"⚠️ Cache de validation EODHD illisible ({self.path}) : {e}")
+
+    def save(self):
+        with self.lock:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.path.with_suffix(".tmp")
+            with open(tmp_path, "w") as f:
+                json.dump(self.entries or {}, f)
+            tmp_path.replace(self.path)
+
+    def get(self, ticker):
+        """Retourne l'entrée encore valide (selon son TTL) ou None."""
+        with self.lock:
+            self._load()
+            entry = self.entries.get(ticker)
+        if entry is None:
+            return None
+        ttl = self.positive_ttl if entry["valid"] else self.negative_ttl
+        return entry if time.time() - entry["checked_at"] < ttl else None
+
+    def put(self, ticker, valid, last_seen=None):
+        with self.lock:
+            self._load()
+            self.entries[ticker] = {"valid": valid, "last_seen": last_seen, "checked_at": time.time()}
+
+validation_cache = EodhdValidationCache()
+
+def check_eodhd_ticker(ticker):
     """
+    Appel EODHD minimal (VALIDATION_WINDOW_DAYS derniers jours). Retourne (valide, dernière date) :
+    valide vaut None si EODHD connaît le ticker sans barre dans la fenêtre (suspension, longue fermeture) ;
+    lève l'exception pour une erreur réseau / serveur. Dans ces deux cas le résultat n'est pas mis en cache.
+    """
+    today = date.today()
     try:
-        data = api.get_eod_historical_stock_market_data(
-            symbol=ticker,
-            period='d',
-            order='d'
-        )
-        if data and isinstance(data, list) and len(data) > 0:
-            logger.info(f"✅ Ticker {ticker} est valide sur EODHD ({data[0]['date']})")
-            return True
+        data, _ = get_eod(ticker, from_date=today - timedelta(days=VALIDATION_WINDOW_DAYS), to_date=today)
+    except HTTPError as e:
+        if e.response is not None and e.response.status_code == 404:
+            return False, None
+        raise
+    if data and isinstance(data, list):
+        return True, data[-1]["date"]
+    return None, None
+
+def validate_eodhd_tickers(tickers, cache=None):
+    """
+    Valide une liste de tickers (dédoublonnée) via le cache puis EODHD pour les absents / expirés.
+    Retourne {ticker: bool} ; le cache est sauvegardé une fois en fin de lot.
+    """
+    cache = cache or validation_cache
+    results = {}
+    checked = cached = errors = 0
+    for ticker in dict.fromkeys(tickers):
+        entry = cache.get(ticker)
+        if entry is not None:
+            results[ticker] = entry["valid"]
+            cached += 1
+            continue
+        try:
+            valid, last_seen = check_eodhd_ticker(ticker)
+        except Exception as e:
+            logger.error(f"Erreur lors de la vérification du ticker EODHD : {e}")
+            results[ticker] = False
+            errors += 1
+            continue
+        checked += 1
+        if valid is None:
+            logger.warning(f"⚠️ Ticker {ticker} sans barre récente sur EODHD (non mis en cache)")
+            results[ticker] = False
+            continue
+        cache.put(ticker, valid, last_seen)
+        results[ticker] = valid
+        if valid:
+            logger.info(f"✅ Ticker {ticker} est valide sur EODHD ({last_seen})")
         else:
             logger.warning(f"❌ Ticker {ticker} est invalide ou absent sur EODHD")
-            return False
-    except Exception as e:
-        logger.error(f"Erreur lors de la vérification du ticker EODHD : {e}")
-        return False
+    if checked:
+        cache.save()
+    logger.info(
+        f"🔎 Validation EODHD : {len(results)} tickers, {checked} appels, {cached} depuis le cache, "
+        f"{errors} en erreur"
+    )
+    return results
+
+def is_valid_eodhd_ticker(ticker):
+    """
+    Vérifie si le ticker est valide sur EODHD (cache, sinon une barre sur les derniers jours).
+    Retourne True si au moins une donnée est trouvée, False sinon.
+    """
+    return validate_eodhd_tickers([ticker])[ticker]
 
 # Exemple d'utilisation
 #if __name__ == "__main__":
@@ -1,6 +1,7 @@
 import pandas as pd
 from scripts.utils.bd_oracle_connection import get_oracle_connection
 from scripts.utils.log_checker import check_and_alert_log
+from scripts.utils.price_loader import load_price_histories
 from pathlib import Path
 from dotenv import load_dotenv
 import requests
@@ -22,17 +23,19 @@ def get_assets_user_watchlist():
     df.columns = [c.lower() for c in df.columns]
     return df
 
+def history_to_df(history):
+    return pd.DataFrame({
+        "price_date": pd.to_datetime(history["price_date"]),
+        "price": history["price"],
+        "volume": history["volume"]
+    })
+
 def get_prices(asset_id):
-    conn = get_oracle_connection()
-    df = pd.read_sql(f"""
-        SELECT price_date, close_value as price, volume
-        FROM prices
-        WHERE asset_id = {asset_id} AND close_value IS NOT NULL
-        ORDER BY price_date
-    """, conn)
-    conn.close()
-    df.columns = [c.lower() for c in df.columns]
-    return df
+    histories = load_price_histories([asset_id], value_column="close_value")
+    history = histories.get(int(asset_id))
+    if history is None:
+        return pd.DataFrame(columns=["price_date", "price", "volume"])
+    return history_to_df(history)
 
 def compute_rsi(prices, window=14):
     delta = prices.diff()
@@ -163,8 +166,13 @@ def synthese_evol(user_evol):
 if __name__ == "__main__":
     assets = get_assets_user_watchlist()
     achats, ventes, conserver = [], [], []
+    # Un seul aller-retour Oracle pour l'historique de tous les actifs
+    histories = load_price_histories(assets["asset_id"], value_column="close_value")
     for _, row in assets.iterrows():
-        df = get_prices(row["asset_id"])
+        history = histories.get(int(row["asset_id"]))
+        if history is None:
+            continue
+        df = history_to_df(history)
         if len(df) < 200 or df["price"].isnull().all():
             continue
 
@@ -1,6 +1,9 @@
+import argparse
+import time
 import pandas as pd
 from scripts.utils.bd_oracle_connection import get_oracle_connection
 from scripts.utils.logger import logger
+from scripts.utils.price_loader import load_price_histories
 from datetime import datetime, timedelta
 from dotenv import load_dotenv
 import numpy as np
@@ -23,21 +26,25 @@ def get_cac40_assets():
     conn.close()
     return df
 
+def history_to_df(history):
+    """Convertit un historique du price_loader en DataFrame (price_date, price, volume)"""
+    if history is None:
+        return pd.DataFrame(columns=['price_date', 'price', 'volume'])
+    return pd.DataFrame({
+        'price_date': pd.to_datetime(history['price_date']),
+        'price': history['price'],
+        'volume': history['volume']
+    })
+
 def get_historical_data(asset_id, start_date, end_date):
     """Récupère les données historiques pour un asset"""
-    conn = get_oracle_connection()
-    query = f"""
-        SELECT price_date, close_value as price, volume
-        FROM prices
-        WHERE asset_id = {asset_id}
-        AND price_date BETWEEN TO_DATE('{start_date}', 'YYYY-MM-DD') 
-                          AND TO_DATE('{end_date}', 'YYYY-MM-DD')
-        ORDER BY price_date
-    """
-    df = pd.read_sql(query, conn)
-    df.columns = [c.lower() for c in df.columns]  # Ajoute cette ligne !
-    conn.close()
-    return df
+    histories = load_price_histories(
+        [asset_id],
+        start_date=datetime.strptime(start_date, '%Y-%m-%d'),
+        end_date=datetime.strptime(end_date, '%Y-%m-%d'),
+        require_value=False
+    )
+    return history_to_df(histories.get(int(asset_id)))
 
 def compute_technical_indicators(df):
     """Calcule tous les indicateurs techniques"""
@@ -82,61 +89,46 @@ def generate_signals(df):
     
     return df
 
-def backtest_strategy():
-    """Backtest complet de la stratégie"""
-    logger.info("Début du backtest")
-    
-    # Paramètres
-    start_date = (datetime.now() - timedelta(days=1825)).strftime('%Y-%m-%d')
-    end_date = datetime.now().strftime('%Y-%m-%d')
-    initial_capital = 10000
-    position_size = 0.1  # 10% du capital par position
-    
-    # Récupération des assets
-    assets = get_cac40_assets()
-    if assets.empty:
-        logger.error("Aucun actif CAC40 trouvé")
-        return
-    
-    portfolio = {}
+def simulate_trades(df, initial_capital, position_size):
+    """Simulation ligne à ligne (implémentation de référence, utilisée par --check)"""
+    position = 0
+    entry_price = 0
+    trade_results = []
+
+    for i, row in df.iterrows():
+        if row['signal'] == 1 and position == 0:  # Achat
+            position = (initial_capital * position_size) / row['price']
+            entry_price = row['price']
+            trade_results.append({
+                'date': row['price_date'],
+                'action': 'BUY',
+                'price': row['price'],
+                'shares': position
+            })
+        elif row['signal'] == -1 and position > 0:  # Vente
+            trade_results.append({
+                'date': row['price_date'],
+                'action': 'SELL',
+                'price': row['price'],
+                'shares': position,
+                'return': (row['price'] - entry_price) / entry_price
+            })
+            position = 0
+    return trade_results
+
+def backtest_assets_loop(assets, histories, initial_capital, position_size):
+    """Backtest actif par actif avec la boucle iterrows (référence)"""
     results = []
-    
     for _, asset in assets.iterrows():
         try:
-            # Récupération des données
-            df = get_historical_data(asset['asset_id'], start_date, end_date)
+            df = history_to_df(histories.get(int(asset['asset_id'])))
             if len(df) < 200:
                 continue
-                
-            # Calcul des indicateurs
+
             df = compute_technical_indicators(df)
             df = generate_signals(df)
-            
-            # Simulation des trades
-            position = 0
-            entry_price = 0
-            trade_results = []
-            
-            for i, row in df.iterrows():
-                if row['signal'] == 1 and position == 0:  # Achat
-                    position = (initial_capital * position_size) / row['price']
-                    entry_price = row['price']
-                    trade_results.append({
-                        'date': row['price_date'],
-                        'action': 'BUY',
-                        'price': row['price'],
-                        'shares': position
-                    })
-                elif row['signal'] == -1 and position > 0:  # Vente
-                    trade_results.append({
-                        'date': row['price_date'],
-                        'action': 'SELL',
-                        'price': row['price'],
-                        'shares': position,
-                        'return': (row['price'] - entry_price) / entry_price
-                    })
-                    position = 0
-                    
+            trade_results = simulate_trades(df, initial_capital, position_size)
+
             if trade_results:
                 results.append({
                     'ticker': asset['ticker'],
@@ -144,25 +136,175 @@ def backtest_strategy():
                     'trades': trade_results,
                     'total_return': sum(t['return'] for t in trade_results if 'return' in t)
                 })
-                
+
         except Exception as e:
             logger.error(f"Erreur pour {asset['ticker']}: {str(e)}")
-    
+    return results
+
+def build_panel(histories, asset_ids):
+    """
+    Construit les panels 2-D (observations × actifs) prix, volume et dates.
+    La ligne k contient la k-ième observation de chaque actif (complétée par NaN en fin de colonne),
+    ce qui donne exactement les mêmes fenêtres glissantes que le calcul actif par actif.
+    """
+    lengths = [len(histories[a]['price']) for a in asset_ids]
+    n_rows = max(lengths)
+    price = np.full((n_rows, len(asset_ids)), np.nan)
+    volume = np.full((n_rows, len(asset_ids)), np.nan)
+    dates = np.full((n_rows, len(asset_ids)), np.datetime64('NaT'), dtype='datetime64[s]')
+    for j, (asset_id, length) in enumerate(zip(asset_ids, lengths)):
+        history = histories[asset_id]
+        price[:length, j] = history['price']
+        volume[:length, j] = history['volume']
+        dates[:length, j] = history['price_date']
+    return price, volume, dates
+
+def compute_panel_indicators(price, volume):
+    """Mêmes indicateurs que compute_technical_indicators, calculés sur toutes les colonnes à la fois"""
+    prices = pd.DataFrame(price)
+    delta = prices.diff()
+    gain = delta.where(delta > 0, 0)
+    loss = -delta.where(delta < 0, 0)
+    rs = gain.rolling(14).mean() / loss.rolling(14).mean()
+    indicators = {
+        'ma20': prices.rolling(20).mean().to_numpy(),
+        'ma50': prices.rolling(50).mean().to_numpy(),
+        'ma200': prices.rolling(200).mean().to_numpy(),
+        'rsi': (100 - (100 / (1 + rs))).to_numpy(),
+        'vol_ma20': pd.DataFrame(volume).rolling(20).mean().to_numpy()
+    }
+    # Équivalent du dropna() : une ligne n'est exploitable que si toutes ses colonnes sont renseignées
+    valid = ~np.isnan(price) & ~np.isnan(volume)
+    for values in indicators.values():
+        valid &= ~np.isnan(values)
+    return indicators, valid
+
+def generate_panel_signals(price, volume, indicators, valid):
+    """Signaux 1 / -1 / 0 pour tout le panel (la vente l'emporte sur l'achat, comme generate_signals)"""
+    with np.errstate(invalid='ignore'):
+        buy = (indicators['rsi'] < 30) & (price > indicators['ma200']) & (volume > indicators['vol_ma20'])
+        sell = (indicators['rsi'] > 70) | (price < indicators['ma50'])
+    signal = np.where(sell, -1, np.where(buy, 1, 0)).astype(np.int8)
+    signal[~valid] = 0
+    return signal
+
+def simulate_panel(price, signal, initial_capital, position_size):
+    """
+    Dérive entrées, sorties et rendements sans itérer sur les lignes.
+    Après un signal non nul, la position est ouverte si ce signal vaut 1 et fermée s'il vaut -1 :
+    l'état avant chaque ligne est donc le dernier signal non nul des lignes précédentes (forward fill).
+    """
+    n_rows, n_assets = signal.shape
+    rows = np.arange(n_rows)[:, None]
+    last_signal_row = np.maximum.accumulate(np.where(signal != 0, rows, -1), axis=0)
+    previous_row = np.vstack((np.full((1, n_assets), -1), last_signal_row[:-1]))
+    previous_signal = np.where(
+        previous_row >= 0,
+        np.take_along_axis(signal, np.maximum(previous_row, 0), axis=0),
+        0
+    )
+    long_before = previous_signal == 1
+    entries = (signal == 1) & ~long_before
+    exits = (signal == -1) & long_before
+
+    entry_row = np.maximum.accumulate(np.where(entries, rows, -1), axis=0)
+    entry_price = np.take_along_axis(price, np.maximum(entry_row, 0), axis=0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        shares = (initial_capital * position_size) / entry_price
+        returns = (price - entry_price) / entry_price
+    return entries, exits, shares, returns
+
+def backtest_assets(assets, histories, initial_capital, position_size):
+    """Backtest vectorisé de tous les actifs en une passe sur le panel"""
+    names = {int(a['asset_id']): (a['ticker'], a['asset_name']) for _, a in assets.iterrows()}
+    asset_ids = [a for a in names if a in histories and len(histories[a]['price']) >= 200]
+    if not asset_ids:
+        return []
+
+    price, volume, dates = build_panel(histories, asset_ids)
+    indicators, valid = compute_panel_indicators(price, volume)
+    signal = generate_panel_signals(price, volume, indicators, valid)
+    entries, exits, shares, returns = simulate_panel(price, signal, initial_capital, position_size)
+
+    results = []
+    trade_assets, trade_obs = np.nonzero((entries | exits).T)
+    for j in np.unique(trade_assets):
+        trade_results = []
+        for t in trade_obs[trade_assets == j]:
+            trade = {
+                'date': pd.Timestamp(dates[t, j]),
+                'action': 'BUY' if entries[t, j] else 'SELL',
+                'price': price[t, j],
+                'shares': shares[t, j]
+            }
+            if exits[t, j]:
+                trade['return'] = returns[t, j]
+            trade_results.append(trade)
+        ticker, name = names[asset_ids[j]]
+        results.append({
+            'ticker': ticker,
+            'name': name,
+            'trades': trade_results,
+            'total_return': sum(t['return'] for t in trade_results if 'return' in t)
+        })
+    return results
+
+def backtest_strategy(check=False):
+    """Backtest complet de la stratégie"""
+    logger.info("Début du backtest")
+
+    # Paramètres
+    start_date = (datetime.now() - timedelta(days=1825)).strftime('%Y-%m-%d')
+    end_date = datetime.now().strftime('%Y-%m-%d')
+    initial_capital = 10000
+    position_size = 0.1  # 10% du capital par position
+
+    # Récupération des assets
+    assets = get_cac40_assets()
+    if assets.empty:
+        logger.error("Aucun actif CAC40 trouvé")
+        return
+
+    # Un seul chargement pour tout l'indice
+    histories = load_price_histories(
+        assets['asset_id'].tolist(),
+        start_date=datetime.strptime(start_date, '%Y-%m-%d'),
+        end_date=datetime.strptime(end_date, '%Y-%m-%d'),
+        require_value=False
+    )
+
+    started = time.perf_counter()
+    results = backtest_assets(assets, histories, initial_capital, position_size)
+    logger.info(f"⏱️ Backtest vectorisé : {len(assets)} actifs en {time.perf_counter() - started:.3f}s")
+
+    if check:
+        started = time.perf_counter()
+        reference = backtest_assets_loop(assets, histories, initial_capital, position_size)
+        logger.info(f"⏱️ Boucle de référence : {time.perf_counter() - started:.3f}s")
+        if results == reference:
+            logger.info("✅ Résultats identiques à la boucle actif par actif")
+        else:
+            logger.error("❌ Écart entre le backtest vectorisé et la boucle de référence")
+
     # Analyse des résultats
     if results:
         total_return = sum(r['total_return'] for r in results) / len(results)
         best_trade = max(results, key=lambda x: x['total_return'])
         worst_trade = min(results, key=lambda x: x['total_return'])
-        
+
         logger.info(f"\nRésultats du backtest:")
         logger.info(f"Rendement moyen: {total_return:.2%}")
         logger.info(f"Meilleur trade: {best_trade['name']} ({best_trade['total_return']:.2%})")
         logger.info(f"Pire trade: {worst_trade['name']} ({worst_trade['total_return']:.2%})")
-        
+
         # Export des résultats pour analyse
         pd.DataFrame(results).to_csv('backtest_results.csv', index=False)
     else:
         logger.info("Aucun trade généré pendant la période")
 
 if __name__ == "__main__":
-    backtest_strategy()
+    parser = argparse.ArgumentParser(description="Backtest de la stratégie sur le CAC40")
+    parser.add_argument("--check", action="store_true",
+                        help="Compare le moteur vectorisé à la boucle actif par actif")
+    args = parser.parse_args()
+    backtest_strategy(check=args.check)
@@ -1,6 +1,7 @@
 import datetime
 from scripts.utils.bd_oracle_connection import get_oracle_connection
 from scripts.utils.logger import logger
+from scripts.utils.response_cache import bump_watermark
 import time
 import pandas as pd
 from pathlib import Path
@@ -92,3 +93,4 @@ if __name__ == "__main__":
 
     today = datetime.datetime.now()
     sync_watchlist_to_transactions(date_exec=today)
+    bump_watermark("transactions")
@@ -5,13 +5,17 @@ import requests
 import os
 from scripts.utils.bd_oracle_connection import get_oracle_connection
 from scripts.utils.logger import logger
-from scripts.search_ticker_eodhd import is_valid_eodhd_ticker
+from scripts.search_ticker_eodhd import validate_eodhd_tickers
 from scripts.utils.search_ticker_coinbase import search_pair_coinbase
-from scripts.extraction_eodhd_hist import fetch_daily_data_eodhd, insert_prices, update_asset_dates
-from scripts.extraction_coinbase_histo_ import fetch_coinbase_ohlc_1h, insert_price, update_asset_dates_and_status
+from scripts.backfill_queue import BackfillQueue, BackfillWorkers
 
 
 DATA_DIR = Path.home() / "market-watcher/data"
+BACKFILL_WORKERS = 4
+
+# Backfills historiques des nouveaux actifs : mis en file, vidés en arrière-plan par les workers
+backfill_queue = None
+backfill_workers = None
 
 def insert_user_watchlist(csv_path, discord_user):
     try:
@@ -126,11 +130,12 @@ def validate_and_update_tickers(tickers_to_validate):
     tickers_to_insert = {t: v for t, v in tickers_to_validate.items() if t not in existing_assets}
 
     corrections = []
+    validity = validate_eodhd_tickers(tickers_to_insert)
 
     for ticker, info in tickers_to_insert.items():
         asset_name = info.get("asset_name")
         asset_type = info.get("asset_type")
-        if is_valid_eodhd_ticker(ticker):
+        if validity[ticker]:
             conn = get_oracle_connection()
             logger.info("🔗 Connexion Oracle pour insertion des actifs type : actions(Stock & ETF) dans la table Assets")
             cur = conn.cursor()
@@ -235,37 +240,18 @@ def get_or_create_asset_id(ticker, asset_name=None, asset_type=None):
         if isinstance(asset_id, list):
             asset_id = asset_id[0]
         conn.commit()
-        # Extraction historique pour les nouveaux actifs
-        if asset_type and asset_type.upper() in ("STOCK", "ETF"):
-            try:
-                prices = fetch_daily_data_eodhd(ticker, years=10)
-                if prices:
-                    insert_prices(asset_id, ticker, prices)
-                    update_asset_dates(asset_id)
-                    logger.info(f"✅ Extraction historique auto pour {ticker} (asset_id={asset_id}) terminée.")
-                else:
-                    logger.warning(f"⚠️ Extraction historique auto pour {ticker} (asset_id={asset_id}) : aucune donnée récupérée.")
-            except Exception as e:
-                logger.error(f"❌ Erreur extraction historique auto pour {ticker} (asset_id={asset_id}): {e}")
-        elif asset_type and asset_type.upper() == "CRYPTO":
-            try:
-                ohlc_list = fetch_coinbase_ohlc_1h(ticker)
-                status = "OK" if ohlc_list else "ERROR"
-                if ohlc_list:
-                    for ohlc in ohlc_list:
-                        insert_price(asset_id, ticker, ohlc)
-                    update_asset_dates_and_status(asset_id, ohlc_list, status)
-                    logger.info(f"✅ Extraction historique auto CRYPTO pour {ticker} (asset_id={asset_id}) terminée.")
-                else:
-                    update_asset_dates_and_status(asset_id, [], status)
-                    logger.warning(f"⚠️ Extraction historique auto CRYPTO pour {ticker} (asset_id={asset_id}) : aucune donnée récupérée.")
-            except Exception as e:
-                logger.error(f"❌ Erreur extraction historique auto CRYPTO pour {ticker} (asset_id={asset_id}): {e}")
+        # Extraction historique des nouveaux actifs : mise en file, sans bloquer l'ingestion du CSV
+        # (sans workers actifs, le job attend le prochain `python -m scripts.backfill_queue run`)
+        queue = backfill_queue or BackfillQueue()
+        if queue.enqueue(asset_id, ticker, asset_type) and backfill_workers is not None:
+            backfill_workers.notify()
     cur.close()
     conn.close()
     return asset_id
 
 if __name__ == "__main__":
+    backfill_queue = BackfillQueue()
+    backfill_workers = BackfillWorkers(backfill_queue, BACKFILL_WORKERS).start()
     all_to_validate = {}
     all_corrections = []
     for csv_file in DATA_DIR.glob("watch_pf_*.csv"):
@@ -274,4 +260,6 @@ if __name__ == "__main__":
         remove_missing_from_watchlist(csv_file, discord_user)
         all_to_validate.update(tickers)
         all_corrections.extend(corrections)
-    validate_and_update_tickers(all_to_validate)
\ No newline at end of file
+    validate_and_update_tickers(all_to_validate)
+    # Attend la fin des backfills (les jobs en échec restent visibles : python -m scripts.backfill_queue status)
+    backfill_workers.drain()
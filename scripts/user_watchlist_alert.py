@@ -3,8 +3,10 @@ from scripts.utils.bd_oracle_connection import get_oracle_connection
 from scripts.utils.discord_manager import DiscordManager
 from scripts.utils.portfolio_tracker import PortfolioTracker
 from scripts.utils.logger import logger
+from scripts.utils.price_loader import load_price_histories
 from scripts.utils.log_checker import check_and_alert_log
 from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 from dotenv import load_dotenv
 import os
@@ -38,39 +40,34 @@ class WatchlistAnalyzer:
         df.columns = [c.lower() for c in df.columns]
         return df.groupby('discord_id')
 
-    def analyze_asset(self, asset_id, asset_type):
+    def load_histories(self, watchlists):
+        """Charge en deux requêtes (crypto agrégée par jour / autres) l'historique de tous les actifs suivis."""
+        assets = watchlists[['asset_id', 'asset_type']].dropna().drop_duplicates()
+        crypto_ids = assets.loc[assets['asset_type'] == 'CRYPTO', 'asset_id']
+        other_ids = assets.loc[assets['asset_type'] != 'CRYPTO', 'asset_id']
+        histories = {}
+        histories.update(load_price_histories(crypto_ids, value_column="price_value", daily=True, since_days=400))
+        histories.update(load_price_histories(other_ids, value_column="close_value", since_days=400))
+        return histories
+
+    def analyze_asset(self, asset_id, asset_type, history=None):
         """Version optimisée avec gestion complète des cryptos"""
-        conn = None
         try:
-            conn = get_oracle_connection()
-            if asset_type == 'CRYPTO':
-                query = f"""
-                    SELECT 
-                        TRUNC(price_date) as price_date,
-                        MAX(price_value) as price,
-                        SUM(volume) as volume
-                    FROM prices
-                    WHERE asset_id = {asset_id}
-                    AND price_value IS NOT NULL
-                    AND price_date >= SYSDATE - 400
-                    GROUP BY TRUNC(price_date)
-                    ORDER BY TRUNC(price_date) ASC
-                """
-            else:
-                query = f"""
-                    SELECT 
-                        price_date,
-                        close_value as price,
-                        volume
-                    FROM prices
-                    WHERE asset_id = {asset_id}
-                    AND close_value IS NOT NULL
-                    AND price_date >= SYSDATE - 400
-                    ORDER BY price_date ASC
-                """
-
-            df = pd.read_sql(query, conn)
-            df.columns = [c.lower() for c in df.columns]
+            if history is None:
+                if asset_type == 'CRYPTO':
+                    histories = load_price_histories([asset_id], value_column="price_value", daily=True, since_days=400)
+                else:
+                    histories = load_price_histories([asset_id], value_column="close_value", since_days=400)
+                history = histories.get(int(asset_id))
+            if history is None:
+                logger.warning(f"Données insuffisantes (0 points) pour {asset_id}")
+                return None
+
+            df = pd.DataFrame({
+                'price_date': pd.to_datetime(history['price_date']),
+                'price': history['price'],
+                'volume': history['volume']
+            })
             df = df.sort_values('price_date', ascending=True).reset_index(drop=True)
             df = df.dropna(subset=['price'])
             df = df[df['price'] > 0]
@@ -116,9 +113,6 @@ class WatchlistAnalyzer:
         except Exception as e:
             logger.error(f"Erreur majeure sur asset {asset_id}: {str(e)}", exc_info=True)
             return None
-        finally:
-            if conn:
-                conn.close()
 
     def compute_rsi(self, prices, window=14):
         delta = prices.diff()
@@ -175,11 +169,31 @@ class WatchlistAnalyzer:
             signal = 'SELL'
         return signal
 
-    def generate_detailed_report(self, discord_id, group):
-        # 1. Récupération des données
+    def analyze_assets(self, watchlists, max_workers=8):
+        """Phase 1 : analyse une seule fois chaque asset_id distinct, en parallèle. Retourne {asset_id: analyse}."""
+        assets = watchlists[['asset_id', 'asset_type']].dropna().drop_duplicates(subset=['asset_id'])
+        histories = self.load_histories(assets)
+        items = [(int(row.asset_id), row.asset_type) for row in assets.itertuples()]
+
+        def analyze(item):
+            asset_id, asset_type = item
+            history = histories.get(asset_id)
+            if history is None:
+                logger.warning(f"Données insuffisantes (0 points) pour {asset_id}")
+                return None
+            return self.analyze_asset(asset_id, asset_type, history)
+
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(items) or 1))) as executor:
+            return dict(zip([asset_id for asset_id, _ in items], executor.map(analyze, items)))
+
+    def generate_detailed_report(self, discord_id, group, analyses=None):
+        # 1. Récupération des données (analyses déjà calculées en phase 1 si fournies)
         asset_reports = []
         for _, row in group.iterrows():
-            analysis = self.analyze_asset(row['asset_id'], row['asset_type'])
+            if analyses is not None:
+                analysis = analyses.get(int(row['asset_id'])) if pd.notnull(row['asset_id']) else None
+            else:
+                analysis = self.analyze_asset(row['asset_id'], row['asset_type'])
             if analysis:
                 asset_reports.append({
                     'ticker': row['ticker'],
@@ -339,10 +353,17 @@ class WatchlistAnalyzer:
     def run(self):
         """Version simplifiée sans doublons"""
         user_groups = list(self.get_user_watchlists())
+        if not user_groups:
+            return
+        # Phase 1 : une analyse par actif distinct, quel que soit le nombre d'utilisateurs qui le suivent
+        watchlists = pd.concat([group for _, group in user_groups])
+        analyses = self.analyze_assets(watchlists)
+        logger.info(f"📊 {len(analyses)} actifs analysés pour {len(watchlists)} lignes de watchlist servies")
+        # Phase 2 : distribution des résultats dans le rapport de chaque utilisateur
         for discord_id, group in user_groups:
             try:
                 # Envoi du rapport unique
-                detailed_report = self.generate_detailed_report(discord_id, group)
+                detailed_report = self.generate_detailed_report(discord_id, group, analyses)
                 if detailed_report:
                     self.discord.send_detailed_report(discord_id, detailed_report)
             except Exception as e:
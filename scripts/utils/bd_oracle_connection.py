@@ -1,12 +1,25 @@
 from dotenv import load_dotenv
 from pathlib import Path
+from contextlib import contextmanager
+import threading
+import time
+import atexit
 import cx_Oracle
 import os
 from scripts.utils.logger import logger
 
-def get_oracle_connection():
+ENV_FILE = "/home/ufcbu/market-watcher/config/.env"
+
+# Pool de sessions partagé par tout le process (créé à la première demande)
+_pool = None
+_pool_lock = threading.Lock()
+_pool_stats = {"acquired": 0, "wait_total": 0.0, "wait_max": 0.0}
+# Plancher de ORACLE_POOL_MAX demandé par le process (ex : un thread d'exécuteur = une session pour l'API)
+_pool_max_floor = 0
+
+def _load_credentials():
     # Charge les variables d'environnement depuis le .env
-    load_dotenv("/home/ufcbu/market-watcher/config/.env")
+    load_dotenv(ENV_FILE)
 
     user = os.getenv("ORACLE_USER")
     pwd = os.getenv("ORACLE_PASSWORD")
@@ -22,20 +35,150 @@ def get_oracle_connection():
     if not dsn:
         logger.error("❌ Oracle DSN non chargé ! Vérifiez votre fichier .env.")
         return None
+    return user, pwd, dsn
+
+def pool_max_sessions():
+    """Taille maximale du pool : ORACLE_POOL_MAX, relevée au besoin par reserve_pool_sessions."""
+    return max(int(os.getenv("ORACLE_POOL_MAX", "4")), _pool_max_floor)
+
+def reserve_pool_sessions(sessions):
+    """
+    Garantit au moins `sessions` sessions au pool ; à appeler avant sa création (premier acquire).
+    Retourne la taille maximale retenue.
+    """
+    global _pool_max_floor
+    with _pool_lock:
+        _pool_max_floor = max(_pool_max_floor, sessions)
+        if _pool is not None and _pool.max < sessions:
+            logger.warning(f"⚠️ Pool Oracle déjà créé avec max={_pool.max} < {sessions} sessions demandées")
+    return pool_max_sessions()
 
+def get_pool():
+    """Retourne le pool de sessions Oracle, créé paresseusement au premier appel.
+    Taille configurable via ORACLE_POOL_MIN / ORACLE_POOL_MAX / ORACLE_POOL_INCREMENT (voir pool_max_sessions)."""
+    global _pool
+    if _pool is not None:
+        return _pool
+    with _pool_lock:
+        if _pool is not None:
+            return _pool
+        credentials = _load_credentials()
+        if not credentials:
+            return None
+        user, pwd, dsn = credentials
+        pool_min = int(os.getenv("ORACLE_POOL_MIN", "1"))
+        pool_max = pool_max_sessions()
+        pool_increment = int(os.getenv("ORACLE_POOL_INCREMENT", "1"))
+        try:
+            _pool = cx_Oracle.SessionPool(
+                user, pwd, dsn,
+                min=pool_min, max=pool_max, increment=pool_increment,
+                threaded=True, getmode=cx_Oracle.SPOOL_ATTRVAL_WAIT
+            )
+            logger.info(f"✅ Pool Oracle créé (min={pool_min}, max={pool_max}, increment={pool_increment})")
+        except Exception as e:
+            logger.error(f"❌ Erreur création du pool Oracle : {e}")
+            return None
+    return _pool
+
+def get_oracle_connection():
+    """Retourne une connexion issue du pool. conn.close() la rend au pool."""
+    pool = get_pool()
+    if pool is None:
+        return None
     try:
-        conn = cx_Oracle.connect(user, pwd, dsn)
-        logger.info("✅ Connexion Oracle réussie !")
+        start = time.perf_counter()
+        conn = pool.acquire()
+        wait = time.perf_counter() - start
+        with _pool_lock:
+            _pool_stats["acquired"] += 1
+            _pool_stats["wait_total"] += wait
+            _pool_stats["wait_max"] = max(_pool_stats["wait_max"], wait)
         return conn
     except Exception as e:
         logger.error(f"❌ Erreur de connexion Oracle : {e}")
         return None
 
+@contextmanager
+def acquire():
+    """Context manager : fournit une connexion du pool et la rend toujours au pool."""
+    conn = get_oracle_connection()
+    if conn is None:
+        raise RuntimeError("Connexion Oracle impossible")
+    try:
+        yield conn
+    finally:
+        try:
+            conn.close()
+        except Exception as e:
+            logger.warning(f"⚠️ Erreur lors de la restitution de la connexion au pool : {e}")
+
+def get_pool_stats():
+    """Statistiques du pool : sessions ouvertes, occupées et temps d'attente à l'acquisition."""
+    if _pool is None:
+        return {"opened": 0, "busy": 0, "max": 0, "acquired": 0, "wait_avg_ms": 0.0, "wait_max_ms": 0.0}
+    with _pool_lock:
+        acquired = _pool_stats["acquired"]
+        wait_total = _pool_stats["wait_total"]
+        wait_max = _pool_stats["wait_max"]
+    return {
+        "opened": _pool.opened,
+        "busy": _pool.busy,
+        "max": _pool.max,
+        "acquired": acquired,
+        "wait_avg_ms": round(wait_total / acquired * 1000, 3) if acquired else 0.0,
+        "wait_max_ms": round(wait_max * 1000, 3)
+    }
+
+def log_pool_stats():
+    stats = get_pool_stats()
+    logger.info(
+        f"📊 Pool Oracle : {stats['opened']} sessions ouvertes, {stats['busy']} occupées (max {stats['max']}), "
+        f"{stats['acquired']} acquisitions, attente moy. {stats['wait_avg_ms']} ms / max {stats['wait_max_ms']} ms"
+    )
+
+def close_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            return
+        try:
+            _pool.close(force=True)
+        except Exception as e:
+            logger.warning(f"⚠️ Erreur fermeture du pool Oracle : {e}")
+        _pool = None
+
+atexit.register(close_pool)
+
+def number_list(conn, values):
+    """Collection SYS.ODCINUMBERLIST à binder dans `IN (SELECT column_value FROM TABLE(:ids))`.
+    Le texte SQL reste identique quel que soit le nombre d'éléments (partage de curseur)."""
+    collection = conn.gettype("SYS.ODCINUMBERLIST").newobject()
+    collection.extend([int(v) for v in values])
+    return collection
+
+def varchar_list(conn, values):
+    """Collection SYS.ODCIVARCHAR2LIST (même usage que number_list, pour des chaînes)."""
+    collection = conn.gettype("SYS.ODCIVARCHAR2LIST").newobject()
+    collection.extend([str(v) for v in values])
+    return collection
+
+def create_table_if_missing(cur, ddl):
+    """Exécute un CREATE TABLE en ignorant l'erreur ORA-00955 (objet déjà existant)."""
+    try:
+        cur.execute(ddl)
+        logger.info("🆕 Table créée : " + " ".join(ddl.split()[:6]))
+    except cx_Oracle.DatabaseError as e:
+        error, = e.args
+        if getattr(error, "code", None) != 955:
+            raise
+
 # Test du module si exécuté directement
 if __name__ == "__main__":
     conn = get_oracle_connection()
     if conn:
         print("Test OK : Connexion Oracle établie.")
         conn.close()
+        log_pool_stats()
     else:
-        print("Test KO : Connexion Oracle impossible.")
\ No newline at end of file
+        print("Test KO : Connexion Oracle impossible.")
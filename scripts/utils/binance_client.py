@@ -0,0 +1,38 @@
+import time
+from scripts.utils.http_client import get_session, RateLimiter
+
+BINANCE_API = "https://api.binance.com"
+
+# Binance limite le poids des requêtes (6000 / minute par IP) ; /klines coûte 2 par appel.
+# On se réserve la moitié du budget, en rafales de 200.
+KLINES_WEIGHT = 2
+binance_limiter = RateLimiter(rate=50, capacity=200)
+# Au-delà de ce poids consommé (en-tête X-MBX-USED-WEIGHT-1M), on ralentit jusqu'à la minute suivante
+USED_WEIGHT_PAUSE = 5000
+KLINES_LIMIT = 1000
+
+def _pause_seconds(resp):
+    return int(resp.headers.get("Retry-After", 60 - time.time() % 60))
+
+def get_klines(symbol, interval, start_ms, end_ms, limit=KLINES_LIMIT, timeout=10, max_retries=3):
+    """
+    Appel /api/v3/klines via la session partagée, sous le limiteur de poids.
+    Sur 418 / 429, attend Retry-After puis refait l'appel (max_retries fois).
+    Retourne les bougies brutes [open_time_ms, open, high, low, close, volume, ...].
+    """
+    for attempt in range(max_retries + 1):
+        binance_limiter.acquire(KLINES_WEIGHT)
+        resp = get_session().get(f"{BINANCE_API}/api/v3/klines", params={
+            "symbol": symbol,
+            "interval": interval,
+            "startTime": start_ms,
+            "endTime": end_ms,
+            "limit": limit
+        }, timeout=timeout)
+        if resp.status_code in (418, 429) and attempt < max_retries:
+            time.sleep(_pause_seconds(resp))
+            continue
+        resp.raise_for_status()
+        if int(resp.headers.get("X-MBX-USED-WEIGHT-1M", 0)) >= USED_WEIGHT_PAUSE:
+            time.sleep(_pause_seconds(resp))
+        return resp.json()
@@ -1,7 +1,31 @@
+import argparse
+import time
+import numpy as np
 import pandas as pd
-from scripts.utils.bd_oracle_connection import get_oracle_connection
+from multiprocessing import get_context
+from scripts.utils.bd_oracle_connection import acquire, close_pool, number_list
 from scripts.utils.logger import logger
 
+RSI_WINDOW = 14
+MA52_WINDOW = 52
+MA104_WINDOW = 104
+UPDATE_BATCH_SIZE = 5000
+
+BULK_QUERY = """
+    SELECT p.asset_id, p.price_id, p.price_date, p.close_value
+    FROM prices p
+    WHERE p.asset_id IN (SELECT column_value FROM TABLE(:ids)) AND p.close_value IS NOT NULL
+    ORDER BY p.asset_id, p.price_date
+"""
+
+# Cryptos : une barre par jour (dernière observation ayant un close), lue dans l'agrégat prices_daily
+DAILY_BULK_QUERY = """
+    SELECT d.asset_id, d.last_price_id, d.last_price_date, d.close_value
+    FROM prices_daily d
+    WHERE d.asset_id IN (SELECT column_value FROM TABLE(:ids)) AND d.close_value IS NOT NULL
+    ORDER BY d.asset_id, d.price_day
+"""
+
 def compute_rsi(series, window=14):
     delta = series.diff()
     gain = delta.where(delta > 0, 0)
@@ -12,77 +36,165 @@ def compute_rsi(series, window=14):
     rsi = 100 - (100 / (1 + rs))
     return rsi
 
-def update_indicators_for_asset(asset_id, asset_type, min_obs_rsi=14, min_obs_ma52=52, min_obs_ma104=104):
-    conn = get_oracle_connection()
-    query = """
-        SELECT price_id, price_date, close_value
-        FROM prices
-        WHERE asset_id = :asset_id AND close_value IS NOT NULL
-        ORDER BY price_date
+def rolling_mean_np(values, window, min_periods):
+    """Équivalent NumPy de Series.rolling(window, min_periods).mean() (NaN si pas assez d'observations)."""
+    cumsum = np.concatenate(([0.0], np.cumsum(values)))
+    idx = np.arange(1, len(values) + 1)
+    start = np.maximum(idx - window, 0)
+    counts = idx - start
+    with np.errstate(invalid="ignore", divide="ignore"):
+        means = (cumsum[idx] - cumsum[start]) / counts
+    means[counts < min_periods] = np.nan
+    return means
+
+def compute_indicators_np(closes):
+    """Calcule rsi, ma52, ma104 sur une série de closes (mêmes règles que la version pandas)."""
+    n = len(closes)
+    rsi = np.full(n, np.nan)
+    ma52 = np.full(n, np.nan)
+    ma104 = np.full(n, np.nan)
+    if n >= RSI_WINDOW:
+        delta = np.diff(closes, prepend=closes[0])
+        avg_gain = rolling_mean_np(np.where(delta > 0, delta, 0.0), RSI_WINDOW, RSI_WINDOW)
+        avg_loss = rolling_mean_np(np.where(delta < 0, -delta, 0.0), RSI_WINDOW, RSI_WINDOW)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            rsi = 100 - (100 / (1 + avg_gain / avg_loss))
+    if n >= MA52_WINDOW:
+        ma52 = rolling_mean_np(closes, MA52_WINDOW, max(1, int(MA52_WINDOW * 0.3)))
+    if n >= MA104_WINDOW:
+        ma104 = rolling_mean_np(closes, MA104_WINDOW, 52)
+    return rsi, ma52, ma104
+
+def _nullable(values):
+    return [None if np.isnan(v) else float(v) for v in values]
+
+def load_prices_bulk(conn, asset_ids, daily_ids=()):
+    """
+    Charge en une requête les closes de plusieurs actifs (daily_ids : barres journalières de prices_daily).
+    Retourne des tableaux NumPy groupés par asset_id et triés par date.
+    """
+    daily_ids = set(daily_ids)
+    queries = [
+        (BULK_QUERY, [a for a in asset_ids if a not in daily_ids]),
+        (DAILY_BULK_QUERY, [a for a in asset_ids if a in daily_ids])
+    ]
+    cur = conn.cursor()
+    cur.arraysize = 10000
+    rows = []
+    for query, ids in queries:
+        if ids:
+            cur.execute(query, {"ids": number_list(conn, ids)})
+            rows.extend(cur.fetchall())
+    cur.close()
+    if not rows:
+        return None
+    asset_col, price_id_col, date_col, close_col = zip(*rows)
+    return {
+        "asset_id": np.array(asset_col, dtype=np.int64),
+        "price_id": np.array(price_id_col, dtype=np.int64),
+        "price_date": np.array(date_col, dtype="datetime64[s]"),
+        "close": np.array(close_col, dtype=np.float64)
+    }
+
+def compute_bulk_updates(data, asset_types):
+    """
+    Calcule les indicateurs de tous les actifs chargés.
+    Pour les cryptos, seule la dernière observation de chaque jour est prise en compte (et mise à jour) :
+    déjà le cas des barres de prices_daily, le filtre ne s'applique qu'aux données horaires.
+    Retourne la liste des binds (rsi, ma52, ma104, price_id) pour l'UPDATE.
     """
-    df = pd.read_sql(query, conn, params={"asset_id": asset_id})
-    df.columns = [c.lower() for c in df.columns]
-    if df.empty:
+    binds = []
+    boundaries = np.flatnonzero(np.diff(data["asset_id"])) + 1
+    starts = np.concatenate(([0], boundaries))
+    ends = np.concatenate((boundaries, [len(data["asset_id"])]))
+    for start, end in zip(starts, ends):
+        asset_id = int(data["asset_id"][start])
+        price_ids = data["price_id"][start:end]
+        closes = data["close"][start:end]
+        if asset_types.get(asset_id) == 'CRYPTO':
+            days = data["price_date"][start:end].astype("datetime64[D]")
+            last_of_day = np.append(days[1:] != days[:-1], True)
+            price_ids = price_ids[last_of_day]
+            closes = closes[last_of_day]
+        rsi, ma52, ma104 = compute_indicators_np(closes)
+        binds.extend(zip(_nullable(rsi), _nullable(ma52), _nullable(ma104), price_ids.tolist()))
+    return binds
+
+def write_indicators(conn, binds, batch_size=UPDATE_BATCH_SIZE):
+    """UPDATE par array binding (executemany), un commit par lot."""
+    cur = conn.cursor()
+    for start in range(0, len(binds), batch_size):
+        cur.setinputsizes(float, float, float, int)
+        cur.executemany(
+            "UPDATE prices SET rsi = :1, ma52 = :2, ma104 = :3 WHERE price_id = :4",
+            binds[start:start + batch_size]
+        )
+        conn.commit()
+    cur.close()
+    return len(binds)
+
+def update_indicators_for_assets(assets):
+    """Reconstruit les indicateurs d'un lot d'actifs [(asset_id, asset_type), ...]. Retourne le nombre de lignes."""
+    asset_types = {int(asset_id): asset_type for asset_id, asset_type in assets}
+    with acquire() as conn:
+        crypto_ids = [a for a, t in asset_types.items() if t == 'CRYPTO']
+        data = load_prices_bulk(conn, list(asset_types), daily_ids=crypto_ids)
+        if data is None:
+            return 0
+        binds = compute_bulk_updates(data, asset_types)
+        return write_indicators(conn, binds)
+
+def update_indicators_for_asset(asset_id, asset_type, min_obs_rsi=14, min_obs_ma52=52, min_obs_ma104=104):
+    updated = update_indicators_for_assets([(asset_id, asset_type)])
+    if not updated:
         logger.info(f"Aucune donnée pour asset_id={asset_id}")
-        conn.close()
-        return 0
-    df = df.sort_values('price_date').reset_index(drop=True)
-    # Pour les cryptos, regrouper par jour et prendre le dernier close
-    if asset_type == 'CRYPTO':
-        df['date'] = pd.to_datetime(df['price_date']).dt.date
-        df = df.groupby('date', as_index=False).last()
-        price_col = 'close_value'
     else:
-        price_col = 'close_value'
-    # Fenêtres standards
-    ma52 = 52
-    ma104 = 104
-    rsi_window = 14
-    min_periods_ma = max(1, int(ma52 * 0.3))
-    # Calcul indicateurs si assez d'observations
-    if len(df) >= rsi_window:
-        df['rsi'] = compute_rsi(df[price_col], window=rsi_window)
-    if len(df) >= ma52:
-        df['ma52'] = df[price_col].rolling(window=ma52, min_periods=min_periods_ma).mean()
-    if len(df) >= ma104:
-        df['ma104'] = df[price_col].rolling(window=ma104, min_periods=52).mean()
-    # Mise à jour en base
-    updated = 0
-    for _, row in df.iterrows():
-        cur = conn.cursor()
-        cur.execute("""
-            UPDATE prices SET rsi = :rsi, ma52 = :ma52, ma104 = :ma104 WHERE price_id = :price_id
-        """, {
-            "rsi": float(row['rsi']) if 'rsi' in row and pd.notnull(row['rsi']) else None,
-            "ma52": float(row['ma52']) if 'ma52' in row and pd.notnull(row['ma52']) else None,
-            "ma104": float(row['ma104']) if 'ma104' in row and pd.notnull(row['ma104']) else None,
-            "price_id": int(row['price_id'])
-        })
-        updated += 1
-        cur.close()
-    conn.commit()
-    conn.close()
-    logger.info(f"{updated} lignes mises à jour pour asset_id={asset_id}")
+        logger.info(f"{updated} lignes mises à jour pour asset_id={asset_id}")
     return updated
 
-def update_all_assets(asset_type_filter=None):
-    conn = get_oracle_connection()
-    query = "SELECT asset_id, asset_type FROM assets"
-    if asset_type_filter:
-        query += " WHERE asset_type = :atype"
-        assets = pd.read_sql(query, conn, params={"atype": asset_type_filter})
-    else:
-        assets = pd.read_sql(query, conn)
+def _chunks(items, size):
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+def update_all_assets(asset_type_filter=None, workers=1, chunk_size=50):
+    with acquire() as conn:
+        query = "SELECT asset_id, asset_type FROM assets"
+        if asset_type_filter:
+            query += " WHERE asset_type = :atype"
+            assets = pd.read_sql(query, conn, params={"atype": asset_type_filter})
+        else:
+            assets = pd.read_sql(query, conn)
     assets.columns = [c.lower() for c in assets.columns]
-    conn.close()
+    chunks = _chunks([(int(r.asset_id), r.asset_type) for r in assets.itertuples()], chunk_size)
     total = 0
-    for _, row in assets.iterrows():
-        total += update_indicators_for_asset(row['asset_id'], row['asset_type'])
-    logger.info(f"Total lignes mises à jour : {total}")
+    done_assets = 0
+    started = time.perf_counter()
 
-if __name__ == "__main__":
-    import sys
-    if len(sys.argv) > 1:
-        update_all_assets(sys.argv[1])
+    def report(updated, n_assets):
+        nonlocal total, done_assets
+        total += updated
+        done_assets += n_assets
+        elapsed = time.perf_counter() - started
+        logger.info(
+            f"⏳ {done_assets}/{len(assets)} actifs, {total} lignes mises à jour "
+            f"({total / elapsed if elapsed > 0 else 0:.0f} lignes/s)"
+        )
+
+    if workers > 1 and len(chunks) > 1:
+        # Chaque process crée son propre pool Oracle : on ferme celui du parent avant le fork
+        close_pool()
+        with get_context("fork").Pool(processes=workers) as pool:
+            for chunk, updated in zip(chunks, pool.imap(update_indicators_for_assets, chunks)):
+                report(updated, len(chunk))
     else:
-        update_all_assets()
+        for chunk in chunks:
+            report(update_indicators_for_assets(chunk), len(chunk))
+    elapsed = time.perf_counter() - started
+    logger.info(f"Total lignes mises à jour : {total} en {elapsed:.1f}s ({total / elapsed if elapsed > 0 else 0:.0f} lignes/s)")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Reconstruction complète des indicateurs rsi/ma52/ma104")
+    parser.add_argument("asset_type", nargs="?", default=None, help="Filtre asset_type (CRYPTO, STOCK, ETF)")
+    parser.add_argument("--workers", type=int, default=1, help="Nombre de process de calcul")
+    parser.add_argument("--chunk-size", type=int, default=50, help="Nombre d'actifs chargés par requête")
+    args = parser.parse_args()
+    update_all_assets(args.asset_type, workers=args.workers, chunk_size=args.chunk_size)
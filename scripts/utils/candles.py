@@ -0,0 +1,154 @@
+import numpy as np
+import pandas as pd
+
+PARIS_TZ = "Europe/Paris"
+NO_ASSET = -1
+
+# Une ligne par bougie : time en secondes epoch, colonnes OHLCV en float64 ; NaN = valeur absente
+CANDLE_DTYPE = np.dtype([
+    ("asset_id", "i8"),
+    ("time", "i8"),
+    ("open", "f8"),
+    ("high", "f8"),
+    ("low", "f8"),
+    ("close", "f8"),
+    ("volume", "f8"),
+    ("price_value", "f8"),
+    ("dividend_amount", "f8"),
+    ("split_coefficient", "f8")
+])
+
+# Ordre des colonnes de prices_stage (INSERT_STAGE_SQL) après asset_id et price_date
+BIND_COLUMNS = ("price_value", "open", "high", "low", "close", "volume", "dividend_amount", "split_coefficient")
+
+class CandleBatch:
+    """
+    Lot de bougies en tableau structuré NumPy (CANDLE_DTYPE) : ~80 octets par bougie au lieu d'un dict
+    de floats et d'un datetime aware. tz est le fuseau dans lequel les dates sont enregistrées en base
+    (conversion vectorisée, une fois par lot) ; tz=None pour des dates déjà locales (barres journalières).
+    """
+    __slots__ = ("data", "tz")
+
+    def __init__(self, data=None, tz=PARIS_TZ):
+        self.data = np.empty(0, dtype=CANDLE_DTYPE) if data is None else data
+        self.tz = tz
+
+    @classmethod
+    def from_columns(cls, time, open, high, low, close, volume, price_value=None, dividend_amount=None,
+                     split_coefficient=None, asset_id=NO_ASSET, tz=PARIS_TZ):
+        data = np.empty(len(time), dtype=CANDLE_DTYPE)
+        data["asset_id"] = asset_id
+        data["time"] = time
+        data["open"] = open
+        data["high"] = high
+        data["low"] = low
+        data["close"] = close
+        data["volume"] = volume
+        data["price_value"] = close if price_value is None else price_value
+        data["dividend_amount"] = np.nan if dividend_amount is None else dividend_amount
+        data["split_coefficient"] = np.nan if split_coefficient is None else split_coefficient
+        return cls(data, tz)
+
+    @classmethod
+    def from_coinbase(cls, raw, asset_id=NO_ASSET):
+        """Réponse /candles Coinbase : [time, low, high, open, close, volume] (time en secondes UTC)."""
+        arr = np.asarray(raw, dtype="f8").reshape(-1, 6)
+        return cls.from_columns(arr[:, 0].astype("i8"), arr[:, 3], arr[:, 2], arr[:, 1], arr[:, 4], arr[:, 5],
+                                asset_id=asset_id)
+
+    @classmethod
+    def from_binance(cls, raw, asset_id=NO_ASSET):
+        """Réponse /klines Binance : [open_time_ms, "open", "high", "low", "close", "volume", ...]."""
+        arr = np.asarray([k[:6] for k in raw], dtype="f8").reshape(-1, 6)
+        return cls.from_columns(arr[:, 0].astype("i8") // 1000, arr[:, 1], arr[:, 2], arr[:, 3], arr[:, 4],
+                                arr[:, 5], asset_id=asset_id)
+
+    @classmethod
+    def from_eod(cls, entries, asset_id=NO_ASSET):
+        """
+        Barres journalières EODHD ({date, open, high, low, close, volume, dividend?, split?}).
+        Dates à minuit sans fuseau, comme les lignes EODHD existantes ; price_value non fourni (NULL).
+        """
+        entries = list(entries)
+        days = np.array([e["date"] for e in entries], dtype="datetime64[D]")
+        column = lambda key, default=np.nan: np.array([float(e.get(key, default)) for e in entries], dtype="f8")
+        return cls.from_columns(days.astype("datetime64[s]").astype("i8"), column("open"), column("high"),
+                                column("low"), column("close"), column("volume"), price_value=np.nan,
+                                dividend_amount=column("dividend", 0), split_coefficient=column("split", 1),
+                                asset_id=asset_id, tz=None)
+
+    @classmethod
+    def concat(cls, batches):
+        batches = [b for b in batches if len(b)]
+        if not batches:
+            return cls()
+        return cls(np.concatenate([b.data for b in batches]), batches[0].tz)
+
+    def __len__(self):
+        return len(self.data)
+
+    def with_asset_id(self, asset_id):
+        """Renseigne asset_id sur les lignes qui n'en ont pas."""
+        data = self.data.copy()
+        data["asset_id"][data["asset_id"] == NO_ASSET] = asset_id
+        return CandleBatch(data, self.tz)
+
+    def clip(self, start_ts=None, end_ts=None):
+        mask = np.ones(len(self.data), dtype=bool)
+        if start_ts is not None:
+            mask &= self.data["time"] >= start_ts
+        if end_ts is not None:
+            mask &= self.data["time"] <= end_ts
+        return CandleBatch(self.data[mask], self.tz)
+
+    def unique(self):
+        """Trie par (asset_id, time) et garde la dernière occurrence de chaque couple."""
+        data = self.data
+        order = np.lexsort((np.arange(len(data)), data["time"], data["asset_id"]))
+        data = data[order]
+        last = np.ones(len(data), dtype=bool)
+        last[:-1] = (data["asset_id"][1:] != data["asset_id"][:-1]) | (data["time"][1:] != data["time"][:-1])
+        return CandleBatch(data[last], self.tz)
+
+    def _local_index(self):
+        index = pd.to_datetime(self.data["time"], unit="s", utc=True)
+        if self.tz is not None:
+            index = index.tz_convert(self.tz)
+        return index.tz_localize(None)
+
+    def local_datetimes(self):
+        """Dates (datetime naïfs, heure locale de tz) de toutes les bougies, converties en une passe."""
+        return self._local_index().to_pydatetime()
+
+    def date_range(self):
+        """(première, dernière) date locale du lot, ou (None, None) s'il est vide."""
+        if not len(self.data):
+            return None, None
+        ends = CandleBatch(self.data[[self.data["time"].argmin(), self.data["time"].argmax()]], self.tz)
+        first, last = ends.local_datetimes()
+        return first, last
+
+    def bind_rows(self, source, asset_id=None):
+        """
+        Tuples positionnels pour prices_stage, construits colonne par colonne (NaN -> NULL).
+        Dédoublonnés sur (asset_id, date locale), c'est-à-dire la DATE réellement stockée : au passage à
+        l'heure d'hiver, deux heures UTC donnent la même date locale et la plus récente l'emporte.
+        """
+        batch = self.with_asset_id(asset_id) if asset_id is not None else self
+        if (batch.data["asset_id"] == NO_ASSET).any():
+            raise ValueError("asset_id manquant pour une ligne de prix")
+        batch = batch.unique()
+        local = batch._local_index()
+        keys = local.asi8
+        order = np.lexsort((batch.data["time"], keys, batch.data["asset_id"]))
+        data, keys, local = batch.data[order], keys[order], local[order]
+        last = np.ones(len(data), dtype=bool)
+        last[:-1] = (data["asset_id"][1:] != data["asset_id"][:-1]) | (keys[1:] != keys[:-1])
+        batch, local = CandleBatch(data[last], batch.tz), local[last]
+        columns = [batch.data["asset_id"].tolist(), local.to_pydatetime().tolist()]
+        for name in BIND_COLUMNS:
+            values = batch.data[name]
+            nulls = np.isnan(values)
+            columns.append(np.where(nulls, None, values).tolist() if nulls.any() else values.tolist())
+        columns.append([source] * len(batch))
+        return list(zip(*columns))
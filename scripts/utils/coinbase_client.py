@@ -0,0 +1,42 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from scripts.utils.http_client import get_session, RateLimiter
+
+COINBASE_API = "https://api.exchange.coinbase.com"
+
+# Limite publique Coinbase Exchange : 10 requêtes/s par IP, rafales jusqu'à 15
+coinbase_limiter = RateLimiter(rate=10, capacity=15)
+# Nombre maximum de bougies renvoyées par /candles
+CANDLES_LIMIT = 300
+# Statuts réessayés après une pause : limite de débit et erreurs serveur
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+def _pause_seconds(resp, attempt, retry_delay):
+    return float(resp.headers.get("Retry-After", retry_delay * attempt))
+
+def get_candles(pair, granularity=3600, params=None, timeout=10, max_retries=3, retry_delay=2):
+    """Appel /products/{pair}/candles via la session partagée et le limiteur de débit.
+    Sur 429 / 5xx, attend Retry-After (ou retry_delay croissant) puis refait l'appel (max_retries fois).
+    Retourne (bougies brutes, latence en secondes)."""
+    url = f"{COINBASE_API}/products/{pair}/candles"
+    query = {"granularity": granularity}
+    if params:
+        query.update(params)
+    for attempt in range(1, max_retries + 2):
+        coinbase_limiter.acquire()
+        start = time.perf_counter()
+        resp = get_session().get(url, params=query, timeout=timeout)
+        latency = time.perf_counter() - start
+        if resp.status_code in RETRY_STATUSES and attempt <= max_retries:
+            time.sleep(_pause_seconds(resp, attempt, retry_delay))
+            continue
+        resp.raise_for_status()
+        return resp.json(), latency
+
+def run_concurrently(items, func, max_workers=8):
+    """Exécute func(item) sur un pool de threads borné. Retourne la liste (item, résultat) dans l'ordre."""
+    items = list(items)
+    if not items:
+        return []
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(items))) as executor:
+        return list(zip(items, executor.map(func, items)))
@@ -0,0 +1,17 @@
+import pandas as pd
+from scripts.utils.price_loader import panel_returns
+
+def correlation_pairs(prices, labels, method="pearson"):
+    """
+    Corrélation des rendements d'une matrice de prix jours × actifs (NaN gérés paire par paire).
+    Retourne la liste (source, target, value) attendue par Grafana.
+    Fonction de module : exécutable dans le pool de process de l'API.
+    """
+    returns = pd.DataFrame(panel_returns(prices), columns=labels)
+    corr_matrix = returns.corr(method=method).round(3)
+    result = []
+    for col in corr_matrix.columns:
+        for idx in corr_matrix.index:
+            if col != idx:
+                result.append({"source": col, "target": idx, "value": corr_matrix.loc[idx, col]})
+    return result
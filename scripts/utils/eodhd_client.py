@@ -0,0 +1,90 @@
+import json
+import os
+from pathlib import Path
+from dotenv import load_dotenv
+from scripts.utils.http_client import get_session, RateLimiter
+
+load_dotenv(str(Path.home() / "market-watcher/config/.env"))
+
+EODHD_API = "https://eodhd.com/api"
+
+# Plafond EODHD : 1000 requêtes/minute, on reste nettement en dessous
+eodhd_limiter = RateLimiter(rate=10, capacity=20)
+
+def get_eod(ticker, from_date=None, to_date=None, timeout=30):
+    """
+    Appel /eod/{ticker} (barres journalières, ordre croissant) via la session partagée.
+    from_date / to_date : date ou None. Retourne (lignes brutes, octets reçus).
+    """
+    params = {"api_token": os.getenv("EODHD_API_KEY"), "fmt": "json", "period": "d", "order": "a"}
+    if from_date is not None:
+        params["from"] = from_date.strftime("%Y-%m-%d")
+    if to_date is not None:
+        params["to"] = to_date.strftime("%Y-%m-%d")
+    eodhd_limiter.acquire()
+    resp = get_session().get(f"{EODHD_API}/eod/{ticker}", params=params, timeout=timeout)
+    resp.raise_for_status()
+    return resp.json(), len(resp.content)
+
+def get_eod_bulk_last_day(exchange, timeout=60):
+    """
+    Appel /eod-bulk-last-day/{exchange} : dernière séance de toute une place en un appel.
+    Retourne (lignes brutes {code, date, open, ...}, octets reçus).
+    """
+    params = {"api_token": os.getenv("EODHD_API_KEY"), "fmt": "json"}
+    eodhd_limiter.acquire()
+    resp = get_session().get(f"{EODHD_API}/eod-bulk-last-day/{exchange}", params=params, timeout=timeout)
+    resp.raise_for_status()
+    return resp.json(), len(resp.content)
+
+class EodhdFetcher:
+    """Accès à l'API EODHD ; remplaçable par RecordedFetcher pour rejouer des réponses enregistrées."""
+
+    def eod(self, ticker, from_date=None, to_date=None):
+        return get_eod(ticker, from_date=from_date, to_date=to_date)
+
+    def bulk_last_day(self, exchange):
+        return get_eod_bulk_last_day(exchange)
+
+class RecordedFetcher:
+    """
+    Rejoue des réponses enregistrées (bulk_{EXCHANGE}.json, eod_{TICKER}.json) depuis un répertoire.
+    Un fichier absent se comporte comme une erreur de l'API.
+    """
+
+    def __init__(self, directory):
+        self.directory = Path(directory)
+
+    def _load(self, name):
+        path = self.directory / name
+        if not path.exists():
+            raise FileNotFoundError(f"Réponse enregistrée absente : {path}")
+        return json.loads(path.read_text()), path.stat().st_size
+
+    def eod(self, ticker, from_date=None, to_date=None):
+        data, size = self._load(f"eod_{ticker}.json")
+        # Même filtrage de période que l'API
+        low = from_date.strftime("%Y-%m-%d") if from_date is not None else ""
+        high = to_date.strftime("%Y-%m-%d") if to_date is not None else "9999"
+        return [row for row in data if low <= row["date"] <= high], size
+
+    def bulk_last_day(self, exchange):
+        return self._load(f"bulk_{exchange}.json")
+
+class RecordingFetcher:
+    """Enregistre les réponses d'un autre fetcher dans un répertoire (pour RecordedFetcher)."""
+
+    def __init__(self, inner, directory):
+        self.inner = inner
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def _save(self, name, result):
+        (self.directory / name).write_text(json.dumps(result[0]))
+        return result
+
+    def eod(self, ticker, from_date=None, to_date=None):
+        return self._save(f"eod_{ticker}.json", self.inner.eod(ticker, from_date=from_date, to_date=to_date))
+
+    def bulk_last_day(self, exchange):
+        return self._save(f"bulk_{exchange}.json", self.inner.bulk_last_day(exchange))
@@ -0,0 +1,47 @@
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+
+# Session HTTP partagée (keep-alive) par process
+_session = None
+_session_lock = threading.Lock()
+
+def get_session(pool_maxsize=32):
+    """Retourne une requests.Session partagée, avec un pool de connexions keep-alive."""
+    global _session
+    if _session is not None:
+        return _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=8, pool_maxsize=pool_maxsize)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _session = session
+    return _session
+
+class RateLimiter:
+    """Token bucket thread-safe : `rate` jetons par seconde, rafale maximale de `capacity` jetons."""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else rate)
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, cost=1):
+        """Bloque jusqu'à disposer de `cost` jetons. Retourne le temps d'attente en secondes."""
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= cost:
+                    self.tokens -= cost
+                    return waited
+                delay = (cost - self.tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
@@ -0,0 +1,228 @@
+import fcntl
+import json
+import math
+import time
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from scripts.utils.logger import logger
+
+STATE_FILE = Path.home() / "market-watcher/data/indicator_state.json"
+# Actifs invalidés {asset_id: epoch}, gardés dans le fichier d'état pour le run qui l'a chargé avant
+INVALIDATED_KEY = "_invalidated"
+
+RSI_WINDOW = 14
+MA52_WINDOW = 52
+MA104_WINDOW = 104
+
+class IncrementalIndicators:
+    """
+    État incrémental RSI14 / MA52 / MA104 d'un actif.
+    Garde des buffers circulaires (closes, gains, pertes) et des sommes glissantes :
+    ajouter une barre ou corriger la dernière (bougie crypto du jour) coûte O(1).
+    Reproduit les calculs pandas de maj_indicateurs_last_obs sur la dernière observation.
+    """
+
+    def __init__(self):
+        self.n = 0
+        self.last_key = None
+        self.last_price_id = None
+        self.date_min = None
+        self.closes = deque()
+        self.gains = deque()
+        self.losses = deque()
+        self.sum52 = 0.0
+        self.sum104 = 0.0
+        self.sum_gain = 0.0
+        self.sum_loss = 0.0
+
+    @staticmethod
+    def _gain_loss(prev_close, close):
+        # Première barre : diff NaN, traité comme 0 (comme delta.where(delta > 0, 0))
+        delta = close - prev_close if prev_close is not None else 0.0
+        return max(delta, 0.0), max(-delta, 0.0)
+
+    def append(self, key, close, price_id):
+        close = float(close)
+        gain, loss = self._gain_loss(self.closes[-1] if self.closes else None, close)
+        self.n += 1
+        self.closes.append(close)
+        self.sum104 += close
+        self.sum52 += close
+        if len(self.closes) > MA52_WINDOW:
+            self.sum52 -= self.closes[-MA52_WINDOW - 1]
+        if len(self.closes) > MA104_WINDOW:
+            self.sum104 -= self.closes.popleft()
+        self.gains.append(gain)
+        self.losses.append(loss)
+        self.sum_gain += gain
+        self.sum_loss += loss
+        if len(self.gains) > RSI_WINDOW:
+            self.sum_gain -= self.gains.popleft()
+            self.sum_loss -= self.losses.popleft()
+        self.last_key = key
+        self.last_price_id = price_id
+
+    def replace_last(self, close, price_id):
+        """Remplace la dernière barre (ex : bougie journalière crypto mise à jour dans la journée)."""
+        close = float(close)
+        old = self.closes[-1]
+        self.closes[-1] = close
+        self.sum104 += close - old
+        self.sum52 += close - old
+        gain, loss = self._gain_loss(self.closes[-2] if len(self.closes) > 1 else None, close)
+        self.sum_gain += gain - self.gains[-1]
+        self.sum_loss += loss - self.losses[-1]
+        self.gains[-1] = gain
+        self.losses[-1] = loss
+        self.last_price_id = price_id
+
+    def push(self, key, close, price_id):
+        """Ajoute la barre `key`, ou remplace la dernière si elle porte la même clé."""
+        if self.last_key is not None and key == self.last_key:
+            self.replace_last(close, price_id)
+        elif self.last_key is None or key > self.last_key:
+            self.append(key, close, price_id)
+        else:
+            raise ValueError(f"Barre {key} antérieure au dernier état ({self.last_key}), reconstruction nécessaire")
+
+    def values(self):
+        """Retourne (rsi, ma52, ma104) pour la dernière barre, None si historique insuffisant."""
+        rsi = ma52 = ma104 = None
+        if self.n >= RSI_WINDOW:
+            avg_gain = self.sum_gain / RSI_WINDOW
+            avg_loss = self.sum_loss / RSI_WINDOW
+            if avg_loss > 0:
+                rsi = 100 - (100 / (1 + avg_gain / avg_loss))
+            elif avg_gain > 0:
+                rsi = 100.0
+        if self.n >= MA52_WINDOW:
+            ma52 = self.sum52 / MA52_WINDOW
+        if self.n >= MA104_WINDOW:
+            ma104 = self.sum104 / MA104_WINDOW
+        return rsi, ma52, ma104
+
+    def resync(self):
+        """Recalcule exactement les sommes glissantes à partir des buffers (corrige la dérive flottante)."""
+        closes = list(self.closes)
+        self.sum104 = math.fsum(closes)
+        self.sum52 = math.fsum(closes[-MA52_WINDOW:])
+        self.sum_gain = math.fsum(self.gains)
+        self.sum_loss = math.fsum(self.losses)
+
+    def to_dict(self):
+        return {
+            "n": self.n,
+            "last_key": self.last_key,
+            "last_price_id": self.last_price_id,
+            "date_min": self.date_min,
+            "closes": list(self.closes),
+            "gains": list(self.gains),
+            "losses": list(self.losses)
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        state = cls()
+        state.n = data["n"]
+        state.last_key = data["last_key"]
+        state.last_price_id = data["last_price_id"]
+        state.date_min = data.get("date_min")
+        state.closes = deque(data["closes"])
+        state.gains = deque(data["gains"])
+        state.losses = deque(data["losses"])
+        state.resync()
+        return state
+
+def bars_from_rows(rows, asset_type):
+    """
+    Convertit des lignes (price_id, price_date, close_value) triées par date en barres (clé, close, price_id).
+    Pour les cryptos : une barre par jour, la dernière observation du jour.
+    """
+    bars = []
+    for price_id, price_date, close in rows:
+        if asset_type == 'CRYPTO':
+            key = price_date.date().isoformat()
+            if bars and bars[-1][0] == key:
+                bars[-1] = (key, close, price_id)
+                continue
+        else:
+            key = price_date.isoformat()
+        bars.append((key, close, price_id))
+    return bars
+
+def since_datetime(state):
+    """Date à partir de laquelle relire les prix pour mettre à jour l'état (inclut la dernière barre)."""
+    return datetime.fromisoformat(state.last_key)
+
+@contextmanager
+def _state_lock(path):
+    """Verrou exclusif entre process (fichier .lock voisin) sur les lectures-écritures du fichier d'état."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path.with_suffix(".lock"), "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def _read_raw(path):
+    if not path.exists():
+        return {}
+    with open(path, "r") as f:
+        return json.load(f)
+
+def _write_raw(raw, path):
+    tmp_path = path.with_suffix(".tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(raw, f)
+    tmp_path.replace(path)
+
+def load_states(path=STATE_FILE):
+    try:
+        with _state_lock(path):
+            raw = _read_raw(path)
+        raw.pop(INVALIDATED_KEY, None)
+        return {int(asset_id): IncrementalIndicators.from_dict(data) for asset_id, data in raw.items()}
+    except Exception as e:
+        logger.warning(f"⚠️ État des indicateurs illisible ({path}), reconstruction complète : {e}")
+        return {}
+
+def save_states(states, path=STATE_FILE, since=None):
+    """
+    Enregistre les états. since : epoch du load_states du run ; le fichier est relu sous verrou et les
+    actifs invalidés depuis (backfill concurrent) sont retirés de states au lieu d'écraser l'invalidation.
+    """
+    with _state_lock(path):
+        try:
+            invalidated = _read_raw(path).get(INVALIDATED_KEY, {})
+        except Exception:
+            invalidated = {}
+        if since is not None:
+            invalidated = {asset_id: at for asset_id, at in invalidated.items() if at >= since}
+            for asset_id in invalidated:
+                states.pop(int(asset_id), None)
+        raw = {str(asset_id): state.to_dict() for asset_id, state in states.items()}
+        if invalidated:
+            raw[INVALIDATED_KEY] = invalidated
+        _write_raw(raw, path)
+
+def invalidate_states(asset_ids, path=STATE_FILE):
+    """Supprime l'état de ces actifs (après un backfill historique) : reconstruction au prochain passage."""
+    with _state_lock(path):
+        try:
+            raw = _read_raw(path)
+        except Exception as e:
+            logger.warning(f"⚠️ État des indicateurs illisible ({path}), reconstruction complète : {e}")
+            raw = {}
+        invalidated = raw.setdefault(INVALIDATED_KEY, {})
+        now = time.time()
+        removed = []
+        for asset_id in asset_ids:
+            if raw.pop(str(int(asset_id)), None) is not None:
+                removed.append(asset_id)
+            invalidated[str(int(asset_id))] = now
+        _write_raw(raw, path)
+    if removed:
+        logger.info(f"♻️ État indicateurs invalidé pour {len(removed)} actif(s)")
@@ -0,0 +1,146 @@
+import argparse
+import os
+from scripts.utils.bd_oracle_connection import acquire, create_table_if_missing, number_list, varchar_list
+from scripts.utils.logger import logger
+
+# Instantané des deux dernières clôtures par actif, tenu à jour par les jobs d'extraction
+LATEST_PRICES_DDL = """
+    CREATE TABLE latest_prices (
+        asset_id NUMBER PRIMARY KEY,
+        last_close NUMBER,
+        last_price_date DATE,
+        prev_close NUMBER,
+        prev_price_date DATE,
+        updated_at TIMESTAMP
+    )
+"""
+
+# Rafraîchissement par type d'actif : seuls les prix récents sont relus (week-ends et jours fériés couverts).
+# Un actif sans prix dans la fenêtre garde sa ligne, déjà à jour puisqu'aucun prix n'est arrivé depuis.
+LOOKBACK_DAYS = int(os.getenv("LATEST_PRICES_LOOKBACK_DAYS", "14"))
+
+REFRESH_SQL = """
+    MERGE INTO latest_prices l
+    USING (
+        SELECT asset_id,
+               MAX(CASE WHEN rn = 1 THEN close_value END) AS last_close,
+               MAX(CASE WHEN rn = 1 THEN price_date END) AS last_price_date,
+               MAX(CASE WHEN rn = 2 THEN close_value END) AS prev_close,
+               MAX(CASE WHEN rn = 2 THEN price_date END) AS prev_price_date
+        FROM (
+            SELECT asset_id, price_date, close_value,
+                   ROW_NUMBER() OVER (PARTITION BY asset_id ORDER BY price_date DESC) AS rn
+            FROM prices
+            WHERE close_value IS NOT NULL {filters}
+        )
+        WHERE rn <= 2
+        GROUP BY asset_id
+    ) s
+    ON (l.asset_id = s.asset_id)
+    WHEN MATCHED THEN UPDATE SET
+        l.last_close = s.last_close, l.last_price_date = s.last_price_date,
+        l.prev_close = s.prev_close, l.prev_price_date = s.prev_price_date,
+        l.updated_at = SYSTIMESTAMP
+    WHEN NOT MATCHED THEN INSERT (asset_id, last_close, last_price_date, prev_close, prev_price_date, updated_at)
+        VALUES (s.asset_id, s.last_close, s.last_price_date, s.prev_close, s.prev_price_date, SYSTIMESTAMP)
+"""
+
+SNAPSHOT_QUERY = """
+    SELECT a.ticker, a.asset_id, a.asset_name, l.asset_id, l.last_close, l.prev_close
+    FROM assets a
+    LEFT JOIN latest_prices l ON l.asset_id = a.asset_id
+    WHERE a.ticker IN (SELECT column_value FROM TABLE(:tickers))
+    ORDER BY a.asset_id
+"""
+
+# Repli sans instantané : les deux dernières clôtures de chaque actif détenu, en une requête
+WINDOW_QUERY = """
+    SELECT ticker, asset_id, asset_name, close_value, prev_close FROM (
+        SELECT a.ticker, a.asset_id, a.asset_name, p.close_value,
+               LEAD(p.close_value) OVER (PARTITION BY a.asset_id ORDER BY p.price_date DESC) AS prev_close,
+               ROW_NUMBER() OVER (PARTITION BY a.asset_id ORDER BY p.price_date DESC) AS rn
+        FROM assets a
+        LEFT JOIN prices p ON p.asset_id = a.asset_id AND p.close_value IS NOT NULL
+        WHERE a.ticker IN (SELECT column_value FROM TABLE(:tickers))
+    )
+    WHERE rn = 1
+    ORDER BY asset_id
+"""
+
+def refresh_latest_prices(asset_ids=None, asset_types=None, conn=None, lookback_days=LOOKBACK_DAYS):
+    """
+    Met à jour l'instantané latest_prices (tous les actifs, ou seulement asset_ids / asset_types).
+    Sans asset_ids, seuls les prix des lookback_days derniers jours sont relus (None : tout l'historique) ;
+    avec asset_ids (ex : après un backfill), tout l'historique de ces actifs.
+    Appelé en fin de job d'extraction ; une erreur est journalisée sans interrompre le job.
+    """
+    if conn is None:
+        try:
+            with acquire() as pooled_conn:
+                return refresh_latest_prices(asset_ids, asset_types, pooled_conn, lookback_days)
+        except Exception as e:
+            logger.warning(f"⚠️ Instantané latest_prices non rafraîchi : {e}")
+            return 0
+    filters, params = [], {}
+    if asset_ids is not None:
+        filters.append("AND asset_id IN (SELECT column_value FROM TABLE(:ids))")
+        params["ids"] = number_list(conn, asset_ids)
+    elif lookback_days is not None:
+        filters.append("AND price_date >= TRUNC(SYSDATE) - :lookback_days")
+        params["lookback_days"] = lookback_days
+    if asset_types is not None:
+        filters.append("AND asset_id IN (SELECT asset_id FROM assets WHERE asset_type IN "
+                       "(SELECT column_value FROM TABLE(:types)))")
+        params["types"] = varchar_list(conn, asset_types)
+    cur = conn.cursor()
+    create_table_if_missing(cur, LATEST_PRICES_DDL)
+    cur.execute(REFRESH_SQL.format(filters=" ".join(filters)), params)
+    refreshed = cur.rowcount
+    conn.commit()
+    cur.close()
+    logger.info(f"✅ Instantané latest_prices : {refreshed} actifs rafraîchis")
+    return refreshed
+
+def _first_by_ticker(rows):
+    """Un actif par ticker (le premier rencontré, comme l'ancien FETCH FIRST 1 ROWS ONLY)."""
+    by_ticker = {}
+    for row in rows:
+        by_ticker.setdefault(row[0], row)
+    return by_ticker
+
+def load_latest_prices(tickers, conn, use_snapshot=True):
+    """
+    Retourne {ticker: (asset_id, asset_name, last_close, prev_close)} pour les tickers donnés.
+    Lit l'instantané latest_prices ; les actifs absents de l'instantané (ou sans table) sont
+    résolus par la requête fenêtrée sur prices.
+    """
+    tickers = sorted(set(tickers))
+    if not tickers:
+        return {}
+    result = {}
+    missing = tickers
+    cur = conn.cursor()
+    if use_snapshot:
+        try:
+            cur.execute(SNAPSHOT_QUERY, {"tickers": varchar_list(conn, tickers)})
+            snapshot = _first_by_ticker(cur.fetchall())
+            for ticker, (_, asset_id, asset_name, snapshot_id, last_close, prev_close) in snapshot.items():
+                if snapshot_id is not None:
+                    result[ticker] = (asset_id, asset_name, last_close, prev_close)
+            missing = [t for t in tickers if t not in result]
+        except Exception as e:
+            logger.warning(f"⚠️ Instantané latest_prices indisponible, repli sur prices : {e}")
+    if missing:
+        cur.execute(WINDOW_QUERY, {"tickers": varchar_list(conn, missing)})
+        for ticker, (_, asset_id, asset_name, last_close, prev_close) in _first_by_ticker(cur.fetchall()).items():
+            result[ticker] = (asset_id, asset_name, last_close, prev_close)
+    cur.close()
+    return result
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rafraîchit l'instantané latest_prices")
+    parser.add_argument("--asset-type", action="append", default=None, help="Filtre asset_type (répétable)")
+    parser.add_argument("--full", action="store_true",
+                        help=f"Relit tout l'historique (défaut : les {LOOKBACK_DAYS} derniers jours)")
+    args = parser.parse_args()
+    refresh_latest_prices(asset_types=args.asset_type, lookback_days=None if args.full else LOOKBACK_DAYS)
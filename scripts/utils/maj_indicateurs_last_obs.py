@@ -1,6 +1,41 @@
+import argparse
+import math
+import time
 import pandas as pd
-from scripts.utils.bd_oracle_connection import get_oracle_connection
+from scripts.utils.bd_oracle_connection import acquire
 from scripts.utils.logger import logger
+from scripts.utils.indicator_engine import (
+    IncrementalIndicators, bars_from_rows, since_datetime, load_states, save_states
+)
+
+HISTORY_QUERY = """
+    SELECT price_id, price_date, close_value
+    FROM prices
+    WHERE asset_id = :asset_id AND close_value IS NOT NULL
+    ORDER BY price_date
+"""
+
+SINCE_QUERY = """
+    SELECT price_id, price_date, close_value
+    FROM prices
+    WHERE asset_id = :asset_id AND close_value IS NOT NULL AND price_date >= :since
+    ORDER BY price_date
+"""
+
+# Cryptos : barres journalières de prices_daily (dernière observation du jour ayant un close)
+DAILY_HISTORY_QUERY = """
+    SELECT last_price_id, last_price_date, close_value
+    FROM prices_daily
+    WHERE asset_id = :asset_id AND close_value IS NOT NULL
+    ORDER BY price_day
+"""
+
+DAILY_SINCE_QUERY = """
+    SELECT last_price_id, last_price_date, close_value
+    FROM prices_daily
+    WHERE asset_id = :asset_id AND close_value IS NOT NULL AND price_day >= TRUNC(:since)
+    ORDER BY price_day
+"""
 
 def compute_rsi(series, window=14):
     delta = series.diff()
@@ -12,20 +47,15 @@ def compute_rsi(series, window=14):
     rsi = 100 - (100 / (1 + rs))
     return rsi
 
-def update_last_obs_for_asset(asset_id, asset_type):
-    conn = get_oracle_connection()
-    query = """
-        SELECT price_id, price_date, close_value
-        FROM prices
-        WHERE asset_id = :asset_id AND close_value IS NOT NULL
-        ORDER BY price_date
+def compute_last_obs_pandas(conn, asset_id, asset_type):
     """
-    df = pd.read_sql(query, conn, params={"asset_id": asset_id})
+    Calcul de référence (pandas, historique complet lu dans prices, y compris l'horaire crypto) :
+    retourne (price_id, rsi, ma52, ma104) ou None. Sert de contrôle de l'agrégat prices_daily.
+    """
+    df = pd.read_sql(HISTORY_QUERY, conn, params={"asset_id": asset_id})
     df.columns = [c.lower() for c in df.columns]
     if df.empty:
-        logger.info(f"Aucune donnée pour asset_id={asset_id}")
-        conn.close()
-        return 0
+        return None
     df = df.sort_values('price_date').reset_index(drop=True)
     # Pour les cryptos, regrouper par jour et prendre le dernier close
     if asset_type == 'CRYPTO':
@@ -46,41 +76,106 @@ def update_last_obs_for_asset(asset_id, asset_type):
         df['ma52'] = df[price_col].rolling(window=ma52, min_periods=min_periods_ma).mean()
     if len(df) >= ma104:
         df['ma104'] = df[price_col].rolling(window=ma104, min_periods=52).mean()
-    # Mise à jour uniquement sur la dernière observation
     last = df.iloc[-1]
+    return (
+        int(last['price_id']),
+        float(last['rsi']) if 'rsi' in last and pd.notnull(last['rsi']) else None,
+        float(last['ma52']) if 'ma52' in last and pd.notnull(last['ma52']) else None,
+        float(last['ma104']) if 'ma104' in last and pd.notnull(last['ma104']) else None
+    )
+
+def rebuild_state(cur, asset_id, asset_type):
+    """Reconstruction complète de l'état incrémental à partir de tout l'historique."""
+    cur.execute(DAILY_HISTORY_QUERY if asset_type == 'CRYPTO' else HISTORY_QUERY, {"asset_id": asset_id})
+    state = IncrementalIndicators()
+    for key, close, price_id in bars_from_rows(cur.fetchall(), asset_type):
+        state.append(key, close, price_id)
+    return state
+
+def update_last_obs_for_asset(asset_id, asset_type, states=None, date_min=None, rebuild=False, conn=None):
+    """Met à jour rsi/ma52/ma104 de la dernière observation via l'état incrémental (O(1) par nouvelle barre)."""
+    if conn is None:
+        with acquire() as pooled_conn:
+            return update_last_obs_for_asset(asset_id, asset_type, states, date_min, rebuild, pooled_conn)
+    states = {} if states is None else states
+    date_min = date_min.isoformat() if date_min is not None else None
     cur = conn.cursor()
+    state = states.get(asset_id)
+    if rebuild or state is None or state.date_min != date_min:
+        state = rebuild_state(cur, asset_id, asset_type)
+        state.date_min = date_min
+        logger.info(f"♻️ État indicateurs reconstruit pour asset_id={asset_id} ({state.n} barres)")
+    else:
+        since_query = DAILY_SINCE_QUERY if asset_type == 'CRYPTO' else SINCE_QUERY
+        cur.execute(since_query, {"asset_id": asset_id, "since": since_datetime(state)})
+        for key, close, price_id in bars_from_rows(cur.fetchall(), asset_type):
+            state.push(key, close, price_id)
+    if state.n == 0:
+        logger.info(f"Aucune donnée pour asset_id={asset_id}")
+        cur.close()
+        return 0
+    states[asset_id] = state
+    rsi, ma52, ma104 = state.values()
     cur.execute("""
         UPDATE prices SET rsi = :rsi, ma52 = :ma52, ma104 = :ma104 WHERE price_id = :price_id
-    """, {
-        "rsi": float(last['rsi']) if 'rsi' in last and pd.notnull(last['rsi']) else None,
-        "ma52": float(last['ma52']) if 'ma52' in last and pd.notnull(last['ma52']) else None,
-        "ma104": float(last['ma104']) if 'ma104' in last and pd.notnull(last['ma104']) else None,
-        "price_id": int(last['price_id'])
-    })
+    """, {"rsi": rsi, "ma52": ma52, "ma104": ma104, "price_id": int(state.last_price_id)})
     conn.commit()
     cur.close()
-    conn.close()
     logger.info(f"Dernière observation mise à jour pour asset_id={asset_id}")
     return 1
 
-def update_last_obs_all_assets(asset_type_filter=None):
-    conn = get_oracle_connection()
-    query = "SELECT asset_id, asset_type FROM assets"
-    if asset_type_filter:
-        query += " WHERE asset_type = :atype"
-        assets = pd.read_sql(query, conn, params={"atype": asset_type_filter})
-    else:
-        assets = pd.read_sql(query, conn)
-    assets.columns = [c.lower() for c in assets.columns]
-    conn.close()
+def check_asset(conn, asset_id, asset_type, state, tolerance=1e-6):
+    """Compare l'état incrémental au calcul pandas complet. Retourne True si cohérent."""
+    reference = compute_last_obs_pandas(conn, asset_id, asset_type)
+    if reference is None:
+        return state is None or state.n == 0
+    expected = reference[1:]
+    actual = state.values()
+    for name, exp, act in zip(("rsi", "ma52", "ma104"), expected, actual):
+        if exp is None and act is None:
+            continue
+        if exp is None or act is None or not math.isclose(exp, act, rel_tol=tolerance, abs_tol=tolerance):
+            logger.error(f"❌ Incohérence {name} pour asset_id={asset_id} : pandas={exp} incrémental={act}")
+            return False
+    if reference[0] != state.last_price_id:
+        logger.error(f"❌ Incohérence price_id pour asset_id={asset_id} : pandas={reference[0]} incrémental={state.last_price_id}")
+        return False
+    return True
+
+def update_last_obs_all_assets(asset_type_filter=None, rebuild=False, check=False):
+    loaded_at = time.time()
+    states = load_states()
     total = 0
-    for _, row in assets.iterrows():
-        total += update_last_obs_for_asset(row['asset_id'], row['asset_type'])
+    mismatches = 0
+    with acquire() as conn:
+        query = "SELECT asset_id, asset_type, date_min FROM assets"
+        if asset_type_filter:
+            query += " WHERE asset_type = :atype"
+            assets = pd.read_sql(query, conn, params={"atype": asset_type_filter})
+        else:
+            assets = pd.read_sql(query, conn)
+        assets.columns = [c.lower() for c in assets.columns]
+        for _, row in assets.iterrows():
+            asset_id = int(row['asset_id'])
+            date_min = row['date_min'] if pd.notnull(row['date_min']) else None
+            try:
+                total += update_last_obs_for_asset(asset_id, row['asset_type'], states, date_min, rebuild, conn)
+            except Exception as e:
+                logger.error(f"❌ Erreur mise à jour indicateurs asset_id={asset_id}: {e}")
+                states.pop(asset_id, None)
+                continue
+            if check and not check_asset(conn, asset_id, row['asset_type'], states.get(asset_id)):
+                mismatches += 1
+                states.pop(asset_id, None)
+    save_states(states, since=loaded_at)
     logger.info(f"Total dernières observations mises à jour : {total}")
+    if check:
+        logger.info(f"Contrôle de cohérence : {mismatches} incohérence(s) sur {len(assets)} actifs")
 
 if __name__ == "__main__":
-    import sys
-    if len(sys.argv) > 1:
-        update_last_obs_all_assets(sys.argv[1])
-    else:
-        update_last_obs_all_assets()
+    parser = argparse.ArgumentParser(description="Mise à jour incrémentale de rsi/ma52/ma104 sur la dernière observation")
+    parser.add_argument("asset_type", nargs="?", default=None, help="Filtre asset_type (CRYPTO, STOCK, ETF)")
+    parser.add_argument("--rebuild", action="store_true", help="Reconstruit l'état à partir de tout l'historique")
+    parser.add_argument("--check", action="store_true", help="Compare l'état incrémental au calcul pandas complet")
+    args = parser.parse_args()
+    update_last_obs_all_assets(args.asset_type, rebuild=args.rebuild, check=args.check)
@@ -0,0 +1,234 @@
+import argparse
+import json
+import os
+from datetime import datetime, timedelta
+from pathlib import Path
+import numpy as np
+from scripts.utils.bd_oracle_connection import acquire, number_list
+from scripts.utils.logger import logger
+
+# Cache local de la table prices : un dossier par asset_id, une colonne par fichier .npy (lisible en mmap)
+CACHE_DIR = Path(os.getenv("PRICE_CACHE_DIR", str(Path.home() / "market-watcher/data/price_cache")))
+COLUMNS = ("open_value", "high_value", "low_value", "close_value", "price_value", "volume")
+DATE_COLUMN = "price_date"
+
+REFRESH_QUERY = """
+    SELECT asset_id, price_date, open_value, high_value, low_value, close_value, price_value, volume
+    FROM prices
+    WHERE asset_id IN (SELECT column_value FROM TABLE(:ids)) {since_filter}
+    ORDER BY asset_id, price_date
+"""
+
+def cache_enabled():
+    return os.getenv("USE_PRICE_CACHE") == "1"
+
+def _asset_dir(asset_id):
+    return CACHE_DIR / str(int(asset_id))
+
+def read_meta(asset_id):
+    meta_path = _asset_dir(asset_id) / "meta.json"
+    if not meta_path.exists():
+        return None
+    with open(meta_path, "r") as f:
+        return json.load(f)
+
+def _load_columns(asset_id, columns=None, mmap_mode="r"):
+    asset_dir = _asset_dir(asset_id)
+    names = (DATE_COLUMN,) + tuple(columns if columns is not None else COLUMNS)
+    data = {name: np.load(asset_dir / f"{name}.npy", mmap_mode=mmap_mode) for name in names}
+    lengths = {len(values) for values in data.values()}
+    if len(lengths) > 1:
+        raise RuntimeError(f"Cache incohérent pour asset_id={asset_id} (rafraîchissement en cours ?)")
+    return data
+
+def _write_columns(asset_id, data, watermark):
+    asset_dir = _asset_dir(asset_id)
+    asset_dir.mkdir(parents=True, exist_ok=True)
+    for name, values in data.items():
+        tmp_path = asset_dir / f"{name}.tmp.npy"
+        np.save(tmp_path, np.ascontiguousarray(values))
+        tmp_path.replace(asset_dir / f"{name}.npy")
+    first_date = data[DATE_COLUMN][0].astype(datetime).isoformat()
+    meta = {"watermark": watermark, "first_date": first_date, "rows": len(data[DATE_COLUMN]),
+            "refreshed_at": datetime.now().isoformat()}
+    tmp_meta = asset_dir / "meta.json.tmp"
+    with open(tmp_meta, "w") as f:
+        json.dump(meta, f)
+    tmp_meta.replace(asset_dir / "meta.json")
+
+def _fetch_rows(conn, asset_ids, since=None):
+    cur = conn.cursor()
+    cur.arraysize = 10000
+    params = {"ids": number_list(conn, asset_ids)}
+    since_filter = ""
+    if since is not None:
+        since_filter = "AND price_date >= :since"
+        params["since"] = since
+    cur.execute(REFRESH_QUERY.format(since_filter=since_filter), params)
+    rows = cur.fetchall()
+    cur.close()
+    if not rows:
+        return {}
+    asset_col = np.array([r[0] for r in rows], dtype=np.int64)
+    columns = {DATE_COLUMN: np.array([r[1] for r in rows], dtype="datetime64[s]")}
+    for idx, name in enumerate(COLUMNS, start=2):
+        columns[name] = np.array([r[idx] for r in rows], dtype=np.float64)
+    boundaries = np.flatnonzero(asset_col[1:] != asset_col[:-1]) + 1
+    starts = np.concatenate(([0], boundaries))
+    ends = np.concatenate((boundaries, [len(asset_col)]))
+    return {
+        int(asset_col[start]): {name: values[start:end] for name, values in columns.items()}
+        for start, end in zip(starts, ends)
+    }
+
+def refresh_cache(asset_ids=None, asset_type=None):
+    """
+    Rafraîchit le cache de façon incrémentale : seuls les actifs dont assets.date_max dépasse
+    le watermark local sont relus, à partir de ce watermark (la dernière ligne est relue et remplacée).
+    Un actif dont assets.date_min précède la première date en cache (historique ajouté par un backfill)
+    est relu entièrement.
+    """
+    with acquire() as conn:
+        cur = conn.cursor()
+        query = "SELECT asset_id, date_max, date_min FROM assets WHERE date_max IS NOT NULL"
+        params = {}
+        if asset_type:
+            query += " AND asset_type = :atype"
+            params["atype"] = asset_type
+        cur.execute(query, params)
+        dates_by_asset = {int(a): (date_max, date_min) for a, date_max, date_min in cur.fetchall()}
+        cur.close()
+        if asset_ids is not None:
+            wanted = {int(a) for a in asset_ids}
+            dates_by_asset = {a: d for a, d in dates_by_asset.items() if a in wanted}
+
+        watermarks = {}
+        for asset_id, (date_max, date_min) in dates_by_asset.items():
+            meta = read_meta(asset_id)
+            watermark = datetime.fromisoformat(meta["watermark"]) if meta and meta.get("watermark") else None
+            first_date = datetime.fromisoformat(meta["first_date"]) if meta and meta.get("first_date") else None
+            if watermark is not None and (first_date is None or (date_min is not None and date_min < first_date)):
+                watermarks[asset_id] = None
+            elif watermark is None or watermark < date_max:
+                watermarks[asset_id] = watermark
+        if not watermarks:
+            logger.info("✅ Cache de prix à jour")
+            return 0
+
+        new_assets = [a for a, w in watermarks.items() if w is None]
+        stale_assets = [a for a, w in watermarks.items() if w is not None]
+        fetched = {}
+        if new_assets:
+            fetched.update(_fetch_rows(conn, new_assets))
+        if stale_assets:
+            # Une seule requête depuis le plus ancien watermark, puis filtrage par actif
+            fetched.update(_fetch_rows(conn, stale_assets, since=min(watermarks[a] for a in stale_assets)))
+
+    appended = 0
+    for asset_id, watermark in watermarks.items():
+        new_data = fetched.get(asset_id)
+        if new_data is None:
+            continue
+        if watermark is not None:
+            keep_new = new_data[DATE_COLUMN] >= np.datetime64(watermark, "s")
+            new_data = {name: values[keep_new] for name, values in new_data.items()}
+            old_data = _load_columns(asset_id, mmap_mode=None)
+            keep_old = old_data[DATE_COLUMN] < np.datetime64(watermark, "s")
+            data = {name: np.concatenate((old_data[name][keep_old], new_data[name])) for name in old_data}
+        else:
+            data = new_data
+        if len(data[DATE_COLUMN]) == 0:
+            continue
+        last_date = data[DATE_COLUMN][-1].astype(datetime)
+        _write_columns(asset_id, data, last_date.isoformat())
+        appended += len(new_data[DATE_COLUMN])
+    logger.info(f"✅ Cache de prix rafraîchi : {len(watermarks)} actifs, {appended} lignes relues")
+    return appended
+
+def clear_cache(asset_ids=None):
+    """
+    Oublie le watermark des actifs (tous par défaut) : ils sont lus dans Oracle (repli de price_loader)
+    jusqu'au prochain refresh, qui les relit entièrement.
+    """
+    targets = [_asset_dir(a) for a in asset_ids] if asset_ids is not None else list(CACHE_DIR.glob("*"))
+    for asset_dir in targets:
+        meta_path = asset_dir / "meta.json"
+        if meta_path.exists():
+            meta_path.unlink()
+
+def invalidate_cache(asset_ids):
+    """Après un backfill (historique ajouté derrière le watermark) : oublie les actifs et les relit si le cache est actif."""
+    asset_ids = [int(a) for a in asset_ids]
+    if not asset_ids:
+        return
+    clear_cache(asset_ids)
+    if cache_enabled():
+        refresh_cache(asset_ids=asset_ids)
+
+def read_prices(asset_id, start=None, end=None, columns=None):
+    """
+    Lecture zero-copy : retourne des vues mmap des colonnes de l'actif sur [start, end].
+    Retourne None si l'actif n'est pas en cache ou si ses fichiers sont en cours de remplacement.
+    """
+    if read_meta(asset_id) is None:
+        return None
+    try:
+        data = _load_columns(asset_id, columns)
+    except (RuntimeError, OSError, ValueError) as e:
+        logger.warning(f"⚠️ Cache illisible pour asset_id={asset_id} : {e}")
+        return None
+    dates = data[DATE_COLUMN]
+    lo = np.searchsorted(dates, np.datetime64(start, "s"), side="left") if start is not None else 0
+    hi = np.searchsorted(dates, np.datetime64(end, "s"), side="right") if end is not None else len(dates)
+    return {name: values[lo:hi] for name, values in data.items()}
+
+def _aggregate_daily(dates, price, volume):
+    """Équivalent NumPy de GROUP BY TRUNC(price_date) avec MAX(prix) et SUM(volume)."""
+    days = dates.astype("datetime64[D]")
+    starts = np.concatenate(([0], np.flatnonzero(days[1:] != days[:-1]) + 1))
+    has_volume = np.add.reduceat(~np.isnan(volume), starts) > 0
+    volume_sum = np.add.reduceat(np.nan_to_num(volume), starts)
+    return {
+        "price_date": days[starts].astype("datetime64[s]"),
+        "price": np.maximum.reduceat(price, starts),
+        "volume": np.where(has_volume, volume_sum, np.nan)
+    }
+
+def load_price_histories_cached(asset_ids, value_column="close_value", daily=False, since_days=None,
+                                start_date=None, end_date=None, require_value=True, missing=None):
+    """
+    Même contrat que price_loader.load_price_histories, servi depuis le cache local sans Oracle.
+    Les actifs non servis (absents ou illisibles) sont ajoutés à `missing` si fourni.
+    """
+    if since_days is not None:
+        since = datetime.now() - timedelta(days=since_days)
+        start_date = max(start_date, since) if start_date is not None else since
+    histories = {}
+    for asset_id in sorted({int(a) for a in asset_ids}):
+        data = read_prices(asset_id, start_date, end_date, columns=(value_column, "volume"))
+        if data is None:
+            logger.warning(f"⚠️ asset_id={asset_id} absent du cache de prix")
+            if missing is not None:
+                missing.append(asset_id)
+            continue
+        dates, price, volume = data[DATE_COLUMN], data[value_column], data["volume"]
+        if require_value:
+            valid = ~np.isnan(price)
+            dates, price, volume = dates[valid], price[valid], volume[valid]
+        if len(dates) == 0:
+            continue
+        if daily:
+            histories[asset_id] = _aggregate_daily(dates, price, volume)
+        else:
+            histories[asset_id] = {"price_date": dates, "price": price, "volume": volume}
+    return histories
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Cache local colonnaire de la table prices")
+    parser.add_argument("command", choices=["refresh", "rebuild"],
+                        help="refresh : mise à jour incrémentale ; rebuild : relecture complète (après un backfill)")
+    parser.add_argument("--asset-type", default=None, help="Filtre asset_type (CRYPTO, STOCK, ETF)")
+    args = parser.parse_args()
+    if args.command == "rebuild":
+        clear_cache()
+    refresh_cache(asset_type=args.asset_type)
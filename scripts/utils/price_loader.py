@@ -0,0 +1,174 @@
+import numpy as np
+from scripts.utils.bd_oracle_connection import acquire, number_list
+from scripts.utils.logger import logger
+from scripts.utils.price_cache import cache_enabled, load_price_histories_cached
+
+VALUE_COLUMNS = ("close_value", "price_value")
+# Colonne de prices_daily portant le maximum journalier de chaque colonne de prix
+DAILY_MAX_COLUMNS = {"close_value": "max_close", "price_value": "max_price"}
+
+def _build_query(value_column, daily, since_days, start_date, end_date, require_value):
+    if value_column not in VALUE_COLUMNS:
+        raise ValueError(f"Colonne de prix non supportée : {value_column}")
+    filters = ["asset_id IN (SELECT column_value FROM TABLE(:ids))"]
+    if daily:
+        # Barres journalières lues dans l'agrégat prices_daily (parcours d'index, sans GROUP BY)
+        daily_column = DAILY_MAX_COLUMNS[value_column]
+        if require_value:
+            filters.append(f"{daily_column} IS NOT NULL")
+        if since_days is not None:
+            filters.append("price_day >= TRUNC(SYSDATE - :since_days)")
+        if start_date is not None:
+            filters.append("price_day >= TRUNC(:start_date)")
+        if end_date is not None:
+            filters.append("price_day <= :end_date")
+        where = " AND ".join(filters)
+        return f"""
+            SELECT asset_id, price_day AS price_date, {daily_column} AS price, volume
+            FROM prices_daily
+            WHERE {where}
+            ORDER BY asset_id, price_day
+        """
+    if require_value:
+        filters.append(f"{value_column} IS NOT NULL")
+    if since_days is not None:
+        filters.append("price_date >= SYSDATE - :since_days")
+    if start_date is not None:
+        filters.append("price_date >= :start_date")
+    if end_date is not None:
+        filters.append("price_date <= :end_date")
+    where = " AND ".join(filters)
+    return f"""
+        SELECT asset_id, price_date, {value_column} AS price, volume
+        FROM prices
+        WHERE {where}
+        ORDER BY asset_id, price_date
+    """
+
+def split_by_asset(asset_col, columns):
+    """Découpe des colonnes triées par asset_id en vues NumPy par actif (sans copie ni DataFrame)."""
+    if len(asset_col) == 0:
+        return {}
+    boundaries = np.flatnonzero(asset_col[1:] != asset_col[:-1]) + 1
+    starts = np.concatenate(([0], boundaries))
+    ends = np.concatenate((boundaries, [len(asset_col)]))
+    return {
+        int(asset_col[start]): {name: values[start:end] for name, values in columns.items()}
+        for start, end in zip(starts, ends)
+    }
+
+def load_price_histories(asset_ids, value_column="close_value", daily=False, since_days=None,
+                         start_date=None, end_date=None, require_value=True, conn=None, use_cache=None):
+    """
+    Charge en une seule requête paramétrée l'historique de prix d'une liste d'actifs.
+    Retourne {asset_id: {"price_date": datetime64[s], "price": float64, "volume": float64}}.
+    Avec use_cache (par défaut : USE_PRICE_CACHE=1), lit le cache local ; seuls les actifs absents du cache
+    ou en cours de rafraîchissement sont lus dans Oracle.
+    """
+    asset_ids = sorted({int(a) for a in asset_ids})
+    if not asset_ids:
+        return {}
+    if use_cache is None:
+        use_cache = cache_enabled()
+    if use_cache:
+        missing = []
+        histories = load_price_histories_cached(asset_ids, value_column, daily, since_days, start_date, end_date,
+                                                require_value, missing=missing)
+        if missing:
+            histories.update(load_price_histories(missing, value_column, daily, since_days, start_date, end_date,
+                                                  require_value, conn, use_cache=False))
+        return histories
+    if conn is None:
+        with acquire() as pooled_conn:
+            return load_price_histories(asset_ids, value_column, daily, since_days, start_date, end_date,
+                                        require_value, pooled_conn, use_cache=False)
+    query = _build_query(value_column, daily, since_days, start_date, end_date, require_value)
+    params = {"ids": number_list(conn, asset_ids)}
+    if since_days is not None:
+        params["since_days"] = since_days
+    if start_date is not None:
+        params["start_date"] = start_date
+    if end_date is not None:
+        params["end_date"] = end_date
+    cur = conn.cursor()
+    cur.arraysize = 10000
+    cur.execute(query, params)
+    rows = cur.fetchall()
+    cur.close()
+    logger.info(f"📥 {len(rows)} prix chargés pour {len(asset_ids)} actifs en une requête")
+    if not rows:
+        return {}
+    asset_col, date_col, price_col, volume_col = zip(*rows)
+    columns = {
+        "price_date": np.array(date_col, dtype="datetime64[s]"),
+        "price": np.array(price_col, dtype=np.float64),
+        "volume": np.array(volume_col, dtype=np.float64)
+    }
+    return split_by_asset(np.array(asset_col, dtype=np.int64), columns)
+
+DAILY_CLOSE_PANEL_QUERY = """
+    SELECT d.asset_id, d.price_day,
+           CASE WHEN a.asset_type = 'CRYPTO' THEN d.max_close ELSE d.close_value END AS close_value
+    FROM prices_daily d
+    JOIN assets a ON a.asset_id = d.asset_id
+    WHERE d.asset_id IN (SELECT column_value FROM TABLE(:ids))
+      AND d.close_value IS NOT NULL {window_filter}
+"""
+
+def pivot_panel(asset_col, day_col, value_col, asset_ids):
+    """Pivote des triplets (asset_id, jour, valeur) en une matrice jours × actifs (NaN si absent)."""
+    days, day_idx = np.unique(day_col, return_inverse=True)
+    position = {asset_id: j for j, asset_id in enumerate(asset_ids)}
+    asset_idx = np.array([position[a] for a in asset_col], dtype=np.int64)
+    matrix = np.full((len(days), len(asset_ids)), np.nan)
+    matrix[day_idx, asset_idx] = value_col
+    return days, matrix
+
+def load_daily_close_panel(asset_ids, window_days=None, conn=None):
+    """
+    Charge en une requête les clôtures journalières d'une liste d'actifs
+    (cryptos : MAX du jour, autres : dernière clôture du jour) et les pivote en matrice jours × actifs.
+    Retourne (jours datetime64[D], asset_ids dans l'ordre des colonnes, matrice float64).
+    """
+    asset_ids = sorted({int(a) for a in asset_ids})
+    if not asset_ids:
+        return np.array([], dtype="datetime64[D]"), asset_ids, np.empty((0, 0))
+    if conn is None:
+        with acquire() as pooled_conn:
+            return load_daily_close_panel(asset_ids, window_days, pooled_conn)
+    params = {"ids": number_list(conn, asset_ids)}
+    window_filter = ""
+    if window_days is not None:
+        window_filter = "AND d.price_day >= TRUNC(SYSDATE) - :window_days"
+        params["window_days"] = window_days
+    cur = conn.cursor()
+    cur.arraysize = 10000
+    cur.execute(DAILY_CLOSE_PANEL_QUERY.format(window_filter=window_filter), params)
+    rows = cur.fetchall()
+    cur.close()
+    if not rows:
+        return np.array([], dtype="datetime64[D]"), asset_ids, np.empty((0, len(asset_ids)))
+    asset_col, day_col, value_col = zip(*rows)
+    days, matrix = pivot_panel(
+        np.array(asset_col, dtype=np.int64),
+        np.array(day_col, dtype="datetime64[D]"),
+        np.array(value_col, dtype=np.float64),
+        asset_ids
+    )
+    return days, asset_ids, matrix
+
+def panel_returns(matrix):
+    """
+    Rendements de chaque colonne entre deux observations consécutives de cet actif
+    (un actif coté 5 j/7 n'est pas pénalisé par les jours sans cotation) ; NaN là où il n'y a pas de prix.
+    """
+    n_rows = matrix.shape[0]
+    rows = np.arange(n_rows)[:, None]
+    observed = ~np.isnan(matrix)
+    last_seen = np.maximum.accumulate(np.where(observed, rows, -1), axis=0)
+    previous = np.vstack((np.full((1, matrix.shape[1]), -1), last_seen[:-1]))
+    previous_price = np.take_along_axis(matrix, np.maximum(previous, 0), axis=0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        returns = matrix / previous_price - 1
+    returns[~observed | (previous < 0)] = np.nan
+    return returns
@@ -0,0 +1,153 @@
+import argparse
+import threading
+from datetime import datetime
+from scripts.utils.bd_oracle_connection import acquire, create_table_if_missing, number_list, varchar_list
+from scripts.utils.logger import logger
+
+# Agrégat journalier de prices (une ligne par actif et par jour), table organisée par index :
+# les lectures par actif / plage de jours sont de simples parcours d'index.
+# close_value / last_price_date / last_price_id : dernière observation du jour ayant un close
+# (celle que les indicateurs crypto utilisent) ; max_close / max_price : maxima du jour.
+PRICES_DAILY_DDL = """
+    CREATE TABLE prices_daily (
+        asset_id        NUMBER NOT NULL,
+        price_day       DATE NOT NULL,
+        open_value      NUMBER,
+        high_value      NUMBER,
+        low_value       NUMBER,
+        close_value     NUMBER,
+        max_close       NUMBER,
+        max_price       NUMBER,
+        volume          NUMBER,
+        last_price_date DATE,
+        last_price_id   NUMBER,
+        CONSTRAINT prices_daily_pk PRIMARY KEY (asset_id, price_day)
+    ) ORGANIZATION INDEX
+"""
+
+AGGREGATE_SQL = """
+    SELECT p.asset_id, TRUNC(p.price_date) AS price_day,
+           MIN(p.open_value) KEEP (DENSE_RANK FIRST ORDER BY p.price_date) AS open_value,
+           MAX(p.high_value) AS high_value,
+           MIN(p.low_value) AS low_value,
+           MAX(p.close_value) KEEP (DENSE_RANK LAST ORDER BY NVL2(p.close_value, 1, 0), p.price_date) AS close_value,
+           MAX(p.close_value) AS max_close,
+           MAX(p.price_value) AS max_price,
+           SUM(p.volume) AS volume,
+           MAX(p.price_date) KEEP (DENSE_RANK LAST ORDER BY NVL2(p.close_value, 1, 0), p.price_date) AS last_price_date,
+           MAX(p.price_id) KEEP (DENSE_RANK LAST ORDER BY NVL2(p.close_value, 1, 0), p.price_date) AS last_price_id
+    FROM prices p
+    WHERE {filters}
+    GROUP BY p.asset_id, TRUNC(p.price_date)
+"""
+
+MERGE_SQL = """
+    MERGE INTO prices_daily d
+    USING ({source}) s
+    ON (d.asset_id = s.asset_id AND d.price_day = s.price_day)
+    WHEN MATCHED THEN UPDATE SET
+        d.open_value = s.open_value, d.high_value = s.high_value, d.low_value = s.low_value,
+        d.close_value = s.close_value, d.max_close = s.max_close, d.max_price = s.max_price,
+        d.volume = s.volume, d.last_price_date = s.last_price_date, d.last_price_id = s.last_price_id
+    WHEN NOT MATCHED THEN INSERT (asset_id, price_day, open_value, high_value, low_value, close_value,
+                                  max_close, max_price, volume, last_price_date, last_price_id)
+        VALUES (s.asset_id, s.price_day, s.open_value, s.high_value, s.low_value, s.close_value,
+                s.max_close, s.max_price, s.volume, s.last_price_date, s.last_price_id)
+"""
+
+# Jours touchés par le lot en cours de prices_stage (appelé par upsert_prices avant le commit)
+STAGE_FILTER = """
+    EXISTS (SELECT 1 FROM prices_stage s
+            WHERE s.asset_id = p.asset_id
+              AND p.price_date >= TRUNC(s.price_date) AND p.price_date < TRUNC(s.price_date) + 1)
+"""
+
+# Actifs dont l'historique de prices commence avant le premier jour de prices_daily (ou absents de l'agrégat) :
+# table tout juste créée, ou alimentée seulement par les upserts depuis son déploiement
+UNCOVERED_ASSETS_SQL = """
+    SELECT a.asset_id FROM assets a
+    WHERE (SELECT MIN(p.price_date) FROM prices p WHERE p.asset_id = a.asset_id)
+          < NVL((SELECT MIN(d.price_day) FROM prices_daily d WHERE d.asset_id = a.asset_id), DATE '9999-12-31')
+"""
+
+_table_ready = False
+_table_lock = threading.Lock()
+
+def ensure_table(cur=None):
+    """
+    Crée prices_daily si besoin et la remplit depuis prices pour les actifs qu'elle ne couvre pas encore,
+    afin que les lecteurs ne voient jamais un agrégat partiel. Une fois par process.
+    cur doit appartenir à une session sans transaction en cours (DDL = commit implicite) ;
+    sans cur, une connexion dédiée est prise dans le pool.
+    """
+    global _table_ready
+    if _table_ready:
+        return
+    if cur is None:
+        with acquire() as conn:
+            own_cur = conn.cursor()
+            try:
+                ensure_table(own_cur)
+            finally:
+                own_cur.close()
+        return
+    with _table_lock:
+        if _table_ready:
+            return
+        create_table_if_missing(cur, PRICES_DAILY_DDL)
+        cur.execute(UNCOVERED_ASSETS_SQL)
+        asset_ids = [row[0] for row in cur.fetchall()]
+        if asset_ids:
+            logger.info(f"⏳ prices_daily : initialisation depuis prices pour {len(asset_ids)} actifs")
+            merged = _merge(cur, "p.asset_id IN (SELECT column_value FROM TABLE(:ids))",
+                            {"ids": number_list(cur.connection, asset_ids)})
+            cur.connection.commit()
+            logger.info(f"✅ prices_daily : {merged} jours initialisés")
+        _table_ready = True
+
+def _merge(cur, filters, params):
+    cur.execute(MERGE_SQL.format(source=AGGREGATE_SQL.format(filters=filters)), params)
+    return cur.rowcount
+
+def refresh_from_stage(cur):
+    """
+    Recalcule les jours des lignes présentes dans prices_stage. Retourne le nombre de jours fusionnés.
+    La table doit déjà exister (ensure_table) : un DDL ici validerait et viderait prices_stage.
+    """
+    cur.execute(MERGE_SQL.format(source=AGGREGATE_SQL.format(filters=STAGE_FILTER)))
+    return cur.rowcount
+
+def refresh_prices_daily(asset_ids=None, asset_types=None, since=None, conn=None):
+    """
+    Recalcule prices_daily depuis prices (tous les actifs, ou asset_ids / asset_types, à partir du jour `since`).
+    Sert à l'initialisation et après une correction manuelle de prices ; les upserts le maintiennent ensuite.
+    """
+    ensure_table()
+    if conn is None:
+        with acquire() as pooled_conn:
+            return refresh_prices_daily(asset_ids, asset_types, since, pooled_conn)
+    filters, params = ["1 = 1"], {}
+    if asset_ids is not None:
+        filters.append("p.asset_id IN (SELECT column_value FROM TABLE(:ids))")
+        params["ids"] = number_list(conn, asset_ids)
+    if asset_types is not None:
+        filters.append("p.asset_id IN (SELECT asset_id FROM assets WHERE asset_type IN "
+                       "(SELECT column_value FROM TABLE(:types)))")
+        params["types"] = varchar_list(conn, asset_types)
+    if since is not None:
+        filters.append("p.price_date >= TRUNC(:since)")
+        params["since"] = since
+    cur = conn.cursor()
+    merged = _merge(cur, " AND ".join(filters), params)
+    conn.commit()
+    cur.close()
+    logger.info(f"✅ prices_daily : {merged} jours recalculés")
+    return merged
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Reconstruction de l'agrégat journalier prices_daily")
+    parser.add_argument("--asset-type", action="append", default=None, help="Filtre asset_type (répétable)")
+    parser.add_argument("--since", default=None, help="Premier jour à recalculer (YYYY-MM-DD)")
+    args = parser.parse_args()
+    since = datetime.strptime(args.since, "%Y-%m-%d") if args.since else None
+    refresh_prices_daily(asset_types=args.asset_type, since=since)
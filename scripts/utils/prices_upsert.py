@@ -0,0 +1,160 @@
+import cx_Oracle
+import threading
+import pytz
+from scripts.utils.bd_oracle_connection import acquire, create_table_if_missing
+from scripts.utils.logger import logger
+from scripts.utils.candles import CandleBatch
+from scripts.utils.prices_daily import ensure_table as ensure_prices_daily, refresh_from_stage
+
+DEFAULT_BATCH_SIZE = 1000
+_stage_ready = False
+_stage_lock = threading.Lock()
+PARIS = pytz.timezone("Europe/Paris")
+
+# Table temporaire de staging (vidée à chaque commit)
+STAGE_TABLE_DDL = """
+    CREATE GLOBAL TEMPORARY TABLE prices_stage (
+        asset_id          NUMBER,
+        price_date        DATE,
+        price_value       NUMBER,
+        open_value        NUMBER,
+        high_value        NUMBER,
+        low_value         NUMBER,
+        close_value       NUMBER,
+        volume            NUMBER,
+        dividend_amount   NUMBER,
+        split_coefficient NUMBER,
+        source            NUMBER
+    ) ON COMMIT DELETE ROWS
+"""
+
+INSERT_STAGE_SQL = """
+    INSERT INTO prices_stage (asset_id, price_date, price_value, open_value, high_value, low_value,
+                              close_value, volume, dividend_amount, split_coefficient, source)
+    VALUES (:1, :2, :3, :4, :5, :6, :7, :8, :9, :10, :11)
+"""
+
+STAGE_INPUT_SIZES = (int, cx_Oracle.DATETIME, float, float, float, float, float, float, float, float, int)
+
+COUNT_EXISTING_SQL = """
+    SELECT COUNT(*) FROM prices_stage s
+    WHERE EXISTS (SELECT 1 FROM prices p WHERE p.asset_id = s.asset_id AND p.price_date = s.price_date)
+"""
+
+# price_value, dividend et split ne sont pas fournis par toutes les sources : on conserve alors la valeur en base
+MERGE_SQL = """
+    MERGE INTO prices dst
+    USING prices_stage src
+    ON (dst.asset_id = src.asset_id AND dst.price_date = src.price_date)
+    WHEN MATCHED THEN
+        UPDATE SET price_value = NVL(src.price_value, dst.price_value),
+                   open_value = src.open_value, high_value = src.high_value, low_value = src.low_value,
+                   close_value = src.close_value, volume = src.volume,
+                   dividend_amount = NVL(src.dividend_amount, dst.dividend_amount),
+                   split_coefficient = NVL(src.split_coefficient, dst.split_coefficient),
+                   source = src.source
+    WHEN NOT MATCHED THEN
+        INSERT (asset_id, price_date, price_value, open_value, high_value, low_value, close_value, volume,
+                dividend_amount, split_coefficient, source)
+        VALUES (src.asset_id, src.price_date, src.price_value, src.open_value, src.high_value, src.low_value,
+                src.close_value, src.volume, src.dividend_amount, src.split_coefficient, src.source)
+"""
+
+def _local_date(price_date):
+    """Date telle qu'Oracle la stockera : cx_Oracle ignore tzinfo, on convertit donc en heure de Paris sans fuseau."""
+    if price_date.tzinfo is None:
+        return price_date
+    return price_date.astimezone(PARIS).replace(tzinfo=None)
+
+def _bind_rows(rows, source, asset_id=None):
+    """
+    Transforme les bougies (dicts) en tuples positionnels, dédoublonnés sur (asset_id, price_date) en heure
+    locale : au passage à l'heure d'hiver, deux heures UTC tombent sur la même DATE et la dernière l'emporte.
+    """
+    binds = {}
+    for row in rows:
+        row_asset_id = row.get("asset_id", asset_id)
+        if row_asset_id is None:
+            raise ValueError("asset_id manquant pour une ligne de prix")
+        price_date = _local_date(row["price_date"])
+        binds[(row_asset_id, price_date)] = (
+            row_asset_id,
+            price_date,
+            row.get("price_value"),
+            row.get("open"),
+            row.get("high"),
+            row.get("low"),
+            row.get("close"),
+            row.get("volume"),
+            row.get("dividend_amount"),
+            row.get("split_coefficient"),
+            row.get("source", source)
+        )
+    return list(binds.values())
+
+def upsert_prices(rows, source, asset_id=None, batch_size=DEFAULT_BATCH_SIZE, conn=None, label=None):
+    """
+    Upsert en masse de bougies OHLCV dans prices (un ou plusieurs asset_id).
+    rows : CandleBatch (binds construits depuis les colonnes) ou liste de dicts.
+    Les lignes sont chargées par array binding dans prices_stage puis fusionnées par un seul MERGE,
+    avec un commit par lot ; les jours touchés sont recalculés dans prices_daily.
+    Retourne {"rows", "inserted", "updated", "batches"}.
+    """
+    if isinstance(rows, CandleBatch):
+        binds = rows.bind_rows(source, asset_id)
+    else:
+        binds = _bind_rows(rows, source, asset_id)
+    stats = {"rows": len(binds), "inserted": 0, "updated": 0, "batches": 0}
+    if not binds:
+        return stats
+    label = label or (f"asset_id={asset_id}" if asset_id is not None else f"{len(binds)} lignes")
+    _ensure_stage()
+    if conn is None:
+        with acquire() as pooled_conn:
+            return _upsert_batches(pooled_conn, binds, batch_size, stats, label)
+    return _upsert_batches(conn, binds, batch_size, stats, label)
+
+def _ensure_stage():
+    """
+    Crée prices_stage / prices_daily au premier upsert, sur une connexion dédiée : un DDL valide implicitement
+    la transaction de sa session et ne doit pas toucher celle de l'appelant.
+    """
+    global _stage_ready
+    with _stage_lock:
+        if _stage_ready:
+            return
+        with acquire() as ddl_conn:
+            cur = ddl_conn.cursor()
+            try:
+                create_table_if_missing(cur, STAGE_TABLE_DDL)
+                ensure_prices_daily(cur)
+            finally:
+                cur.close()
+        _stage_ready = True
+
+def _upsert_batches(conn, binds, batch_size, stats, label):
+    cur = conn.cursor()
+    try:
+        total = len(binds)
+        for start in range(0, total, batch_size):
+            batch = binds[start:start + batch_size]
+            cur.setinputsizes(*STAGE_INPUT_SIZES)
+            cur.executemany(INSERT_STAGE_SQL, batch)
+            cur.execute(COUNT_EXISTING_SQL)
+            existing = cur.fetchone()[0]
+            cur.execute(MERGE_SQL)
+            merged = cur.rowcount
+            # Agrégat journalier des jours touchés, dans la même transaction
+            refresh_from_stage(cur)
+            conn.commit()
+            stats["updated"] += existing
+            stats["inserted"] += merged - existing
+            stats["batches"] += 1
+            logger.info(f"⏳ Progression {label}: {min(start + batch_size, total)}/{total} lignes fusionnées")
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+    logger.info(f"✅ Upsert {label}: {stats['inserted']} insérées, {stats['updated']} mises à jour ({stats['batches']} lots)")
+    return stats
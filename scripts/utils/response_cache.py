@@ -0,0 +1,210 @@
+import asyncio
+import functools
+import inspect
+import threading
+import time
+from collections import OrderedDict
+from scripts.utils.bd_oracle_connection import acquire, create_table_if_missing
+from scripts.utils.logger import logger
+
+# Table de watermarks : les jobs d'extraction y datent leur dernière écriture (une ligne par source)
+WATERMARK_TABLE_DDL = """
+    CREATE TABLE cache_watermark (
+        source VARCHAR2(50) PRIMARY KEY,
+        updated_at TIMESTAMP NOT NULL
+    )
+"""
+
+BUMP_WATERMARK_SQL = """
+    MERGE INTO cache_watermark w
+    USING (SELECT :source AS source FROM dual) s
+    ON (w.source = s.source)
+    WHEN MATCHED THEN UPDATE SET w.updated_at = SYSTIMESTAMP
+    WHEN NOT MATCHED THEN INSERT (source, updated_at) VALUES (s.source, SYSTIMESTAMP)
+"""
+
+WATERMARK_CHECK_SECONDS = 30
+
+def bump_watermark(source, conn=None):
+    """
+    Signale aux API qu'une source de données a changé (ex : 'prices', 'transactions').
+    Les caches de réponses dépendant de cette source sont vidés au prochain contrôle.
+    """
+    if conn is None:
+        try:
+            with acquire() as pooled_conn:
+                return bump_watermark(source, pooled_conn)
+        except Exception as e:
+            logger.warning(f"⚠️ Watermark '{source}' non mis à jour : {e}")
+            return
+    cur = conn.cursor()
+    try:
+        cur.execute(BUMP_WATERMARK_SQL, {"source": source})
+    except Exception:
+        create_table_if_missing(cur, WATERMARK_TABLE_DDL)
+        cur.execute(BUMP_WATERMARK_SQL, {"source": source})
+    conn.commit()
+    cur.close()
+    logger.info(f"🔖 Watermark '{source}' mis à jour")
+
+def read_watermarks():
+    """Retourne {source: updated_at} depuis la table cache_watermark ({} si elle n'existe pas encore)."""
+    with acquire() as conn:
+        cur = conn.cursor()
+        try:
+            cur.execute("SELECT source, updated_at FROM cache_watermark")
+            return dict(cur.fetchall())
+        except Exception:
+            return {}
+        finally:
+            cur.close()
+
+def normalize_params(params):
+    """Clé de cache stable : paramètres triés, valeurs None ignorées, chaînes nettoyées."""
+    items = []
+    for name, value in sorted(params.items()):
+        if value is None:
+            continue
+        if isinstance(value, str):
+            value = value.strip()
+        items.append((name, value))
+    return tuple(items)
+
+class ResponseCache:
+    """
+    Cache de réponses en mémoire du process, partagé par les endpoints.
+    - TTL par endpoint, taille maximale avec éviction LRU ;
+    - invalidation explicite (par endpoint ou totale) ou via la table cache_watermark ;
+    - compteurs hits / misses par endpoint.
+    Les réponses d'erreur ({"error": ...}) ne sont jamais mises en cache.
+    freeze / thaw : conversion de la réponse en valeur stockée et inverse à chaque hit (ex : corps encodé
+    d'une Response, objet qui ne doit pas être partagé entre requêtes).
+    """
+
+    def __init__(self, max_entries=256, watermark_check_seconds=WATERMARK_CHECK_SECONDS,
+                 watermark_reader=read_watermarks, freeze=None, thaw=None):
+        self.max_entries = max_entries
+        self.freeze = freeze or (lambda value: value)
+        self.thaw = thaw or (lambda value: value)
+        self.watermark_check_seconds = watermark_check_seconds
+        self.watermark_reader = watermark_reader
+        self.entries = OrderedDict()
+        self.sources = {}
+        self.stats_by_endpoint = {}
+        self.watermarks = None
+        self.watermark_checked_at = 0.0
+        self.lock = threading.Lock()
+
+    def _stats(self, endpoint):
+        return self.stats_by_endpoint.setdefault(endpoint, {"hits": 0, "misses": 0, "evictions": 0})
+
+    def get(self, endpoint, key):
+        """Retourne (trouvé, valeur)."""
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get((endpoint, key))
+            if entry is not None and entry[0] > now:
+                self.entries.move_to_end((endpoint, key))
+                self._stats(endpoint)["hits"] += 1
+                return True, entry[1]
+            if entry is not None:
+                del self.entries[(endpoint, key)]
+            self._stats(endpoint)["misses"] += 1
+            return False, None
+
+    def set(self, endpoint, key, value, ttl):
+        with self.lock:
+            self.entries[(endpoint, key)] = (time.monotonic() + ttl, value)
+            self.entries.move_to_end((endpoint, key))
+            while len(self.entries) > self.max_entries:
+                (evicted_endpoint, _), _ = self.entries.popitem(last=False)
+                self._stats(evicted_endpoint)["evictions"] += 1
+
+    def invalidate(self, endpoint=None):
+        """Vide le cache d'un endpoint (ou tout le cache). Retourne le nombre d'entrées supprimées."""
+        with self.lock:
+            if endpoint is None:
+                removed = len(self.entries)
+                self.entries.clear()
+            else:
+                keys = [k for k in self.entries if k[0] == endpoint]
+                for k in keys:
+                    del self.entries[k]
+                removed = len(keys)
+        logger.info(f"🧹 Cache réponses invalidé ({endpoint or 'tous les endpoints'}) : {removed} entrées")
+        return removed
+
+    def invalidate_sources(self, sources):
+        """Vide les endpoints qui dépendent d'au moins une des sources données."""
+        endpoints = [e for e, deps in self.sources.items() if set(deps) & set(sources)]
+        return sum(self.invalidate(endpoint) for endpoint in endpoints)
+
+    def watermarks_due(self):
+        return time.monotonic() - self.watermark_checked_at >= self.watermark_check_seconds
+
+    def check_watermarks(self, force=False):
+        """
+        Relit la table cache_watermark au plus toutes les watermark_check_seconds secondes
+        et invalide les endpoints dont une source a été modifiée depuis la dernière lecture.
+        """
+        if not force and not self.watermarks_due():
+            return []
+        self.watermark_checked_at = time.monotonic()
+        try:
+            current = self.watermark_reader()
+        except Exception as e:
+            logger.warning(f"⚠️ Lecture des watermarks impossible : {e}")
+            return []
+        previous, self.watermarks = self.watermarks, current
+        if previous is None:
+            return []
+        changed = [source for source, updated_at in current.items() if previous.get(source) != updated_at]
+        if changed:
+            self.invalidate_sources(changed)
+        return changed
+
+    def stats(self):
+        with self.lock:
+            by_endpoint = {endpoint: dict(s) for endpoint, s in self.stats_by_endpoint.items()}
+            entries = len(self.entries)
+        for endpoint, s in by_endpoint.items():
+            total = s["hits"] + s["misses"]
+            s["hit_ratio"] = round(s["hits"] / total, 3) if total else None
+        return {"entries": entries, "max_entries": self.max_entries, "endpoints": by_endpoint}
+
+    def cached(self, endpoint, ttl, sources=("prices",)):
+        """
+        Décorateur d'endpoint : la réponse est mise en cache par paramètres normalisés pendant `ttl` secondes.
+        `sources` : watermarks dont une mise à jour invalide cet endpoint.
+        """
+        self.sources[endpoint] = tuple(sources)
+
+        def store(key, value):
+            if not (isinstance(value, dict) and "error" in value):
+                self.set(endpoint, key, self.freeze(value), ttl)
+            return value
+
+        def decorator(func):
+            if inspect.iscoroutinefunction(func):
+                # Handler async : la relecture des watermarks (I/O Oracle) part dans un thread
+                @functools.wraps(func)
+                async def async_wrapper(*args, **kwargs):
+                    if self.watermarks_due():
+                        await asyncio.get_running_loop().run_in_executor(None, self.check_watermarks)
+                    key = normalize_params(kwargs)
+                    found, value = self.get(endpoint, key)
+                    if found:
+                        return self.thaw(value)
+                    return store(key, await func(*args, **kwargs))
+                return async_wrapper
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                self.check_watermarks()
+                key = normalize_params(kwargs)
+                found, value = self.get(endpoint, key)
+                if found:
+                    return self.thaw(value)
+                return store(key, func(*args, **kwargs))
+            return wrapper
+        return decorator
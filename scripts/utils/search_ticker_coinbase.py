@@ -1,38 +1,121 @@
-import requests
+import json
+import os
+import threading
+import time
+from pathlib import Path
 from scripts.utils.logger import logger
+from scripts.utils.http_client import get_session
+from scripts.utils.coinbase_client import COINBASE_API, coinbase_limiter
 
-COINBASE_API = "https://api.exchange.coinbase.com"
+# Catalogue produits / devises Coinbase, persisté sur disque et rafraîchi après CATALOGUE_TTL secondes
+CATALOGUE_FILE = Path.home() / "market-watcher/data/cache/coinbase_catalogue.json"
+CATALOGUE_TTL = int(os.getenv("COINBASE_CATALOGUE_TTL", 24 * 3600))
+
+class CoinbaseCatalogue:
+    """
+    Index en mémoire des /products (par id) et /currencies (par id) de Coinbase.
+    Deux appels HTTP au plus par période de TTL ; le fichier sur disque évite de refaire ces appels
+    d'un run à l'autre. Si Coinbase ne répond pas, un catalogue périmé est utilisé plutôt que rien.
+    """
+
+    def __init__(self, path=CATALOGUE_FILE, ttl=CATALOGUE_TTL):
+        self.path = Path(path)
+        self.ttl = ttl
+        self.products = None
+        self.currencies = None
+        self.fetched_at = 0.0
+        self.lock = threading.Lock()
+
+    def _fresh(self):
+        return self.products is not None and time.time() - self.fetched_at < self.ttl
+
+    def _index(self, products, currencies, fetched_at):
+        self.products = {
+            p["id"].upper(): {"id": p["id"], "base_currency": p.get("base_currency", ""),
+                              "quote_currency": p.get("quote_currency", "")}
+            for p in products if p.get("id")
+        }
+        self.currencies = {c["id"].upper(): c.get("name", "") for c in currencies if c.get("id")}
+        self.fetched_at = fetched_at
+
+    def _load_file(self):
+        if not self.path.exists():
+            return False
+        try:
+            with open(self.path, "r") as f:
+                raw = json.load(f)
+            self._index(list(raw["products"].values()), [{"id": k, "name": v} for k, v in raw["currencies"].items()],
+                        raw["fetched_at"])
+            return True
+        except Exception as e:
+            logger.warning(f"⚠️ Catalogue Coinbase illisible ({self.path}) : {e}")
+            return False
+
+    def _save_file(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_suffix(".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump({"fetched_at": self.fetched_at, "products": self.products, "currencies": self.currencies}, f)
+        tmp_path.replace(self.path)
+
+    def _fetch(self, name):
+        coinbase_limiter.acquire()
+        resp = get_session().get(f"{COINBASE_API}/{name}", timeout=10)
+        resp.raise_for_status()
+        return resp.json()
+
+    def refresh(self):
+        """Recharge le catalogue depuis Coinbase (2 appels) et le persiste."""
+        products = self._fetch("products")
+        currencies = self._fetch("currencies")
+        self._index(products, currencies, time.time())
+        self._save_file()
+        logger.info(f"📚 Catalogue Coinbase rafraîchi : {len(self.products)} produits, {len(self.currencies)} devises")
+
+    def ensure_loaded(self):
+        with self.lock:
+            if self._fresh():
+                return
+            if self.products is None and self._load_file() and self._fresh():
+                return
+            try:
+                self.refresh()
+            except Exception:
+                if self.products is None:
+                    raise
+                logger.warning("⚠️ Coinbase injoignable, utilisation du catalogue en cache (périmé)")
+
+    def product(self, pair):
+        self.ensure_loaded()
+        return self.products.get(pair.upper())
+
+    def currency_name(self, currency_id):
+        self.ensure_loaded()
+        return self.currencies.get(currency_id.upper())
+
+catalogue = CoinbaseCatalogue()
 
 def search_pair_coinbase(pair: str):
     """
     Vérifie si une paire (ex: BTC-EUR) existe sur Coinbase.
     Retourne (PAIR, NOM_CRYPTO) ou (None, None) si non trouvée.
     """
-    url_products = f"{COINBASE_API}/products"
-    url_currencies = f"{COINBASE_API}/currencies"
     logger.info(f"🔎 Vérification de la paire {pair} sur Coinbase...")
     try:
-        resp = requests.get(url_products, timeout=5)
-        resp.raise_for_status()
-        products = resp.json()
-        for prod in products:
-            if prod.get("id", "").upper() == pair.upper():
-                base = prod.get("base_currency", "")
-                quote = prod.get("quote_currency", "")
-                logger.info(f"✅ Paire trouvée : {prod['id']} ({base}/{quote})")
-                # Cherche le nom officiel de la crypto (base_currency)
-                resp2 = requests.get(url_currencies, timeout=5)
-                resp2.raise_for_status()
-                for cur in resp2.json():
-                    if cur.get("id", "").upper() == base.upper():
-                        name = cur.get("name", "")
-                        logger.info(f"ℹ️ Nom officiel pour {base}: {name}")
-                        return prod["id"], name
-                # Si pas trouvé, retourne juste le code
-                logger.warning(f"Nom officiel non trouvé pour {base}")
-                return prod["id"], base
-        logger.warning(f"❌ Paire {pair} non trouvée sur Coinbase.")
-        return None, None
+        prod = catalogue.product(pair)
+        if prod is None:
+            logger.warning(f"❌ Paire {pair} non trouvée sur Coinbase.")
+            return None, None
+        base = prod["base_currency"]
+        logger.info(f"✅ Paire trouvée : {prod['id']} ({base}/{prod['quote_currency']})")
+        # Nom officiel de la crypto (base_currency)
+        name = catalogue.currency_name(base)
+        if name is not None:
+            logger.info(f"ℹ️ Nom officiel pour {base}: {name}")
+            return prod["id"], name
+        # Si pas trouvé, retourne juste le code
+        logger.warning(f"Nom officiel non trouvé pour {base}")
+        return prod["id"], base
     except Exception as e:
         logger.error(f"Erreur lors de la vérification de la paire {pair} : {e}")
         return None, None
@@ -44,4 +127,4 @@ def search_pair_coinbase(pair: str):
    #     if symbol:
     #        print(f"✅ {pair} trouvé : {symbol} - {name}")
      #   else:
-      #      print(f"❌ {pair} non trouvé sur Coinbase")
\ No newline at end of file
+      #      print(f"❌ {pair} non trouvé sur Coinbase")
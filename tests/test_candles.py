@@ -0,0 +1,33 @@
+from datetime import datetime
+import pytz
+from scripts.utils.candles import CandleBatch
+
+def coinbase_candle(dt, close):
+    return [int(pytz.UTC.localize(dt).timestamp()), close, close, close, close, 1.0]
+
+def test_bind_rows_dst_fall_back_single_row():
+    # 00:00 et 01:00 UTC le 26/10/2025 donnent tous deux 02:00 à Paris
+    batch = CandleBatch.from_coinbase([
+        coinbase_candle(datetime(2025, 10, 26, 1), 2.0),
+        coinbase_candle(datetime(2025, 10, 26, 0), 1.0),
+        coinbase_candle(datetime(2025, 10, 26, 2), 3.0)
+    ])
+    rows = batch.bind_rows(1, asset_id=5)
+    assert [row[:2] for row in rows] == [(5, datetime(2025, 10, 26, 2)), (5, datetime(2025, 10, 26, 3))]
+    assert rows[0][6] == 2.0
+
+def test_bind_rows_keeps_last_duplicate_and_nulls():
+    batch = CandleBatch.concat([
+        CandleBatch.from_coinbase([coinbase_candle(datetime(2025, 1, 15, 9), 1.0)]),
+        CandleBatch.from_coinbase([coinbase_candle(datetime(2025, 1, 15, 9), 4.0)])
+    ])
+    rows = batch.bind_rows(1, asset_id=7)
+    assert len(rows) == 1
+    assert rows[0][:2] == (7, datetime(2025, 1, 15, 10))
+    assert rows[0][6] == 4.0
+    assert rows[0][8:10] == (None, None)
+
+def test_from_eod_dates_without_timezone():
+    rows = CandleBatch.from_eod([{"date": "2024-01-02", "open": 1, "high": 2, "low": 0.5, "close": 1.5,
+                                  "volume": 10}], asset_id=3).bind_rows(4)
+    assert rows == [(3, datetime(2024, 1, 2), None, 1.0, 2.0, 0.5, 1.5, 10.0, 0.0, 1.0, 4)]
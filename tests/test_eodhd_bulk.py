@@ -0,0 +1,78 @@
+from datetime import datetime
+from pathlib import Path
+import pytest
+
+pytest.importorskip("cx_Oracle")
+pytest.importorskip("eodhd")
+import scripts.extraction_eodhd_ as eodhd
+from scripts.utils.eodhd_client import RecordedFetcher
+
+RECORDED = Path(__file__).parent / "fixtures" / "eodhd_recorded"
+
+TARGETS = [
+    (1, "AI.PA", datetime(2025, 3, 13)),     # servi par le fichier bulk
+    (2, "MC.PA", datetime(2025, 3, 14)),     # déjà à jour
+    (3, "OR.PA", datetime(2025, 3, 11)),     # jours ouvrés manquants : repli
+    (4, "CAP.PA", datetime(2025, 3, 12)),    # absent du fichier bulk : repli
+    (5, "AAPL", datetime(2025, 3, 13)),      # sans suffixe de place : repli
+    (6, "SAP.XETRA", datetime(2025, 3, 13))  # pas de bulk_XETRA.json (erreur bulk) : repli
+]
+
+class CountingFetcher(RecordedFetcher):
+    def __init__(self, directory):
+        super().__init__(directory)
+        self.bulk_calls, self.eod_calls = [], []
+
+    def bulk_last_day(self, exchange):
+        self.bulk_calls.append(exchange)
+        return super().bulk_last_day(exchange)
+
+    def eod(self, ticker, from_date=None, to_date=None):
+        self.eod_calls.append(ticker)
+        return super().eod(ticker, from_date=from_date, to_date=to_date)
+
+@pytest.fixture
+def run_bulk(monkeypatch):
+    stored = {}
+    monkeypatch.setattr(eodhd, "get_incremental_targets", lambda: list(TARGETS))
+    monkeypatch.setattr(eodhd, "link_watchlist_asset_ids", lambda targets: None)
+    monkeypatch.setattr(eodhd, "store_extraction",
+                        lambda rows, statuses, label: stored.update(rows=rows, statuses=statuses))
+
+    def run(threshold):
+        fetcher = CountingFetcher(RECORDED)
+        eodhd.bulk_extract_and_insert(fetcher, threshold)
+        dates = {}
+        for row in stored["rows"]:
+            dates.setdefault(row["asset_id"], []).append(row["price_date"].strftime("%Y-%m-%d"))
+        return fetcher, dates, stored["statuses"]
+    return run
+
+def test_bulk_and_fallbacks(run_bulk):
+    fetcher, dates, statuses = run_bulk(threshold=0)
+    assert sorted(fetcher.bulk_calls) == ["PA", "XETRA"]
+    assert sorted(fetcher.eod_calls) == ["AAPL", "CAP.PA", "OR.PA", "SAP.XETRA"]
+    assert dates[1] == ["2025-03-14"]
+    assert 2 not in dates
+    assert dates[3] == ["2025-03-12", "2025-03-13", "2025-03-14"]
+    assert dates[4] == ["2025-03-13", "2025-03-14"]
+    assert dates[5] == ["2025-03-14"]
+    assert dates[6] == ["2025-03-14"]
+    assert statuses == {asset_id: "OK" for asset_id, _, _ in TARGETS}
+
+def test_small_exchanges_skip_bulk(run_bulk):
+    fetcher, dates, statuses = run_bulk(threshold=eodhd.BULK_CALL_COST)
+    assert fetcher.bulk_calls == []
+    assert sorted(fetcher.eod_calls) == ["AAPL", "AI.PA", "CAP.PA", "MC.PA", "OR.PA", "SAP.XETRA"]
+    assert dates[1] == ["2025-03-14"]
+    assert 2 not in dates
+    assert statuses == {asset_id: "OK" for asset_id, _, _ in TARGETS}
+
+def test_split_bulk_rows():
+    tracked = {code: target for code, target in (("AI", TARGETS[0]), ("MC", TARGETS[1]), ("OR", TARGETS[2]),
+                                                 ("CAP", TARGETS[3]))}
+    bulk, _ = RecordedFetcher(RECORDED).bulk_last_day("PA")
+    from_bulk, fallback = eodhd.split_bulk_rows(bulk, tracked)
+    assert from_bulk[1]["close"] == 180.5
+    assert from_bulk[2] is None
+    assert sorted(t[1] for t in fallback) == ["CAP.PA", "OR.PA"]
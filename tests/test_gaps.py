@@ -0,0 +1,65 @@
+from datetime import datetime
+import pytest
+import pytz
+
+pytest.importorskip("cx_Oracle")
+import scripts.extraction_coinbase_histo_ as histo
+from scripts.extraction_coinbase_histo_ import _bucket, _bucket_start, find_gaps
+
+PARIS = pytz.timezone("Europe/Paris")
+
+class FakeCursor:
+    def __init__(self, rows):
+        self.rows = rows
+        self.executed = []
+
+    def execute(self, sql, params=None):
+        self.executed.append((sql, params))
+
+    def fetchall(self):
+        return self.rows
+
+    def close(self):
+        pass
+
+class FakeConn:
+    def __init__(self, rows):
+        self.cur = FakeCursor(rows)
+
+    def cursor(self):
+        return self.cur
+
+def test_spring_forward_hours_are_consecutive_slots():
+    # 30/03/2025 : 02:00 n'existe pas à Paris, 01:00 et 03:00 sont deux heures UTC consécutives
+    assert _bucket(datetime(2025, 3, 30, 3), 3600) == _bucket(datetime(2025, 3, 30, 1), 3600) + 1
+
+def test_six_hour_slots_aligned_on_utc():
+    start = _bucket_start(_bucket(PARIS.localize(datetime(2025, 1, 15, 9)), 21600), 21600)
+    assert start == pytz.UTC.localize(datetime(2025, 1, 15, 6))
+    assert start.tzinfo.zone == "Europe/Paris"
+
+def test_local_daily_slots_keep_stored_date():
+    assert _bucket_start(_bucket(datetime(2025, 1, 13), 86400, None), 86400, None) == datetime(2025, 1, 13)
+
+def test_find_gaps_converts_price_date_to_utc(monkeypatch):
+    monkeypatch.setattr(histo, "number_list", lambda conn, values: values)
+    first = _bucket(datetime(2025, 3, 30, 0), 3600)
+    conn = FakeConn([(5, first + 1, first + 1)])
+    gaps = find_gaps([5], datetime(2025, 3, 30, 0), datetime(2025, 3, 30, 4), conn=conn)
+    sql, params = conn.cur.executed[0]
+    assert "FROM_TZ(CAST(p.price_date AS TIMESTAMP), 'Europe/Paris') AT TIME ZONE 'UTC'" in sql
+    assert params["range_start"] == datetime(2025, 3, 30, 0)
+    assert params["range_end"] == datetime(2025, 3, 30, 5)
+    assert params["last_bucket"] - params["first_bucket"] == 3
+    (start, end, n), = gaps[5]
+    assert start == end == PARIS.localize(datetime(2025, 3, 30, 1)) and n == 1
+
+def test_fall_back_repeated_hour_is_not_a_gap(monkeypatch):
+    # 26/10/2025 : 00:00 et 01:00 UTC donnent 02:00 à Paris, une seule ligne stockée (relue à 01:00 UTC)
+    monkeypatch.setattr(histo, "number_list", lambda conn, values: values)
+    repeated = _bucket(pytz.UTC.localize(datetime(2025, 10, 26, 0)), 3600)
+    conn = FakeConn([(5, repeated, repeated), (6, repeated, repeated + 2)])
+    gaps = find_gaps([5, 6], datetime(2025, 10, 26, 0), datetime(2025, 10, 26, 5), conn=conn)
+    assert 5 not in gaps
+    (start, end, n), = gaps[6]
+    assert start == pytz.UTC.localize(datetime(2025, 10, 26, 1)) and n == 2
@@ -0,0 +1,27 @@
+from datetime import datetime
+import pytest
+import pytz
+
+pytest.importorskip("cx_Oracle")
+from scripts.utils.prices_upsert import _bind_rows
+
+UTC = pytz.UTC
+
+def candle(dt, close):
+    return {"price_date": dt, "open": close, "high": close, "low": close, "close": close, "price_value": close,
+            "volume": 1.0}
+
+def test_bind_rows_naive_paris_dates():
+    rows = _bind_rows([candle(UTC.localize(datetime(2025, 1, 15, 9)), 1.0)], 1, asset_id=5)
+    assert rows[0][1] == datetime(2025, 1, 15, 10)
+    assert rows[0][1].tzinfo is None
+
+def test_bind_rows_dst_fall_back_single_row():
+    # 00:00 et 01:00 UTC le 26/10/2025 donnent tous deux 02:00 à Paris : une seule DATE en base
+    rows = _bind_rows([
+        candle(UTC.localize(datetime(2025, 10, 26, 0)), 1.0),
+        candle(UTC.localize(datetime(2025, 10, 26, 1)), 2.0)
+    ], 1, asset_id=5)
+    assert len(rows) == 1
+    assert rows[0][:2] == (5, datetime(2025, 10, 26, 2))
+    assert rows[0][6] == 2.0
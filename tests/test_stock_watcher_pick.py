@@ -0,0 +1,33 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip("cx_Oracle")
+from scripts.stock_watcher_pick import simulate_panel, simulate_trades
+
+def test_simulate_panel_hand_checked():
+    price = np.array([[10.0], [11.0], [12.0], [9.0], [8.0], [10.0]])
+    signal = np.array([[1], [1], [0], [-1], [-1], [1]], dtype=np.int8)
+    entries, exits, shares, returns = simulate_panel(price, signal, 1000, 0.1)
+    assert entries[:, 0].tolist() == [True, False, False, False, False, True]
+    assert exits[:, 0].tolist() == [False, False, False, True, False, False]
+    assert shares[3, 0] == pytest.approx(10.0)
+    assert returns[3, 0] == pytest.approx(-0.1)
+
+def test_simulate_panel_matches_loop():
+    rng = np.random.default_rng(7)
+    price = rng.uniform(50, 150, size=(300, 4))
+    signal = rng.choice(np.array([-1, 0, 0, 1], dtype=np.int8), size=price.shape)
+    entries, exits, shares, returns = simulate_panel(price, signal, 10000, 0.1)
+    dates = pd.date_range("2024-01-01", periods=len(price))
+    for j in range(price.shape[1]):
+        df = pd.DataFrame({"price_date": dates, "price": price[:, j], "signal": signal[:, j]})
+        expected = simulate_trades(df, 10000, 0.1)
+        rows = np.nonzero(entries[:, j] | exits[:, j])[0]
+        assert len(rows) == len(expected)
+        for t, trade in zip(rows, expected):
+            assert trade["action"] == ("BUY" if entries[t, j] else "SELL")
+            assert trade["date"] == dates[t]
+            assert trade["shares"] == pytest.approx(shares[t, j])
+            if "return" in trade:
+                assert trade["return"] == pytest.approx(returns[t, j])